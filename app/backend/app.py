@@ -1,23 +1,28 @@
 import os
 import io
 import mimetypes
-import time
 import logging
 import openai
 from flask import Flask, request, jsonify, send_file, abort
 from azure.identity import DefaultAzureCredential
 from azure.search.documents import SearchClient
-from approaches.retrievethenread import RetrieveThenReadApproach
-from approaches.readretrieveread import ReadRetrieveReadApproach
-from approaches.readdecomposeask import ReadDecomposeAsk
-from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
 from azure.storage.blob import BlobServiceClient
+from core.localsearch import LocalSearchClient
+from core.modelhelper import num_tokens_from_text
+from core.openaiauth import use_api_key
+from core.retrievalcache import RetrievalCache
+from core.tokenmanager import TokenManager
+from core.toolcache import ToolResultCache
 
 # Replace these with your own values, either in environment variables or directly here
 AZURE_STORAGE_ACCOUNT = os.environ.get("AZURE_STORAGE_ACCOUNT") or "mystorageaccount"
 AZURE_STORAGE_CONTAINER = os.environ.get("AZURE_STORAGE_CONTAINER") or "content"
 AZURE_SEARCH_SERVICE = os.environ.get("AZURE_SEARCH_SERVICE") or "gptkb"
 AZURE_SEARCH_INDEX = os.environ.get("AZURE_SEARCH_INDEX") or "gptkbindex"
+# Serve queries from sections exported with prepdocs --export instead of Cognitive Search, for small corpora
+LOCAL_SEARCH_SECTIONS = os.environ.get("LOCAL_SEARCH_SECTIONS")
+# Answer vector queries over the local sections with the index in this file, built with scripts/buildvectorindex.py
+LOCAL_SEARCH_VECTOR_INDEX = os.environ.get("LOCAL_SEARCH_VECTOR_INDEX")
 AZURE_OPENAI_SERVICE = os.environ.get("AZURE_OPENAI_SERVICE") or "myopenai"
 AZURE_OPENAI_GPT_DEPLOYMENT = os.environ.get("AZURE_OPENAI_GPT_DEPLOYMENT") or "davinci"
 AZURE_OPENAI_CHATGPT_DEPLOYMENT = os.environ.get("AZURE_OPENAI_CHATGPT_DEPLOYMENT") or "chat"
@@ -28,6 +33,26 @@ KB_FIELDS_CONTENT = os.environ.get("KB_FIELDS_CONTENT") or "content"
 KB_FIELDS_CATEGORY = os.environ.get("KB_FIELDS_CATEGORY") or "category"
 KB_FIELDS_SOURCEPAGE = os.environ.get("KB_FIELDS_SOURCEPAGE") or "sourcepage"
 
+# Search results are cached until they expire or prepdocs publishes a new index version, 0 entries disable the cache
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE") or 1000)
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL") or 300)
+
+# Seconds and tokens the agents of the rrr and rda approaches may spend on a request before they have to answer
+AGENT_DEADLINE = float(os.environ.get("AGENT_DEADLINE") or 120)
+AGENT_TOKEN_BUDGET = int(os.environ.get("AGENT_TOKEN_BUDGET") or 20000)
+# The search and lookup results of the rda agents are reused by other requests for this many seconds, 0 disables it
+TOOL_CACHE_TTL = float(os.environ.get("TOOL_CACHE_TTL") or 60)
+
+# Approaches served by /ask and /chat, only these are imported and set up when a worker starts, the agent approaches
+# rrr and rda of /ask need langchain, which takes most of the startup time. Empty to serve none.
+ASK_APPROACHES = [name.strip() for name in os.environ.get("ASK_APPROACHES", "rtr,rrr,rda").split(",") if name.strip()]
+CHAT_APPROACHES = [name.strip() for name in os.environ.get("CHAT_APPROACHES", "rrr").split(",") if name.strip()]
+
+# Tokenizer encodings bundled with the app by scripts/bundletiktoken.py, so that tiktoken does not download them
+TIKTOKEN_BUNDLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiktoken_cache")
+if "TIKTOKEN_CACHE_DIR" not in os.environ and os.path.isdir(TIKTOKEN_BUNDLE):
+    os.environ["TIKTOKEN_CACHE_DIR"] = TIKTOKEN_BUNDLE
+
 # Use the current user identity to authenticate with Azure OpenAI, Cognitive Search and Blob Storage (no secrets needed, 
 # just use 'az login' locally, and managed identity when deployed on Azure). If you need to use keys, use separate AzureKeyCredential instances with the 
 # keys for each service
@@ -39,37 +64,94 @@ openai.api_type = "azure"
 openai.api_base = f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com"
 openai.api_version = "2023-05-15"
 
-# Comment these two lines out if using keys, set your API key in the OPENAI_API_KEY environment variable instead
+# Comment these three lines out if using keys, set your API key in the OPENAI_API_KEY environment variable instead.
+# The token manager has a credential of its own, so that with preload_app the workers do not inherit connections of
+# the credential of the search and storage clients. Every call of the OpenAI SDK is passed its current token.
 openai.api_type = "azure_ad"
-openai_token = azure_credential.get_token("https://cognitiveservices.azure.com/.default")
-openai.api_key = openai_token.token
+openai_token = TokenManager(DefaultAzureCredential(exclude_shared_token_cache_credential = True), "https://cognitiveservices.azure.com/.default").start()
+use_api_key(lambda: openai_token.token)
 
 # Set up clients for Cognitive Search and Storage
-search_client = SearchClient(
-    endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
-    index_name=AZURE_SEARCH_INDEX,
-    credential=azure_credential)
+if LOCAL_SEARCH_SECTIONS:
+    search_client = LocalSearchClient.from_file(LOCAL_SEARCH_SECTIONS, vector_index_path=LOCAL_SEARCH_VECTOR_INDEX)
+else:
+    search_client = SearchClient(
+        endpoint=f"https://{AZURE_SEARCH_SERVICE}.search.windows.net",
+        index_name=AZURE_SEARCH_INDEX,
+        credential=azure_credential)
 blob_client = BlobServiceClient(
     account_url=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net", 
     credential=azure_credential)
 blob_container = blob_client.get_container_client(AZURE_STORAGE_CONTAINER)
 
+def version_container_client():
+    # The index version is polled from a background thread with a client of its own, so that workers forked from a
+    # preloaded app do not share the connections of the thread of the master
+    return BlobServiceClient(
+        account_url=f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net",
+        credential=DefaultAzureCredential(exclude_shared_token_cache_credential = True)).get_container_client(AZURE_STORAGE_CONTAINER)
+
+version_container = version_container_client()
+
+def search_index_version():
+    # Written to the container metadata by prepdocs whenever it changes the index
+    return version_container.get_container_properties().metadata.get("searchindexversion")
+
+retrieval_cache = RetrievalCache(
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL,
+    fields=["id", KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT],
+    version=None if LOCAL_SEARCH_SECTIONS else search_index_version).start() if RETRIEVAL_CACHE_SIZE > 0 else None
+
 # Various approaches to integrate GPT and external knowledge, most applications will use a single one of these patterns
-# or some derivative, here we include several for exploration purposes
-ask_approaches = {
-    "rtr": RetrieveThenReadApproach(search_client, AZURE_OPENAI_CHATGPT_DEPLOYMENT, AZURE_OPENAI_CHATGPT_MODEL, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT),
-    "rrr": ReadRetrieveReadApproach(search_client, AZURE_OPENAI_GPT_DEPLOYMENT, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT),
-    "rda": ReadDecomposeAsk(search_client, AZURE_OPENAI_GPT_DEPLOYMENT, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT)
-}
-
-chat_approaches = {
-    "rrr": ChatReadRetrieveReadApproach(search_client, 
-                                        AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-                                        AZURE_OPENAI_CHATGPT_MODEL, 
-                                        AZURE_OPENAI_EMB_DEPLOYMENT,
-                                        KB_FIELDS_SOURCEPAGE, 
-                                        KB_FIELDS_CONTENT)
-}
+# or some derivative, here we include several for exploration purposes. Each is imported only if it is enabled.
+def create_ask_approach(name):
+    if name == "rtr":
+        from approaches.retrievethenread import RetrieveThenReadApproach
+        return RetrieveThenReadApproach(search_client, AZURE_OPENAI_CHATGPT_DEPLOYMENT, AZURE_OPENAI_CHATGPT_MODEL, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT, retrieval_cache)
+    if name == "rrr":
+        from approaches.readretrieveread import ReadRetrieveReadApproach
+        return ReadRetrieveReadApproach(search_client, AZURE_OPENAI_GPT_DEPLOYMENT, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT, retrieval_cache, AGENT_DEADLINE, AGENT_TOKEN_BUDGET)
+    if name == "rda":
+        from approaches.readdecomposeask import ReadDecomposeAsk
+        return ReadDecomposeAsk(search_client, AZURE_OPENAI_GPT_DEPLOYMENT, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT, retrieval_cache, AGENT_DEADLINE, AGENT_TOKEN_BUDGET,
+                                ToolResultCache(ttl=TOOL_CACHE_TTL) if TOOL_CACHE_TTL > 0 else None)
+    raise ValueError(f"Unknown ask approach {name}")
+
+def create_chat_approach(name):
+    if name == "rrr":
+        from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+        return ChatReadRetrieveReadApproach(search_client, 
+                                            AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+                                            AZURE_OPENAI_CHATGPT_MODEL, 
+                                            AZURE_OPENAI_EMB_DEPLOYMENT,
+                                            KB_FIELDS_SOURCEPAGE, 
+                                            KB_FIELDS_CONTENT,
+                                            retrieval_cache)
+    raise ValueError(f"Unknown chat approach {name}")
+
+ask_approaches = {name: create_ask_approach(name) for name in ASK_APPROACHES}
+chat_approaches = {name: create_chat_approach(name) for name in CHAT_APPROACHES}
+
+# Load the tokenizer of the chat model now rather than on the first request, and with preload_app only once for all workers
+if "rtr" in ask_approaches or chat_approaches:
+    try:
+        num_tokens_from_text("", AZURE_OPENAI_CHATGPT_MODEL)
+    except Exception:
+        logging.warning("Could not load the tokenizer of %s, it is loaded on the first request", AZURE_OPENAI_CHATGPT_MODEL, exc_info=True)
+
+def after_fork():
+    # Called by gunicorn in every worker forked from a preloaded app. Threads do not survive the fork, so the worker
+    # refreshes the token with a thread of its own, and with a credential of its own to not share the connections
+    # of the credential of the master. Its first token is the current one of the master.
+    global version_container
+    if isinstance(globals().get("openai_token"), TokenManager):
+        openai_token.credential = DefaultAzureCredential(exclude_shared_token_cache_credential = True)
+        openai_token.start()
+    # Likewise the poll of the search index version of the retrieval cache
+    version_container = version_container_client()
+    if retrieval_cache is not None:
+        retrieval_cache.start()
 
 app = Flask(__name__)
 
@@ -96,7 +178,6 @@ def content_file(path):
     
 @app.route("/ask", methods=["POST"])
 def ask():
-    ensure_openai_token()
     if not request.json:
         return jsonify({"error": "request must be json"}), 400
     approach = request.json["approach"]
@@ -104,15 +185,15 @@ def ask():
         impl = ask_approaches.get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        r = impl.run(request.json["question"], request.json.get("overrides") or {})
-        return jsonify(r)
+        overrides = request.json.get("overrides") or {}
+        r = impl.run(request.json["question"], overrides)
+        return jsonify(with_trace(r, overrides))
     except Exception as e:
         logging.exception("Exception in /ask")
         return jsonify({"error": str(e)}), 500
     
 @app.route("/chat", methods=["POST"])
 def chat():
-    ensure_openai_token()
     if not request.json:
         return jsonify({"error": "request must be json"}), 400
     approach = request.json["approach"]
@@ -120,17 +201,19 @@ def chat():
         impl = chat_approaches.get(approach)
         if not impl:
             return jsonify({"error": "unknown approach"}), 400
-        r = impl.run(request.json["history"], request.json.get("overrides") or {})
-        return jsonify(r)
+        overrides = request.json.get("overrides") or {}
+        r = impl.run(request.json["history"], overrides)
+        return jsonify(with_trace(r, overrides))
     except Exception as e:
         logging.exception("Exception in /chat")
         return jsonify({"error": str(e)}), 500
 
-def ensure_openai_token():
-    global openai_token
-    if openai_token.expires_on < int(time.time()) - 60:
-        openai_token = azure_credential.get_token("https://cognitiveservices.azure.com/.default")
-        openai.api_key = openai_token.token
-    
+def with_trace(r, overrides):
+    # Only render the thought process into the response when the client asks for it
+    t = r.pop("trace", None)
+    if t is not None:
+        r["thoughts"] = t.to_html() if overrides.get("include_thoughts") else None
+    return r
+
 if __name__ == "__main__":
     app.run()
@@ -1,14 +1,17 @@
-from typing import Any, Sequence
+from typing import Any, Optional, Sequence
 
 import openai
 import tiktoken
 from azure.search.documents import SearchClient
-from azure.search.documents.models import QueryType
 from approaches.approach import Approach
 from text import nonewlines
 
 from core.messagebuilder import MessageBuilder
-from core.modelhelper import get_token_limit
+from core.modelhelper import get_token_limit, num_tokens_from_text
+from core.openaiauth import api_key
+from core.retrieval import Retriever
+from core.sourceselection import SourceSelector
+from core.trace import Trace
 
 class ChatReadRetrieveReadApproach(Approach):
     # Chat roles
@@ -47,7 +50,7 @@ Wenn Sie keine Suchabfrage generieren können, geben Sie nur die Zahl 0 zurück.
         {'role' : ASSISTANT, 'content' : 'Ja, bei unserer ERGO Pferdeversicherung sind auch die Reitbeteiligungen des Versicherungsnehmers abgedeckt'}
     ]
 
-    def __init__(self, search_client: SearchClient, chatgpt_deployment: str, chatgpt_model: str, embedding_deployment: str, sourcepage_field: str, content_field: str):
+    def __init__(self, search_client: SearchClient, chatgpt_deployment: str, chatgpt_model: str, embedding_deployment: str, sourcepage_field: str, content_field: str, retrieval_cache: Optional[Any] = None):
         self.search_client = search_client
         self.chatgpt_deployment = chatgpt_deployment
         self.chatgpt_model = chatgpt_model
@@ -55,14 +58,12 @@ Wenn Sie keine Suchabfrage generieren können, geben Sie nur die Zahl 0 zurück.
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
         self.chatgpt_token_limit = get_token_limit(chatgpt_model)
+        self.retriever = Retriever(search_client, embedding_deployment, sourcepage_field, content_field, query_language="de-de", cache=retrieval_cache)
+        self.source_selector = SourceSelector(lambda text: num_tokens_from_text(text, chatgpt_model))
 
     def run(self, history: Sequence[dict[str, str]], overrides: dict[str, Any]) -> Any:
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
-        has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
-        top = overrides.get("top") or 3
-        exclude_category = overrides.get("exclude_category") or None
-        filter = "category ne '{}'".format(exclude_category.replace("'", "''")) if exclude_category else None
 
         user_q = 'Generate search query for: ' + history[-1]["user"]
 
@@ -82,48 +83,25 @@ Wenn Sie keine Suchabfrage generieren können, geben Sie nur die Zahl 0 zurück.
             messages=messages, 
             temperature=0.0, 
             max_tokens=32, 
-            n=1)
+            n=1,
+            api_key=api_key())
         
         query_text = chat_completion.choices[0].message.content
         if query_text.strip() == "0":
             query_text = history[-1]["user"] # Use the last user input if we failed to generate a better query
 
         # STEP 2: Retrieve relevant documents from the search index with the GPT optimized query
+        r = self.retriever.retrieve(query_text, self.source_selector.retrieval_overrides(overrides))
 
-        # If retrieval mode includes vectors, compute an embedding for the query
-        if has_vector:
-            query_vector = openai.Embedding.create(engine=self.embedding_deployment, input=query_text)["data"][0]["embedding"]
-        else:
-            query_vector = None
-
-         # Only keep the text query if the retrieval mode uses text, otherwise drop it
+        # Only keep the text query if the retrieval mode uses text, for display
         if not has_text:
             query_text = None
 
-        # Use semantic L2 reranker if requested and if retrieval mode is text or hybrid (vectors + text)
-        if overrides.get("semantic_ranker") and has_text:
-            r = self.search_client.search(query_text, 
-                                          filter=filter,
-                                          query_type=QueryType.SEMANTIC, 
-                                          query_language="de-de",
-                                          query_speller="lexicon", 
-                                          semantic_configuration_name="default", 
-                                          top=top, 
-                                          query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None,
-                                          vector_fields="embedding" if query_vector else None)
-        else:
-            r = self.search_client.search(query_text, 
-                                          filter=filter, 
-                                          top=top, 
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None, 
-                                          vector_fields="embedding" if query_vector else None)
         if use_semantic_captions:
             results = [doc[self.sourcepage_field] + ": " + nonewlines(" . ".join([c.text for c in doc['@search.captions']])) for doc in r]
         else:
             results = [doc[self.sourcepage_field] + ": " + nonewlines(doc[self.content_field]) for doc in r]
+        results = self.source_selector.select(r.documents, results, overrides)
         content = "\n".join(results)
 
         follow_up_questions_prompt = self.follow_up_questions_prompt_content if overrides.get("suggest_followup_questions") else ""
@@ -152,13 +130,15 @@ Wenn Sie keine Suchabfrage generieren können, geben Sie nur die Zahl 0 zurück.
             messages=messages, 
             temperature=overrides.get("temperature") or 0.7, 
             max_tokens=1024, 
-            n=1)
+            n=1,
+            api_key=api_key())
 
         chat_content = chat_completion.choices[0].message.content
 
-        msg_to_display = '\n\n'.join([str(message) for message in messages])
-
-        return {"data_points": results, "answer": chat_content, "thoughts": f"Searched for:<br>{query_text}<br><br>Conversations:<br>" + msg_to_display.replace('\n', '<br>')}
+        trace = Trace()
+        trace.section("Searched for", query_text)
+        trace.messages("Conversations", messages)
+        return {"data_points": results, "answer": chat_content, "trace": trace}
     
     def get_messages_from_history(self, system_prompt: str, model_id: str, history: Sequence[dict[str, str]], user_conv: str, few_shots = [], max_tokens: int = 4096) -> []:
         message_builder = MessageBuilder(system_prompt, model_id)
@@ -1,71 +1,75 @@
 import openai
 import re
+import time
+from contextvars import ContextVar
 from approaches.approach import Approach
 from azure.search.documents import SearchClient
 from azure.search.documents.models import QueryType
-from langchain.llms.openai import AzureOpenAI
-from langchain.prompts import PromptTemplate, BasePromptTemplate
+from langchain.prompts import PromptTemplate
 from langchain.callbacks.manager import CallbackManager
-from langchain.agents import Tool, AgentExecutor
+from langchain.chains import LLMChain
+from langchain.agents import Tool
 from langchain.agents.react.base import ReActDocstoreAgent
-from langchainadapters import HtmlCallbackHandler
+from langchainadapters import KeyedAzureOpenAI, RequestCallbackHandler, TraceCallbackHandler
 from text import nonewlines
 from typing import Any, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+
+from core.agentbudget import DEFAULT_DEADLINE, DEFAULT_TOKEN_BUDGET, AgentBudget, BudgetedAgentExecutor
+from core.openaiauth import api_key
+from core.queryplan import INSUFFICIENT, QueryPlan, is_insufficient, parse_plan
+from core.retrieval import Retriever
+from core.toolcache import MISSING, ToolMemo, ToolResultCache, normalize_query
+from core.trace import Trace
 
 class ReadDecomposeAsk(Approach):
-    def __init__(self, search_client: SearchClient, openai_deployment: str, embedding_deployment: str, sourcepage_field: str, content_field: str):
+    def __init__(self, search_client: SearchClient, openai_deployment: str, embedding_deployment: str, sourcepage_field: str, content_field: str, retrieval_cache: Optional[Any] = None,
+                 deadline: float = DEFAULT_DEADLINE, token_budget: int = DEFAULT_TOKEN_BUDGET, tool_cache: Optional[ToolResultCache] = None):
         self.search_client = search_client
         self.openai_deployment = openai_deployment
         self.embedding_deployment = embedding_deployment
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
+        self.retriever = Retriever(search_client, embedding_deployment, sourcepage_field, content_field, cache=retrieval_cache)
+        self.lookup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lookup")
+        self.deadline = deadline
+        self.token_budget = token_budget
+        self.tool_cache = tool_cache
+
+        # The agents are built once per combination of the overrides they depend on, the state of a request is bound
+        # to the tools and callbacks of the agent while it runs
+        self.request_callbacks = RequestCallbackHandler()
+        self.request_overrides: ContextVar[dict[str, Any]] = ContextVar("overrides")
+        self.request_memo: ContextVar[ToolMemo] = ContextVar("memo")
+        cb_manager = CallbackManager(handlers=[self.request_callbacks])
+        self.tools = [
+            Tool(name="Search", func=lambda q: self.search(q, self.request_overrides.get(), self.request_memo.get()), description="useful for when you need to ask with search", callbacks=cb_manager),
+            Tool(name="Lookup", func=lambda q: self.request_memo.get().call("Lookup", q, lambda: self.lookup(q)), description="useful for when you need to ask with lookup", callbacks=cb_manager)
+        ]
+        self.agent_executor = lru_cache(maxsize=32)(self.create_agent_executor)
+
+    def search(self, query_text: str, overrides: dict[str, Any], memo: ToolMemo) -> str:
+        self.results = list(memo.call("Search", query_text, lambda: self.format_results(self.retriever.retrieve(query_text, overrides), overrides),
+                                      self.search_options(overrides)))
+        return "\n".join(self.results)
 
-    def search(self, query_text: str, overrides: dict[str, Any]) -> str:
+    @staticmethod
+    def search_options(overrides: dict[str, Any]) -> tuple:
+        """The overrides that change the formatted results of a search, part of the key of the results in the memo."""
+        return tuple(overrides.get(name) for name in ("retrieval_mode", "semantic_ranker", "semantic_captions", "top", "exclude_category"))
+
+    def format_results(self, documents, overrides: dict[str, Any]) -> list[str]:
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
-        has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
-        top = overrides.get("top") or 3
-        exclude_category = overrides.get("exclude_category") or None
-        filter = "category ne '{}'".format(exclude_category.replace("'", "''")) if exclude_category else None
-
-        # If retrieval mode includes vectors, compute an embedding for the query
-        if has_vector:
-            query_vector = openai.Embedding.create(engine=self.embedding_deployment, input=query_text)["data"][0]["embedding"]
-        else:
-            query_vector = None
-
-        # Only keep the text query if the retrieval mode uses text, otherwise drop it
-        if not has_text:
-            query_text = None
-
-        if overrides.get("semantic_ranker") and has_text:
-            r = self.search_client.search(query_text,
-                                          filter=filter,
-                                          query_type=QueryType.SEMANTIC, 
-                                          query_language="en-us", 
-                                          query_speller="lexicon", 
-                                          semantic_configuration_name="default", 
-                                          top=top,
-                                          query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None, 
-                                          vector_fields="embedding" if query_vector else None)
-        else:
-            r = self.search_client.search(query_text, 
-                                          filter=filter, 
-                                          top=top, 
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None, 
-                                          vector_fields="embedding" if query_vector else None)
         if use_semantic_captions:
-            self.results = [doc[self.sourcepage_field] + ":" + nonewlines(" . ".join([c.text for c in doc['@search.captions'] ])) for doc in r]
-        else:
-            self.results = [doc[self.sourcepage_field] + ":" + nonewlines(doc[self.content_field][:500]) for doc in r]
-        return "\n".join(self.results)
+            return [doc[self.sourcepage_field] + ":" + nonewlines(" . ".join([c.text for c in doc['@search.captions'] ])) for doc in documents]
+        return [doc[self.sourcepage_field] + ":" + nonewlines(doc[self.content_field][:500]) for doc in documents]
 
     def lookup(self, q: str) -> Optional[str]:
         r = self.search_client.search(q,
                                       top = 1,
+                                      select=[self.content_field],
                                       include_total_count=True,
                                       query_type=QueryType.SEMANTIC, 
                                       query_language="en-us", 
@@ -78,44 +82,124 @@ class ReadDecomposeAsk(Approach):
         if answers and len(answers) > 0:
             return answers[0].text
         if r.get_count() > 0:
-            return "\n".join(d['content'] for d in r)
+            return "\n".join(d[self.content_field] for d in r)
         return None
 
     def run(self, q: str, overrides: dict[str, Any]) -> Any:
-        # Not great to keep this as instance state, won't work with interleaving (e.g. if using async), but keeps the example simple
-        self.results = None
+        budget = AgentBudget.for_request(overrides, self.deadline, self.token_budget)
+        trace = Trace()
+        memo = ToolMemo(self.tool_cache, trace)
+        if overrides.get("plan_and_execute"):
+            response = self.plan_and_execute(q, overrides, budget, memo)
+        else:
+            response = self.react(q, overrides, budget, memo)
+        memo.summarize()
+        response["trace"] = trace
+        response["budget"] = budget.report()
+        return response
 
-        # Use to capture thought process during iterations
-        cb_handler = HtmlCallbackHandler()
-        cb_manager = CallbackManager(handlers=[cb_handler])
+    def complete(self, prompt: str, temperature: float, max_tokens: int, budget: AgentBudget, stop: Optional[List[str]] = None) -> str:
+        started = time.monotonic()
+        completion = openai.Completion.create(engine=self.openai_deployment, prompt=prompt, temperature=temperature, max_tokens=max_tokens, n=1, stop=stop,
+                                              request_timeout=max(budget.remaining_time(), 1.0), api_key=api_key())
+        budget.record_llm_call(time.monotonic() - started, completion.get("usage", {}).get("total_tokens", 0))
+        return completion.choices[0].text
 
-        llm = AzureOpenAI(deployment_name=self.openai_deployment, temperature=overrides.get("temperature") or 0.3, openai_api_key=openai.api_key)
-        tools = [
-            Tool(name="Search", func=lambda q: self.search(q, overrides), description="useful for when you need to ask with search", callbacks=cb_manager),
-            Tool(name="Lookup", func=self.lookup, description="useful for when you need to ask with lookup", callbacks=cb_manager)
-        ]
+    def plan_and_execute(self, q: str, overrides: dict[str, Any], budget: AgentBudget, memo: ToolMemo) -> Any:
+        """
+        Answers with one completion to plan all searches and lookups up front, which then run concurrently, and one
+        completion to answer from their observations, instead of one completion and one tool call after the other.
+        Falls back to the ReAct agent when the planner finds that actions depend on each other or the observations
+        do not answer the question.
+        """
+        plan_prompt = PLAN_PROMPT.format(input=q)
+        plan = parse_plan(self.complete(plan_prompt, 0.0, 256, budget, stop=["\nQuestion:"]))
+        trace = memo.trace
+        trace.section("Plan prompt", plan_prompt)
+        trace.section("Plan", plan)
+        if not plan.executable:
+            trace.note("The actions depend on each other, running the ReAct agent")
+            return self.react(q, overrides, budget, memo)
 
-        # Like results above, not great to keep this as a global, will interfere with interleaving
-        global prompt
+        started = time.monotonic()
+        observations, data_points = self.execute(plan, overrides, memo)
+        budget.record_tool_call(time.monotonic() - started)
         prompt_prefix = overrides.get("prompt_template")
-        prompt = PromptTemplate.from_examples(
-            EXAMPLES, SUFFIX, ["input", "agent_scratchpad"], prompt_prefix + "\n\n" + PREFIX if prompt_prefix else PREFIX)
+        answer_prompt = (prompt_prefix + "\n\n" if prompt_prefix else "") + ANSWER_PROMPT.format(observations="\n\n".join(observations), input=q)
+        result = self.complete(answer_prompt, overrides.get("temperature") or 0.3, 1024, budget).strip()
+        trace.section("Answer prompt", answer_prompt)
+        trace.section("Answer", result)
+        if is_insufficient(result):
+            trace.note("The observations do not answer the question, running the ReAct agent")
+            return self.react(q, overrides, budget, memo)
+
+        result = re.sub(r"<([a-zA-Z0-9_ \-\.]+)>", r"[\1]", result)
+        return {"data_points": data_points, "answer": result}
+
+    def execute(self, plan: QueryPlan, overrides: dict[str, Any], memo: ToolMemo) -> tuple[list[str], list[str]]:
+        """
+        Runs the lookups of plan on the lookup executor while its searches run on the retriever, once per normalized
+        query and only if memo does not have their results yet. Returns the observations and data points.
+        """
+        options = self.search_options(overrides)
+        lookups: dict[str, Future] = {}
+        searches: dict[str, Any] = {}
+        queries: dict[str, str] = {}
+        for step in plan.steps:
+            key = normalize_query(step.argument)
+            if step.action == "Lookup" and key not in lookups:
+                lookups[key] = self.lookup_executor.submit(memo.call, "Lookup", step.argument, partial(self.lookup, step.argument))
+            elif step.action == "Search" and key not in searches:
+                searches[key] = memo.get("Search", step.argument, options)
+                if searches[key] is MISSING:
+                    queries[key] = step.argument
+        if queries:
+            for (key, query), retrieval in zip(queries.items(), self.retriever.retrieve_each(list(queries.values()), overrides)):
+                searches[key] = self.format_results(retrieval, overrides)
+                memo.set("Search", query, searches[key], options)
+
+        observations, data_points = [], []
+        for step in plan.steps:
+            key = normalize_query(step.argument)
+            if step.action == "Search":
+                results = searches[key]
+                data_points.extend(result for result in results if result not in data_points)
+                observations.append(f"{step}:\n" + ("\n".join(results) or "No results"))
+            else:
+                observations.append(f"{step}:\n" + (lookups[key].result() or "No results"))
+        return observations, data_points
+
+    def react(self, q: str, overrides: dict[str, Any], budget: AgentBudget, memo: ToolMemo) -> Any:
+        # Not great to keep this as instance state, won't work with interleaving (e.g. if using async), but keeps the example simple
+        self.results = None
+
+        chain = self.agent_executor(overrides.get("prompt_template"), overrides.get("temperature") or 0.3)
 
-        agent = ReAct.from_llm_and_tools(llm, tools)
-        chain = AgentExecutor.from_agent_and_tools(agent, tools, verbose=True, callback_manager=cb_manager)
-        result = chain.run(q)
+        # Use to capture thought process during iterations
+        cb_handler = TraceCallbackHandler(memo.trace)
+        token = self.request_overrides.set(overrides)
+        memo_token = self.request_memo.set(memo)
+        try:
+            with self.request_callbacks.bind(cb_handler):
+                result = chain.run_within(budget, q)
+        finally:
+            self.request_memo.reset(memo_token)
+            self.request_overrides.reset(token)
 
         # Replace substrings of the form <file.ext> with [file.ext] so that the frontend can render them as links, match them with a regex to avoid 
         # generalizing too much and disrupt HTML snippets if present
         result = re.sub(r"<([a-zA-Z0-9_ \-\.]+)>", r"[\1]", result)
 
-        return {"data_points": self.results or [], "answer": result, "thoughts": cb_handler.get_and_reset_log()}
-    
-class ReAct(ReActDocstoreAgent):
-    @classmethod
-    def create_prompt(cls, tools: List[Tool]) -> BasePromptTemplate:
-        return prompt
-    
+        return {"data_points": self.results or [], "answer": result}
+
+    def create_agent_executor(self, prompt_prefix: Optional[str], temperature: float) -> BudgetedAgentExecutor:
+        prompt = PromptTemplate.from_examples(
+            EXAMPLES, SUFFIX, ["input", "agent_scratchpad"], prompt_prefix + "\n\n" + PREFIX if prompt_prefix else PREFIX)
+        # The key is only checked here, every call passes the current one
+        llm = KeyedAzureOpenAI(deployment_name=self.openai_deployment, temperature=temperature, openai_api_key=api_key() or openai.api_key, request_timeout=self.deadline)
+        agent = ReActDocstoreAgent(llm_chain=LLMChain(llm=llm, prompt=prompt), allowed_tools=[tool.name for tool in self.tools])
+        return BudgetedAgentExecutor.from_agent_and_tools(agent, self.tools, verbose=True, callback_manager=CallbackManager(handlers=[self.request_callbacks]))
+
 # Modified version of langchain's ReAct prompt that includes instructions and examples for how to cite information sources
 EXAMPLES = [
     """Question: What is the elevation range for the area that the eastern sector of the
@@ -229,3 +313,34 @@ PREFIX = "Answer questions as shown in the following examples, by splitting the
 "Observations are prefixed by their source name in angled brackets, source names MUST be included with the actions in the answers." \
 "All questions must be answered from the results from search or look up actions, only facts resulting from those can be used in an answer. "
 "Answer questions as truthfully as possible, and ONLY answer the questions using the information from observations, do not speculate or your own knowledge."
+
+PLAN_PROMPT = """Plan the actions needed to answer the question, one per line: Search[query] searches the documents for a topic, Lookup[term] looks up a term. \
+All actions run at the same time and their observations are only seen when answering, so no action can depend on another. \
+Use at most 5 actions. If the question needs an action that can only be written once the observation of another is known, write the actions \
+that do not depend on others and then a last line with the word Sequential.
+
+Question: What profession does Nicholas Ray and Elia Kazan have in common?
+Search[Nicholas Ray]
+Search[Elia Kazan]
+
+Question: What is the elevation range for the area that the eastern sector of the Colorado orogeny extends into?
+Search[Colorado orogeny]
+Lookup[eastern sector]
+Sequential
+
+Question: Which magazine was started first Arthur's Magazine or First for Women?
+Search[Arthur's Magazine]
+Search[First for Women]
+
+Question: {input}
+"""
+ANSWER_PROMPT = """Answer the question using only the observations below, do not speculate or use your own knowledge. \
+Each observation lists results prefixed by their source name and a colon, source names MUST be included in angled brackets after the facts \
+they support, for example "1,800 to 7,000 ft <filea.pdf>". If the observations do not contain the facts needed to answer the question, \
+reply only with the word """ + INSUFFICIENT + """.
+
+Observations:
+{observations}
+
+Question: {input}
+Answer:"""
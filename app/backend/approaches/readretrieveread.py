@@ -1,15 +1,19 @@
 import openai
+from contextvars import ContextVar
+from functools import lru_cache
 from approaches.approach import Approach
 from azure.search.documents import SearchClient
-from azure.search.documents.models import QueryType
-from langchain.llms.openai import AzureOpenAI
 from langchain.callbacks.manager import CallbackManager, Callbacks
 from langchain.chains import LLMChain
-from langchain.agents import Tool, ZeroShotAgent, AgentExecutor
-from langchainadapters import HtmlCallbackHandler
+from langchain.agents import Tool, ZeroShotAgent
+from langchainadapters import KeyedAzureOpenAI, RequestCallbackHandler, TraceCallbackHandler
 from text import nonewlines
 from lookuptool import CsvLookupTool
-from typing import Any
+from core.agentbudget import DEFAULT_DEADLINE, DEFAULT_TOKEN_BUDGET, AgentBudget, BudgetedAgentExecutor
+from core.openaiauth import api_key
+from core.retrieval import Retriever
+from core.trace import Trace
+from typing import Any, Optional
 
 class ReadRetrieveReadApproach(Approach):
     """
@@ -44,51 +48,35 @@ Thought: {agent_scratchpad}"""
 
     CognitiveSearchToolDescription = "useful for searching the Microsoft employee benefits information such as healthcare plans, retirement plans, etc."
 
-    def __init__(self, search_client: SearchClient, openai_deployment: str, embedding_deployment: str, sourcepage_field: str, content_field: str):
+    def __init__(self, search_client: SearchClient, openai_deployment: str, embedding_deployment: str, sourcepage_field: str, content_field: str, retrieval_cache: Optional[Any] = None,
+                 deadline: float = DEFAULT_DEADLINE, token_budget: int = DEFAULT_TOKEN_BUDGET):
         self.search_client = search_client
         self.openai_deployment = openai_deployment
         self.embedding_deployment = embedding_deployment
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
+        self.retriever = Retriever(search_client, embedding_deployment, sourcepage_field, content_field, cache=retrieval_cache)
+        self.deadline = deadline
+        self.token_budget = token_budget
+
+        # The agents are built once per combination of the overrides they depend on, the state of a request is bound
+        # to the tools and callbacks of the agent while it runs
+        self.request_callbacks = RequestCallbackHandler()
+        self.request_overrides: ContextVar[dict[str, Any]] = ContextVar("overrides")
+        cb_manager = CallbackManager(handlers=[self.request_callbacks])
+        acs_tool = Tool(name="CognitiveSearch", 
+                        func=lambda q: self.retrieve(q, self.request_overrides.get()), 
+                        description=self.CognitiveSearchToolDescription,
+                        callbacks=cb_manager)
+        employee_tool = EmployeeInfoTool("Employee1", callbacks=cb_manager)
+        self.tools = [acs_tool, employee_tool]
+        self.agent_executor = lru_cache(maxsize=32)(self.create_agent_executor)
 
     def retrieve(self, query_text: str, overrides: dict[str, Any]) -> Any:
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
-        has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
-        top = overrides.get("top") or 3
-        exclude_category = overrides.get("exclude_category") or None
-        filter = "category ne '{}'".format(exclude_category.replace("'", "''")) if exclude_category else None
 
-        # If retrieval mode includes vectors, compute an embedding for the query
-        if has_vector:
-            query_vector = openai.Embedding.create(engine=self.embedding_deployment, input=query_text)["data"][0]["embedding"]
-        else:
-            query_vector = None
-
-        # Only keep the text query if the retrieval mode uses text, otherwise drop it
-        if not has_text:
-            query_text = None
-
-        # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
-        if overrides.get("semantic_ranker") and has_text:
-            r = self.search_client.search(query_text,
-                                          filter=filter, 
-                                          query_type=QueryType.SEMANTIC, 
-                                          query_language="en-us", 
-                                          query_speller="lexicon", 
-                                          semantic_configuration_name="default", 
-                                          top = top,
-                                          query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None, 
-                                          vector_fields="embedding" if query_vector else None)
-        else:
-            r = self.search_client.search(query_text, 
-                                          filter=filter, 
-                                          top=top, 
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None, 
-                                          vector_fields="embedding" if query_vector else None)
+        r = self.retriever.retrieve(query_text, overrides)
         if use_semantic_captions:
             self.results = [doc[self.sourcepage_field] + ":" + nonewlines(" -.- ".join([c.text for c in doc['@search.captions']])) for doc in r]
         else:
@@ -100,35 +88,41 @@ Thought: {agent_scratchpad}"""
         # Not great to keep this as instance state, won't work with interleaving (e.g. if using async), but keeps the example simple
         self.results = None
 
+        budget = AgentBudget.for_request(overrides, self.deadline, self.token_budget)
+
+        agent_exec = self.agent_executor(overrides.get("prompt_template_prefix") or self.template_prefix,
+                                         overrides.get("prompt_template_suffix") or self.template_suffix,
+                                         overrides.get("temperature") or 0.3)
+
         # Use to capture thought process during iterations
-        cb_handler = HtmlCallbackHandler()
-        cb_manager = CallbackManager(handlers=[cb_handler])
-        
-        acs_tool = Tool(name="CognitiveSearch", 
-                        func=lambda q: self.retrieve(q, overrides), 
-                        description=self.CognitiveSearchToolDescription,
-                        callbacks=cb_manager)
-        employee_tool = EmployeeInfoTool("Employee1", callbacks=cb_manager)
-        tools = [acs_tool, employee_tool]
+        trace = Trace()
+        cb_handler = TraceCallbackHandler(trace)
+        token = self.request_overrides.set(overrides)
+        try:
+            with self.request_callbacks.bind(cb_handler):
+                result = agent_exec.run_within(budget, q)
+        finally:
+            self.request_overrides.reset(token)
+                
+        # Remove references to tool names that might be confused with a citation
+        result = result.replace("[CognitiveSearch]", "").replace("[Employee]", "")
 
+        return {"data_points": self.results or [], "answer": result, "trace": trace, "budget": budget.report()}
+
+    def create_agent_executor(self, prefix: str, suffix: str, temperature: float) -> BudgetedAgentExecutor:
         prompt = ZeroShotAgent.create_prompt(
-            tools=tools,
-            prefix=overrides.get("prompt_template_prefix") or self.template_prefix,
-            suffix=overrides.get("prompt_template_suffix") or self.template_suffix,
+            tools=self.tools,
+            prefix=prefix,
+            suffix=suffix,
             input_variables = ["input", "agent_scratchpad"])
-        llm = AzureOpenAI(deployment_name=self.openai_deployment, temperature=overrides.get("temperature") or 0.3, openai_api_key=openai.api_key)
+        # The key is only checked here, every call passes the current one
+        llm = KeyedAzureOpenAI(deployment_name=self.openai_deployment, temperature=temperature, openai_api_key=api_key() or openai.api_key, request_timeout=self.deadline)
         chain = LLMChain(llm = llm, prompt = prompt)
-        agent_exec = AgentExecutor.from_agent_and_tools(
-            agent = ZeroShotAgent(llm_chain = chain, tools = tools),
-            tools = tools, 
+        return BudgetedAgentExecutor.from_agent_and_tools(
+            agent = ZeroShotAgent(llm_chain = chain, tools = self.tools),
+            tools = self.tools, 
             verbose = True, 
-            callback_manager = cb_manager)
-        result = agent_exec.run(q)
-                
-        # Remove references to tool names that might be confused with a citation
-        result = result.replace("[CognitiveSearch]", "").replace("[Employee]", "")
-
-        return {"data_points": self.results or [], "answer": result, "thoughts": cb_handler.get_and_reset_log()}
+            callback_manager = CallbackManager(handlers=[self.request_callbacks]))
 
 class EmployeeInfoTool(CsvLookupTool):
     employee_name: str = ""
@@ -2,11 +2,15 @@ import openai
 
 from approaches.approach import Approach
 from azure.search.documents import SearchClient
-from azure.search.documents.models import QueryType
 from text import nonewlines
-from typing import Any
+from typing import Any, Optional
 
 from core.messagebuilder import MessageBuilder
+from core.modelhelper import num_tokens_from_text
+from core.openaiauth import api_key
+from core.retrieval import Retriever
+from core.sourceselection import SourceSelector
+from core.trace import Trace
 
 class RetrieveThenReadApproach(Approach):
     """
@@ -35,55 +39,29 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
 """
     answer = "In-network deductibles are $500 for employee and $1000 for family [info1.txt] and Overlake is in-network for the employee plan [info2.pdf][info4.pdf]."
 
-    def __init__(self, search_client: SearchClient, openai_deployment: str, chatgpt_model: str, embedding_deployment: str, sourcepage_field: str, content_field: str):
+    def __init__(self, search_client: SearchClient, openai_deployment: str, chatgpt_model: str, embedding_deployment: str, sourcepage_field: str, content_field: str, retrieval_cache: Optional[Any] = None):
         self.search_client = search_client
         self.openai_deployment = openai_deployment
         self.chatgpt_model = chatgpt_model
         self.embedding_deployment = embedding_deployment
         self.sourcepage_field = sourcepage_field
         self.content_field = content_field
+        self.retriever = Retriever(search_client, embedding_deployment, sourcepage_field, content_field, cache=retrieval_cache)
+        self.source_selector = SourceSelector(lambda text: num_tokens_from_text(text, chatgpt_model))
 
     def run(self, q: str, overrides: dict[str, Any]) -> Any:
         has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
-        has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
         use_semantic_captions = True if overrides.get("semantic_captions") and has_text else False
-        top = overrides.get("top") or 3
-        exclude_category = overrides.get("exclude_category") or None
-        filter = "category ne '{}'".format(exclude_category.replace("'", "''")) if exclude_category else None
 
-        # If retrieval mode includes vectors, compute an embedding for the query
-        if has_vector:
-            query_vector = openai.Embedding.create(engine=self.embedding_deployment, input=q)["data"][0]["embedding"]
-        else:
-            query_vector = None
-
-        # Only keep the text query if the retrieval mode uses text, otherwise drop it
+        # Only keep the text query if the retrieval mode uses text, for display
         query_text = q if has_text else None
 
-        # Use semantic ranker if requested and if retrieval mode is text or hybrid (vectors + text)
-        if overrides.get("semantic_ranker") and has_text:
-            r = self.search_client.search(query_text, 
-                                          filter=filter,
-                                          query_type=QueryType.SEMANTIC, 
-                                          query_language="en-us", 
-                                          query_speller="lexicon", 
-                                          semantic_configuration_name="default", 
-                                          top=top, 
-                                          query_caption="extractive|highlight-false" if use_semantic_captions else None,
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None, 
-                                          vector_fields="embedding" if query_vector else None)
-        else:
-            r = self.search_client.search(query_text, 
-                                          filter=filter, 
-                                          top=top, 
-                                          vector=query_vector, 
-                                          top_k=50 if query_vector else None, 
-                                          vector_fields="embedding" if query_vector else None)
+        r = self.retriever.retrieve(q, self.source_selector.retrieval_overrides(overrides))
         if use_semantic_captions:
             results = [doc[self.sourcepage_field] + ": " + nonewlines(" . ".join([c.text for c in doc['@search.captions']])) for doc in r]
         else:
             results = [doc[self.sourcepage_field] + ": " + nonewlines(doc[self.content_field]) for doc in r]
+        results = self.source_selector.select(r.documents, results, overrides)
         content = "\n".join(results)
 
         message_builder = MessageBuilder(overrides.get("prompt_template") or self.system_chat_template, self.chatgpt_model);
@@ -103,6 +81,10 @@ info4.pdf: In-network institutions include Overlake, Swedish and others in the r
             messages=messages, 
             temperature=overrides.get("temperature") or 0.3, 
             max_tokens=1024, 
-            n=1)
+            n=1,
+            api_key=api_key())
         
-        return {"data_points": results, "answer": chat_completion.choices[0].message.content, "thoughts": f"Question:<br>{query_text}<br><br>Prompt:<br>" + '\n\n'.join([str(message) for message in messages])}
+        trace = Trace()
+        trace.section("Question", query_text)
+        trace.messages("Prompt", messages)
+        return {"data_points": results, "answer": chat_completion.choices[0].message.content, "trace": trace}
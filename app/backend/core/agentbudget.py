@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain.agents import AgentExecutor
+from langchain.callbacks.base import BaseCallbackHandler, BaseCallbackManager
+from langchain.callbacks.manager import CallbackManagerForChainRun, Callbacks
+from langchain.input import get_color_mapping
+from langchain.schema import AgentAction, AgentFinish, LLMResult, OutputParserException
+
+# Completion tokens allowed for every LLM call of the agents, the default of the langchain OpenAI LLMs
+COMPLETION_TOKENS = 256
+DEFAULT_DEADLINE = 120.0
+DEFAULT_TOKEN_BUDGET = 20000
+STOPPED_ANSWER = "I could not find an answer in the time available, please try a more specific question."
+FINAL_ANSWER_PROMPT = "\n\nThere is no time for more actions, I now need to return a final answer based on the previous observations:"
+
+
+@dataclass
+class AgentBudget:
+    """
+    Time and token budget of one request to an agent. The agent keeps taking steps while there is room for another
+    step and a final answer after it, estimated from the slowest and largest LLM calls and the slowest tool call
+    so far, since prompts grow with every observation.
+    """
+    deadline: float
+    token_budget: int
+    completion_tokens: int = COMPLETION_TOKENS
+    clock: Callable[[], float] = time.monotonic
+    started: float = field(init=False)
+    tokens: int = 0
+    llm_calls: int = 0
+    tool_calls: int = 0
+    iterations: int = 0
+    llm_time: float = 0.0
+    tool_time: float = 0.0
+    slowest_llm_call: float = 0.0
+    slowest_tool_call: float = 0.0
+    largest_llm_call: int = 0
+    stopped: Optional[str] = None
+
+    def __post_init__(self):
+        self.started = self.clock()
+
+    @classmethod
+    def for_request(cls, overrides: dict[str, Any], deadline: float = DEFAULT_DEADLINE, token_budget: int = DEFAULT_TOKEN_BUDGET) -> AgentBudget:
+        """The budget of a request, from the "deadline" and "token_budget" overrides, which can only lower the configured limits."""
+        return cls(min(deadline, overrides.get("deadline") or deadline), min(token_budget, overrides.get("token_budget") or token_budget))
+
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    def remaining_time(self) -> float:
+        return self.deadline - self.elapsed()
+
+    def remaining_tokens(self) -> int:
+        return self.token_budget - self.tokens
+
+    def record_llm_call(self, duration: float, tokens: int):
+        self.llm_calls += 1
+        self.llm_time += duration
+        self.tokens += tokens
+        self.slowest_llm_call = max(self.slowest_llm_call, duration)
+        self.largest_llm_call = max(self.largest_llm_call, tokens)
+
+    def record_tool_call(self, duration: float):
+        self.tool_calls += 1
+        self.tool_time += duration
+        self.slowest_tool_call = max(self.slowest_tool_call, duration)
+
+    def can_answer(self) -> bool:
+        """Whether there is room for one more LLM call, to answer."""
+        return self.remaining_time() > self.slowest_llm_call and self.remaining_tokens() >= self.largest_llm_call + self.completion_tokens
+
+    def exhausted(self) -> Optional[str]:
+        """Returns why the agent has to answer now, or None if it can take another step."""
+        if self.remaining_time() <= 2 * self.slowest_llm_call + self.slowest_tool_call:
+            return "deadline"
+        if self.remaining_tokens() < 2 * (self.largest_llm_call + self.completion_tokens):
+            return "tokens"
+        return None
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "deadline": self.deadline,
+            "elapsed": round(self.elapsed(), 3),
+            "token_budget": self.token_budget,
+            "tokens": self.tokens,
+            "llm_calls": self.llm_calls,
+            "tool_calls": self.tool_calls,
+            "iterations": self.iterations,
+            "llm_time": round(self.llm_time, 3),
+            "tool_time": round(self.tool_time, 3),
+            "stopped": self.stopped,
+        }
+
+
+class BudgetCallbackHandler(BaseCallbackHandler):
+    """Records the duration and token usage of the LLM and tool calls of an agent in its budget."""
+
+    def __init__(self, budget: AgentBudget):
+        self.budget = budget
+        self._started: dict[UUID, float] = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.setdefault(run_id, self.budget.clock())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            self.budget.record_llm_call(self.budget.clock() - started, usage.get("total_tokens", 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.setdefault(run_id, self.budget.clock())
+
+    def on_tool_end(self, output: str, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.budget.record_tool_call(self.budget.clock() - started)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+
+
+_budget: ContextVar[AgentBudget] = ContextVar("agent_budget")
+
+
+class BudgetedAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor that stops taking steps when the budget or max_iterations runs out and then asks the agent for a
+    final answer from the observations it already has. max_execution_time is not used, the budget has the deadline.
+    """
+
+    def run_within(self, budget: AgentBudget, input: str, callbacks: Callbacks = None) -> str:
+        """Runs the agent on input within budget. The executor can be shared by requests, each with their own budget."""
+        handlers = list(callbacks.handlers if isinstance(callbacks, BaseCallbackManager) else callbacks or [])
+        token = _budget.set(budget)
+        try:
+            # The callbacks of the executor itself are not passed on to the LLM and tool runs, the ones of the call are
+            return self.run(input, callbacks=handlers + [BudgetCallbackHandler(budget)])
+        finally:
+            _budget.reset(token)
+
+    def _call(self, inputs: Dict[str, str], run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
+        budget = _budget.get()
+        name_to_tool_map = {tool.name: tool for tool in self.tools}
+        color_mapping = get_color_mapping([tool.name for tool in self.tools], excluded_colors=["green", "red"])
+        intermediate_steps: List[Tuple[AgentAction, str]] = []
+        while self.max_iterations is None or budget.iterations < self.max_iterations:
+            budget.stopped = budget.exhausted()
+            if budget.stopped is not None:
+                break
+            next_step_output = self._take_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=run_manager)
+            if isinstance(next_step_output, AgentFinish):
+                return self._return(next_step_output, intermediate_steps, run_manager=run_manager)
+            intermediate_steps.extend(next_step_output)
+            budget.iterations += 1
+            if len(next_step_output) == 1:
+                tool_return = self._get_tool_return(next_step_output[0])
+                if tool_return is not None:
+                    return self._return(tool_return, intermediate_steps, run_manager=run_manager)
+        else:
+            budget.stopped = "iterations"
+        if run_manager:
+            run_manager.on_text(f"Stopped after {budget.iterations} steps, {budget.stopped} budget exhausted", color="red")
+        return self._return(self._final_answer(budget, intermediate_steps, inputs, run_manager), intermediate_steps, run_manager=run_manager)
+
+    def _final_answer(self, budget: AgentBudget, intermediate_steps: List[Tuple[AgentAction, str]], inputs: Dict[str, str],
+                      run_manager: Optional[CallbackManagerForChainRun]) -> AgentFinish:
+        if not budget.can_answer():
+            return AgentFinish({"output": STOPPED_ANSWER}, STOPPED_ANSWER)
+        agent = self.agent
+        thoughts = "".join(f"{action.log}\n{agent.observation_prefix}{observation}\n{agent.llm_prefix}" for action, observation in intermediate_steps)
+        output = agent.llm_chain.predict(callbacks=run_manager.get_child() if run_manager else None,
+                                         **inputs, agent_scratchpad=thoughts + FINAL_ANSWER_PROMPT, stop=agent._stop)
+        try:
+            parsed = agent.output_parser.parse(output)
+        except OutputParserException:
+            parsed = None
+        if isinstance(parsed, AgentFinish):
+            return parsed
+        # Not in the format of a final answer, but still the best answer there is
+        return AgentFinish({"output": output.strip()}, output)
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+from typing import Any, Optional
+
+import numpy as np
+
+MAGIC = b"IVFPQIX1"
+METRICS = ("cosine", "dotProduct", "euclidean")
+
+# Lists probed per query and approximate candidates per requested neighbor that are scored exactly, the
+# recall/latency trade-off of the index, see benchmarks/bench_ann.py
+DEFAULT_NPROBE = 16
+DEFAULT_REFINE = 4
+# Codes per subquantizer, so that a code is a byte
+PQ_CODES = 256
+KMEANS_ITERATIONS = 12
+SUBQUANTIZER_DIMENSIONS = 16
+# Training vectors per inverted list and per subquantizer code
+TRAINING_PER_CENTROID = 48
+CHUNK_SIZE = 4096
+CACHED_SIMILARITIES = 1 << 17
+
+
+def default_nlist(count: int) -> int:
+    """sqrt(count) inverted lists, so that comparing a query to the centroids costs about as much as scanning a list."""
+    return max(1, min(count, int(round(math.sqrt(count)))))
+
+
+def default_subquantizers(dimensions: int) -> int:
+    """The most subquantizers of at least SUBQUANTIZER_DIMENSIONS each that divide dimensions, 96 bytes per vector for 1536."""
+    for subquantizers in range(max(1, dimensions // SUBQUANTIZER_DIMENSIONS), 0, -1):
+        if dimensions % subquantizers == 0:
+            return subquantizers
+    return 1
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """The nearest centroid of every vector, in chunks so that the similarity matrix stays in the CPU cache."""
+    half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    rows = max(256, min(CHUNK_SIZE, CACHED_SIMILARITIES // len(centroids)))
+    for start in range(0, len(vectors), rows):
+        chunk = np.asarray(vectors[start:start + rows], dtype=np.float32)
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T - half_norms, axis=1)
+    return assignment
+
+
+def kmeans(vectors: np.ndarray, k: int, rng: np.random.Generator, iterations: int = KMEANS_ITERATIONS, spherical: bool = False) -> np.ndarray:
+    """
+    Lloyd's k-means of vectors, starting from k of them chosen at random. Empty clusters restart at a random vector.
+    Spherical k-means keeps the centroids of unit vectors unit length, otherwise the shorter centroids of mixed
+    clusters are closer to every vector than the centroids of tight clusters and collect most of them.
+    """
+    centroids = vectors[np.sort(rng.choice(len(vectors), k, replace=False))].astype(np.float32)
+    for _ in range(iterations):
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=k)
+        filled = np.flatnonzero(counts)
+        sums = np.add.reduceat(vectors[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[filled], axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        if spherical:
+            centroids = _normalize(centroids)
+    return centroids
+
+
+class IvfPqIndex:
+    """
+    Approximate nearest neighbor index over vectors with an inverted file of product quantized residuals (Jégou et
+    al., "Product quantization for nearest neighbor search", 2011). Vectors are assigned to the nearest of nlist
+    k-means centroids, and their residual to it is stored as one byte per subquantizer. A query compares itself to
+    the centroids, scores the vectors of the nprobe nearest lists from their codes with one table lookup per byte,
+    and scores the refine * k best of them exactly. nprobe and refine trade latency for recall. Every step is a
+    NumPy array operation, so the work per query grows with nprobe / nlist of the vectors instead of all of them.
+
+    Indexes are built offline with build and save, and loaded memory mapped and read only with load, so processes
+    loading the same file share its pages and the exact vectors are only read from disk for the refined candidates.
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray], metric: str = "cosine", nprobe: int = DEFAULT_NPROBE, refine: int = DEFAULT_REFINE,
+                 metadata: Optional[dict[str, Any]] = None):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric {metric}, expected one of {', '.join(METRICS)}")
+        self.metric = metric
+        self.nprobe = nprobe
+        self.refine = refine
+        self.metadata: dict[str, Any] = dict(metadata or {})
+        self.arrays = arrays
+        # Centroids and codebooks are small and read by every query, the rest is read where queries need it
+        self.centroids = np.asarray(arrays["centroids"], dtype=np.float32)
+        self.codebooks = np.asarray(arrays["codebooks"], dtype=np.float32)
+        self.list_offsets = np.asarray(arrays["list_offsets"])
+        self.list_rows, self.codes, self.sq_norms = arrays["list_rows"], arrays["codes"], arrays["sq_norms"]
+        self.labels, self.vectors = arrays["labels"], arrays["vectors"]
+        self._centroid_half_norms = 0.5 * (self.centroids ** 2).sum(axis=1)
+        self._code_offsets = np.arange(self.codebooks.shape[0]) * self.codebooks.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @property
+    def dimensions(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, labels: Optional[np.ndarray] = None, nlist: Optional[int] = None, subquantizers: Optional[int] = None,
+              metric: str = "cosine", nprobe: int = DEFAULT_NPROBE, refine: int = DEFAULT_REFINE, seed: int = 0) -> IvfPqIndex:
+        """
+        Trains the centroids and subquantizers on a sample of vectors and encodes all of them, in chunks. vectors can
+        be memory mapped, they are neither copied nor reordered.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric {metric}, expected one of {', '.join(METRICS)}")
+        count, dimensions = vectors.shape
+        if count == 0:
+            raise ValueError("Expected at least one vector")
+        nlist = min(nlist or default_nlist(count), count)
+        subquantizers = subquantizers or default_subquantizers(dimensions)
+        if dimensions % subquantizers:
+            raise ValueError(f"{dimensions} dimensions cannot be split into {subquantizers} subquantizers")
+        labels = np.arange(count, dtype=np.int64) if labels is None else np.asarray(labels, dtype=np.int64)
+        if len(labels) != count:
+            raise ValueError("Expected one label per vector")
+        rng = np.random.default_rng(seed)
+        prepare = _normalize if metric == "cosine" else (lambda v: np.asarray(v, dtype=np.float32))
+
+        sample_size = min(count, max(nlist, PQ_CODES) * TRAINING_PER_CENTROID)
+        sample = prepare(vectors[np.sort(rng.choice(count, sample_size, replace=False))])
+        centroids = kmeans(sample, nlist, rng, spherical=metric == "cosine")
+        # The subquantizers need fewer training vectors than the lists when there are more lists than codes
+        sample = sample[:PQ_CODES * TRAINING_PER_CENTROID]
+        residuals = sample - centroids[_assign(sample, centroids)]
+        width = dimensions // subquantizers
+        codes_per_subquantizer = min(PQ_CODES, len(sample))
+        codebooks = np.stack([kmeans(np.ascontiguousarray(residuals[:, j * width:(j + 1) * width]), codes_per_subquantizer, rng) for j in range(subquantizers)])
+
+        assignment = np.empty(count, dtype=np.int64)
+        codes = np.empty((count, subquantizers), dtype=np.uint8)
+        sq_norms = np.empty(count, dtype=np.float32)
+        for start in range(0, count, CHUNK_SIZE):
+            chunk = prepare(vectors[start:start + CHUNK_SIZE])
+            stop = start + len(chunk)
+            assignment[start:stop] = _assign(chunk, centroids)
+            sq_norms[start:stop] = (chunk ** 2).sum(axis=1)
+            residuals = chunk - centroids[assignment[start:stop]]
+            for j in range(subquantizers):
+                codes[start:stop, j] = _assign(residuals[:, j * width:(j + 1) * width], codebooks[j])
+
+        list_rows = np.argsort(assignment, kind="stable")
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+        arrays = {
+            "centroids": centroids, "codebooks": codebooks, "list_offsets": list_offsets, "list_rows": list_rows,
+            "codes": codes[list_rows], "sq_norms": sq_norms[list_rows], "labels": labels, "vectors": vectors,
+        }
+        return cls(arrays, metric, nprobe, refine)
+
+    def _prepare(self, query: np.ndarray) -> np.ndarray:
+        query = np.asarray(query, dtype=np.float32)
+        if query.shape != (self.dimensions,):
+            raise ValueError(f"Expected a single vector with {self.dimensions} dimensions, got shape {query.shape}")
+        return _normalize(query) if self.metric == "cosine" else query
+
+    def _exact(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Distances of query to the vectors of rows, lower is more similar."""
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.metric == "cosine":
+            vectors = _normalize(vectors)
+        if self.metric == "euclidean":
+            return ((vectors - query) ** 2).sum(axis=1)
+        return -(vectors @ query)
+
+    def scores(self, distances: np.ndarray) -> np.ndarray:
+        """Converts distances to the similarity scores of the service, higher is more similar."""
+        if self.metric == "euclidean":
+            return 1 / (1 + np.sqrt(np.maximum(distances, 0)))
+        return -distances
+
+    def search(self, query: np.ndarray, k: int, mask: Optional[np.ndarray] = None, nprobe: Optional[int] = None,
+               refine: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the labels of the k approximate nearest neighbors of query and their scores, best first. mask
+        optionally selects the allowed labels as a boolean array indexed by label. If no more vectors are allowed
+        than would be refined they are compared exactly, and more lists are probed until k allowed vectors are found.
+        """
+        query = self._prepare(query)
+        refined = max(k, k * (refine or self.refine))
+        allowed = None
+        if mask is not None:
+            allowed = np.asarray(mask, dtype=bool)[self.labels]
+            allowed_rows = np.flatnonzero(allowed)
+            if len(allowed_rows) <= refined:
+                return self._best(query, allowed_rows, k)
+
+        centroid_products = self.centroids @ query
+        # Lists are ranked like vectors were assigned to them, by distance to the centroid, except for dot products
+        # where lists of longer vectors may hold the best ones
+        coarse = centroid_products if self.metric == "dotProduct" else centroid_products - self._centroid_half_norms
+        probe = min(nprobe or self.nprobe, self.nlist)
+        # Inner products of the query with every code of every subquantizer, flattened for the lookups by code
+        tables = (self.codebooks @ query.reshape(len(self.codebooks), -1, 1)).ravel()
+        ranked_lists = np.argsort(-coarse, kind="stable")
+        while True:
+            lists = ranked_lists[:probe]
+            starts, stops = self.list_offsets[lists], self.list_offsets[lists + 1]
+            positions = np.concatenate([np.arange(start, stop) for start, stop in zip(starts.tolist(), stops.tolist())] or [np.zeros(0, dtype=np.int64)])
+            rows = np.asarray(self.list_rows[positions])
+            if allowed is not None:
+                keep = allowed[rows]
+                positions, rows = positions[keep], rows[keep]
+            if len(rows) >= k or probe >= self.nlist:
+                break
+            probe = min(2 * probe, self.nlist)
+
+        # Inner products of the query with the centroid plus the quantized residual of every candidate
+        list_of_position = np.repeat(lists, stops - starts)
+        if allowed is not None:
+            list_of_position = list_of_position[keep]
+        products = centroid_products[list_of_position] + np.take(tables, np.asarray(self.codes[positions], dtype=np.int64) + self._code_offsets).sum(axis=1)
+        approximate = np.asarray(self.sq_norms[positions]) - 2 * products if self.metric == "euclidean" else -products
+        if len(rows) > refined:
+            rows = rows[np.argpartition(approximate, refined - 1)[:refined]]
+        return self._best(query, rows, k)
+
+    def _best(self, query: np.ndarray, rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # Sorted rows read the memory mapped vectors in file order
+        rows = np.sort(rows)
+        distances = self._exact(query, rows)
+        order = np.argsort(distances, kind="stable")[:k]
+        return np.asarray(self.labels[rows[order]]), self.scores(distances[order])
+
+    def save(self, path: str):
+        """Writes the index to path, replacing it atomically so that processes loading it never see a partial file."""
+        header: dict[str, Any] = {"metric": self.metric, "nprobe": self.nprobe, "refine": self.refine, "metadata": self.metadata}
+        # Place every array at a 64 byte aligned offset after the header, leaving more room if the header needs it
+        data_start = 4096
+        while True:
+            header["arrays"], offset = {}, data_start
+            for name, array in self.arrays.items():
+                dtype = np.dtype(np.float32) if name == "vectors" else array.dtype
+                header["arrays"][name] = {"offset": offset, "dtype": dtype.str, "shape": list(array.shape)}
+                offset += -(-math.prod(array.shape) * dtype.itemsize // 64) * 64
+            encoded = json.dumps(header).encode("utf-8")
+            if len(MAGIC) + 8 + len(encoded) <= data_start:
+                break
+            data_start *= 2
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(encoded).to_bytes(8, "little"))
+            f.write(encoded)
+            for name, array in self.arrays.items():
+                f.seek(header["arrays"][name]["offset"])
+                # In chunks, the vectors may be a memory mapped file larger than memory
+                for start in range(0, max(len(array), 1), CHUNK_SIZE * 16):
+                    chunk = np.asarray(array[start:start + CHUNK_SIZE * 16], dtype=np.float32 if name == "vectors" else array.dtype)
+                    f.write(np.ascontiguousarray(chunk).tobytes())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> IvfPqIndex:
+        """Maps an index written by save into memory, read only. Pages are only read from disk when a search needs them."""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an IVF-PQ index file")
+            header = json.loads(f.read(int.from_bytes(f.read(8), "little")))
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if math.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+            else:
+                arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", offset=spec["offset"], shape=shape)
+        return cls(arrays, header["metric"], header["nprobe"], header["refine"], header["metadata"])
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
@@ -0,0 +1,368 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from typing import IO, Any, Hashable, Iterable, Iterator, Optional
+
+import numpy as np
+
+from .ivfpq import IvfPqIndex
+
+# Format of the files written by prepdocs --export, see scripts/prepdocslib/sectionfile.py
+SECTIONS_FORMAT_NAME = "prepdocs-sections"
+SECTIONS_FORMAT_VERSION = 1
+
+# Defaults of the service: the page size without top, the k of reciprocal rank fusion and the number of text
+# results that are fused with the vector results in hybrid queries
+DEFAULT_TOP = 50
+RRF_K = 60
+HYBRID_TEXT_CANDIDATES = 50
+
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?]*")
+_FILTER_CLAUSE_RE = re.compile(r"\s*(\w+) (eq|ne) '((?:[^']|'')*)'\s*")
+
+GERMAN_STOPWORDS = frozenset("""
+aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes anderm andern anderr
+anders auch auf aus bei bin bis bist da damit dann das dass daß dasselbe dazu dein deine deinem deinen deiner deines
+dem demselben den denn denselben der derer derselbe derselben des desselben dessen dich die dies diese dieselbe
+dieselben diesem diesen dieser dieses dir doch dort du durch ein eine einem einen einer eines einig einige einigem
+einigen einiger einiges einmal er es etwas euch euer eure eurem euren eurer eures für gegen gewesen hab habe haben
+hat hatte hatten hier hin hinter ich ihm ihn ihnen ihr ihre ihrem ihren ihrer ihres im in indem ins ist jede jedem
+jeden jeder jedes jene jenem jenen jener jenes jetzt kann kein keine keinem keinen keiner keines können könnte machen
+man manche manchem manchen mancher manches mein meine meinem meinen meiner meines mich mir mit muss musste nach
+nicht nichts noch nun nur ob oder ohne sehr sein seine seinem seinen seiner seines selbst sich sie sind so solche
+solchem solchen solcher solches soll sollte sondern sonst über um und uns unsere unserem unseren unser unseres unter
+viel vom von vor während war waren warst was weg weil weiter welche welchem welchen welcher welches wenn werde
+werden wie wieder will wir wird wirst wo wollen wollte würde würden zu zum zur zwar zwischen
+""".split())
+
+_UMLAUTS = str.maketrans({"ä": "a", "ö": "o", "ü": "u", "à": "a", "á": "a", "â": "a", "é": "e", "è": "e", "ê": "e", "í": "i", "ì": "i", "î": "i", "ó": "o", "ò": "o", "ô": "o", "ú": "u", "ù": "u", "û": "u"})
+
+
+def _valid_s_ending(c: str) -> bool:
+    return c in "bdfghklmnrt"
+
+
+def _valid_st_ending(c: str) -> bool:
+    return c in "bdfghklmnt"
+
+
+def german_stem(word: str) -> str:
+    """Light stemming of a lower case German word after Savoy, the stemmer of the de.lucene analyzer."""
+    word = word.replace("ß", "ss").translate(_UMLAUTS)
+    n = len(word)
+    if n > 5 and word.endswith("ern"):
+        n -= 3
+    elif n > 4 and word[n - 2:n] in ("em", "en", "er", "es"):
+        n -= 2
+    elif n > 3 and word[n - 1] == "e":
+        n -= 1
+    elif n > 3 and word[n - 1] == "s" and _valid_s_ending(word[n - 2]):
+        n -= 1
+    if n > 5 and word[n - 3:n] == "est":
+        n -= 3
+    elif n > 4 and word[n - 2:n] in ("er", "en"):
+        n -= 2
+    elif n > 4 and word[n - 2:n] == "st" and _valid_st_ending(word[n - 3]):
+        n -= 2
+    return word[:n]
+
+
+def analyze(text: str) -> list[str]:
+    """Splits text into lower case words and drops German stop words and stems the rest, like the de.lucene analyzer."""
+    return [german_stem(word) for word in _WORD_RE.findall(text.lower()) if word not in GERMAN_STOPWORDS]
+
+
+class Caption:
+    """Extractive caption of a search result, with the text and highlights attributes of the service's captions."""
+
+    def __init__(self, text: str, highlights: Optional[str] = None):
+        self.text = text
+        self.highlights = highlights
+
+    def __repr__(self) -> str:
+        return f"Caption({self.text!r})"
+
+
+class LocalSearchResults:
+    """The results of a LocalSearchClient query, iterable like the SearchItemPaged returned by the service."""
+
+    def __init__(self, documents: list[dict[str, Any]], count: Optional[int]):
+        self._documents = documents
+        self._count = count
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return iter(self._documents)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def get_count(self) -> Optional[int]:
+        return self._count
+
+    def get_answers(self) -> Optional[list[Any]]:
+        # Semantic answers need the semantic ranker of the service
+        return None
+
+    def get_facets(self) -> Optional[dict[str, Any]]:
+        return None
+
+
+class LocalSearchClient:
+    """
+    In-memory search engine with the search() call surface of azure.search.documents.SearchClient as used by the
+    approaches, for small corpora, tests and offline development. Text queries are ranked with BM25 over the content
+    field analyzed like German text, vector queries with the cosine similarity to the embedding field, and hybrid
+    queries fuse both rankings with reciprocal rank fusion like the service. Filters support "field eq/ne 'value'"
+    clauses joined with "and". Semantic ranking and answers are not available, semantic queries are ranked like
+    simple ones and captions are the sentences of the content that match the most query terms. Vector queries
+    compare the query to every embedding unless a vector_index is given, which answers them approximately in
+    sublinear time and holds the embeddings instead, so they are not kept in memory twice.
+    """
+
+    def __init__(self, documents: Iterable[dict[str, Any]], key_field: str = "id", content_field: str = "content", vector_field: str = "embedding",
+                 k1: float = 1.2, b: float = 0.75, vector_index: Optional[IvfPqIndex] = None):
+        self.key_field = key_field
+        self.content_field = content_field
+        self.vector_field = vector_field
+        self.k1 = k1
+        self.b = b
+        self.documents: list[dict[str, Any]] = []
+        vectors: list[Optional[np.ndarray]] = []
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        lengths: list[int] = []
+        for document in documents:
+            document = dict(document)
+            vector = document.pop(vector_field, None)
+            vectors.append(None if vector is None or vector_index is not None else np.asarray(vector, dtype=np.float32))
+            terms = analyze(document.get(content_field) or "")
+            for term, tf in Counter(terms).items():
+                doc_ids, tfs = postings.setdefault(term, ([], []))
+                doc_ids.append(len(self.documents))
+                tfs.append(tf)
+            lengths.append(len(terms))
+            self.documents.append(document)
+        self._postings = {term: (np.array(doc_ids, dtype=np.int64), np.array(tfs, dtype=np.float32)) for term, (doc_ids, tfs) in postings.items()}
+        self._lengths = np.array(lengths, dtype=np.float32)
+        self._avg_length = float(self._lengths.mean()) if lengths and self._lengths.mean() > 0 else 1.0
+        self._keys = {document[key_field]: i for i, document in enumerate(self.documents)}
+        self._field_values: dict[str, np.ndarray] = {}
+        self.vector_index: Optional[IvfPqIndex] = None
+        self._index_rows: Optional[np.ndarray] = None
+
+        # Unit length embeddings in one matrix so that a query is a single matrix vector product
+        dimensions = next((len(v) for v in vectors if v is not None), 0)
+        self._vectors: Optional[np.ndarray] = np.zeros((len(self.documents), dimensions), dtype=np.float32)
+        self._has_vector = np.zeros(len(self.documents), dtype=bool)
+        for i, vector in enumerate(vectors):
+            if vector is not None and len(vector) == dimensions:
+                norm = np.linalg.norm(vector)
+                self._vectors[i] = vector / norm if norm else vector
+                self._has_vector[i] = True
+        if vector_index is not None:
+            self.use_vector_index(vector_index)
+
+    @classmethod
+    def from_file(cls, path: str, vector_index_path: Optional[str] = None, **kwargs: Any) -> LocalSearchClient:
+        """
+        Loads the sections written by prepdocs --export, gzip compressed if the path ends with .gz. With
+        vector_index_path, vector queries use the IVF-PQ index in that file, which scripts/buildvectorindex.py builds
+        from the same sections. Building it takes minutes for large corpora, so a missing index or one that belongs
+        to other sections is an error instead of being rebuilt here.
+        """
+        if not vector_index_path:
+            return cls(read_sections_file(path), **kwargs)
+        if not os.path.exists(vector_index_path):
+            raise FileNotFoundError(f"Vector index {vector_index_path} does not exist, build it with scripts/buildvectorindex.py {path} {vector_index_path}")
+        vector_index = IvfPqIndex.load(vector_index_path)
+        client = cls(read_sections_file(path, include_embeddings=False), vector_index=vector_index, **kwargs)
+        if vector_index.metadata.get("keys") != client.keys_digest():
+            raise ValueError(f"Vector index {vector_index_path} belongs to other sections than {path}, rebuild it with scripts/buildvectorindex.py {path} {vector_index_path}")
+        return client
+
+    def keys_digest(self) -> str:
+        """Identifies the documents and their order, to check that a saved vector index belongs to them."""
+        digest = hashlib.sha256()
+        for document in self.documents:
+            digest.update(str(document[self.key_field]).encode("utf-8") + b"\0")
+        return digest.hexdigest()
+
+    def build_vector_index(self, **parameters: Any) -> IvfPqIndex:
+        """Builds an IVF-PQ index over the embeddings with IvfPqIndex.build parameters and answers vector queries with it."""
+        if self._vectors is None:
+            raise ValueError("The embeddings are only held by the current vector index")
+        labels = np.flatnonzero(self._has_vector)
+        vector_index = IvfPqIndex.build(self._vectors[labels], labels, **parameters)
+        vector_index.metadata["keys"] = self.keys_digest()
+        self.use_vector_index(vector_index)
+        return vector_index
+
+    def use_vector_index(self, vector_index: IvfPqIndex):
+        labels = np.asarray(vector_index.labels)
+        if len(labels) and labels.max() >= len(self.documents):
+            raise ValueError("The vector index has labels of documents that do not exist")
+        self.vector_index = vector_index
+        self._vectors = None
+        self._has_vector = np.zeros(len(self.documents), dtype=bool)
+        self._has_vector[labels] = True
+        self._index_rows = np.full(len(self.documents), -1, dtype=np.int64)
+        self._index_rows[labels] = np.arange(len(labels))
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def get_document(self, key: str, selected_fields: Optional[list[str]] = None, **kwargs: Any) -> dict[str, Any]:
+        if key not in self._keys:
+            raise KeyError(key)
+        return self._result(self._keys[key], selected_fields)
+
+    def search(self, search_text: Optional[str], filter: Optional[str] = None, select: Optional[list[str]] = None, top: Optional[int] = None,
+               skip: Optional[int] = None, include_total_count: bool = False, vector: Optional[list[float]] = None, top_k: Optional[int] = None,
+               vector_fields: Optional[str] = None, query_caption: Optional[str] = None, **kwargs: Any) -> LocalSearchResults:
+        mask = self._filter_mask(filter)
+        has_text = bool(search_text and search_text.strip() and search_text.strip() != "*")
+        rankings = []
+        if has_text:
+            text_ranking = self._text_ranking(search_text, mask)
+            rankings.append(text_ranking[:HYBRID_TEXT_CANDIDATES] if vector is not None else text_ranking)
+        if vector is not None:
+            if vector_fields and vector_fields != self.vector_field:
+                raise ValueError(f"Unknown vector field: {vector_fields}")
+            rankings.append(self._vector_ranking(vector, top_k or DEFAULT_TOP, mask))
+        if not rankings:
+            # Without a query all documents that pass the filter match, in index order
+            ranking = [(int(i), 1.0) for i in np.flatnonzero(mask)]
+        elif len(rankings) == 1:
+            ranking = rankings[0]
+        else:
+            ranking = reciprocal_rank_fusion(rankings)
+
+        start = skip or 0
+        page = ranking[start:start + (DEFAULT_TOP if top is None else top)]
+        query_terms = set(analyze(search_text)) if has_text and query_caption else None
+        results = []
+        for i, score in page:
+            result = self._result(i, select)
+            result["@search.score"] = score
+            result["@search.reranker_score"] = None
+            result["@search.highlights"] = None
+            result["@search.captions"] = self._captions(i, query_terms) if query_terms is not None else None
+            results.append(result)
+        return LocalSearchResults(results, len(ranking) if include_total_count else None)
+
+    def _result(self, i: int, select: Optional[list[str]]) -> dict[str, Any]:
+        document = self.documents[i]
+        result = {k: v for k, v in document.items() if not select or k in select}
+        if self._has_vector[i] and (not select or self.vector_field in select):
+            vector = self._vectors[i] if self.vector_index is None else self.vector_index.vectors[self._index_rows[i]]
+            result[self.vector_field] = vector.tolist()
+        return result
+
+    def _text_ranking(self, search_text: str, mask: np.ndarray) -> list[tuple[int, float]]:
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        matched = np.zeros(len(self.documents), dtype=bool)
+        n = len(self.documents)
+        for term in set(analyze(search_text)):
+            if term not in self._postings:
+                continue
+            doc_ids, tfs = self._postings[term]
+            idf = np.log(1 + (n - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norms = self.k1 * (1 - self.b + self.b * self._lengths[doc_ids] / self._avg_length)
+            scores[doc_ids] += idf * tfs * (self.k1 + 1) / (tfs + norms)
+            matched[doc_ids] = True
+        candidates = np.flatnonzero(matched & mask)
+        # Stable sort so that equally scored documents keep their index order
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), float(scores[i])) for i in order]
+
+    def _vector_ranking(self, vector: list[float], k: int, mask: np.ndarray) -> list[tuple[int, float]]:
+        if self.vector_index is not None:
+            labels, scores = self.vector_index.search(vector, k, mask=None if mask.all() else mask)
+            return list(zip(labels.tolist(), scores.tolist()))
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape != (self._vectors.shape[1],):
+            raise ValueError(f"Expected a vector with {self._vectors.shape[1]} dimensions, got {query.shape[0]}")
+        norm = np.linalg.norm(query)
+        similarities = self._vectors @ (query / norm if norm else query)
+        candidates = np.flatnonzero(mask & self._has_vector)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-similarities[candidates], k - 1)[:k]]
+        order = candidates[np.argsort(-similarities[candidates], kind="stable")]
+        return [(int(i), float(similarities[i])) for i in order]
+
+    def _filter_mask(self, filter: Optional[str]) -> np.ndarray:
+        mask = np.ones(len(self.documents), dtype=bool)
+        if not filter:
+            return mask
+        for clause in filter.split(" and "):
+            match = _FILTER_CLAUSE_RE.fullmatch(clause)
+            if not match:
+                raise ValueError(f"Unsupported filter: {filter}")
+            field_name, op, value = match.group(1), match.group(2), match.group(3).replace("''", "'")
+            equal = self._values(field_name) == value
+            mask &= equal if op == "eq" else ~equal
+        return mask
+
+    def _values(self, field_name: str) -> np.ndarray:
+        if field_name not in self._field_values:
+            values = np.empty(len(self.documents), dtype=object)
+            values[:] = [document.get(field_name) for document in self.documents]
+            self._field_values[field_name] = values
+        return self._field_values[field_name]
+
+    def _captions(self, i: int, query_terms: set[str]) -> list[Caption]:
+        sentences = [s.strip() for s in _SENTENCE_RE.findall(self.documents[i].get(self.content_field) or "") if s.strip()]
+        if not sentences:
+            return []
+        best = max(sentences, key=lambda sentence: len(query_terms.intersection(analyze(sentence))))
+        return [Caption(best)]
+
+
+def reciprocal_rank_fusion(rankings: list[list[tuple[Hashable, float]]], k: int = RRF_K) -> list[tuple[Hashable, float]]:
+    """Fuses rankings by summing 1 / (k + rank) of every document over the rankings it appears in."""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (i, _) in enumerate(ranking, 1):
+            scores[i] = scores.get(i, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def _open(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def read_sections_file(path: str, include_embeddings: bool = True) -> Iterator[dict[str, Any]]:
+    """
+    Returns the sections of a file written by prepdocs --export with decoded embeddings, after applying the merge
+    records that link the source pages of duplicates to their sections.
+    """
+    merges = []
+    sections: dict[str, dict[str, Any]] = {}
+    with _open(path) as f:
+        header = json.loads(f.readline() or "null")
+        if not header or header.get("format") != SECTIONS_FORMAT_NAME:
+            raise ValueError(f"{path} is not a {SECTIONS_FORMAT_NAME} file")
+        if header.get("version", 0) > SECTIONS_FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['version']}, only versions up to {SECTIONS_FORMAT_VERSION} are supported")
+        for line in f:
+            section = json.loads(line)
+            if section.pop("@search.action", None) == "merge":
+                merges.append(section)
+                continue
+            if not include_embeddings:
+                section.pop("embedding", None)
+            elif section.get("embedding") is not None:
+                section["embedding"] = np.frombuffer(base64.b64decode(section["embedding"]), dtype="<f4")
+            sections[section["id"]] = section
+    for merge in merges:
+        if merge["id"] in sections:
+            sections[merge["id"]].update(merge)
+    return iter(sections.values())
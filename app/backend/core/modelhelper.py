@@ -44,6 +44,12 @@ def num_tokens_from_messages(message: dict[str, str], model: str) -> int:
     return num_tokens
 
 
+def num_tokens_from_text(text: str, model: str) -> int:
+    """Calculate the number of tokens of text for the ChatGPT model."""
+    encoding = tiktoken.encoding_for_model(get_oai_chatmodel_tiktok(model))
+    return len(encoding.encode(text))
+
+
 def get_oai_chatmodel_tiktok(aoaimodel: str) -> str:
     message = "Expected Azure OpenAI ChatGPT model name"
     if aoaimodel == "" or aoaimodel is None:
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+# Returns the key or Azure AD token of the next call of the OpenAI SDK. Every call passes it as api_key rather than
+# going through the global openai.api_key, which langchain overwrites whenever it creates an LLM.
+_api_key: Optional[Callable[[], str]] = None
+
+
+def use_api_key(provider: Optional[Callable[[], str]]):
+    global _api_key
+    _api_key = provider
+
+
+def api_key() -> Optional[str]:
+    """The key of the next call, or None for the SDK to use openai.api_key, as when it is set with OPENAI_API_KEY."""
+    return _api_key() if _api_key is not None else None
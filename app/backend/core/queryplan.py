@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+
+ACTIONS = ("Search", "Lookup")
+SEQUENTIAL = "Sequential"
+# Reply of the answer completion when the observations of a plan do not answer the question
+INSUFFICIENT = "INSUFFICIENT"
+
+_STEP_RE = re.compile(r"^\s*(?:[-*]|\d+[.)])?\s*(?:Action:\s*)?(" + "|".join(ACTIONS) + r")\s*\[(.+)\]\s*$", re.IGNORECASE)
+
+
+@dataclass
+class PlanStep:
+    action: str
+    argument: str
+
+    def __str__(self) -> str:
+        return f"{self.action}[{self.argument}]"
+
+
+@dataclass
+class QueryPlan:
+    """
+    The actions planned up front to answer a question. A plan is sequential when the planner found that some
+    action can only be decided from the observation of another, which the actions of a plan cannot depend on
+    since they all run at the same time.
+    """
+    steps: list[PlanStep] = field(default_factory=list)
+    sequential: bool = False
+
+    @property
+    def executable(self) -> bool:
+        return bool(self.steps) and not self.sequential
+
+    def __str__(self) -> str:
+        return "\n".join([str(step) for step in self.steps] + ([SEQUENTIAL] if self.sequential else []))
+
+
+def parse_plan(text: str, max_steps: int = 5) -> QueryPlan:
+    """
+    Parses a plan written as one Search[query] or Lookup[term] action per line, optionally numbered, and a
+    Sequential line if the plan cannot be executed up front. Other lines are ignored, and so are repeated actions
+    and actions beyond max_steps.
+    """
+    plan = QueryPlan()
+    for line in text.splitlines():
+        if line.strip().rstrip(".").lower() == SEQUENTIAL.lower():
+            plan.sequential = True
+            continue
+        match = _STEP_RE.match(line)
+        if match is None:
+            continue
+        step = PlanStep(match.group(1).capitalize(), match.group(2).strip())
+        if step.argument and step not in plan.steps and len(plan.steps) < max_steps:
+            plan.steps.append(step)
+    return plan
+
+
+def is_insufficient(answer: str) -> bool:
+    return answer.strip().strip(".").upper().startswith(INSUFFICIENT)
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit
+
+import requests
+from azure.core.pipeline.transport import HttpTransport, RequestsTransport, RequestsTransportResponse
+from requests.adapters import HTTPAdapter
+
+# Response headers kept in recordings, the others only describe the service that sent them
+KEPT_HEADERS = ("Content-Type", "Retry-After")
+
+
+class ReplayMissError(LookupError):
+    """A request to replay that was not recorded."""
+
+
+def _body_bytes(body: Any) -> bytes:
+    if body is None:
+        return b""
+    return body if isinstance(body, bytes) else str(body).encode("utf-8")
+
+
+def _canonical(body: bytes) -> bytes:
+    # Requests with the same JSON in a different key order or formatting are the same request
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        return body
+
+
+class Recording:
+    """
+    HTTP requests of the OpenAI SDK and the Azure SDK with their responses, stored in a JSON lines file, gzipped when
+    its name ends in .gz. A request is identified by its method, its path and query, which leave out the host so that
+    a recording of one service replays for another, and a hash of its body. Request headers and bodies are not
+    stored, only the status, the KEPT_HEADERS, the body and the seconds taken of each response.
+
+    In "record" mode requests are sent and recorded, save writes the recording. In "replay" mode they are answered
+    from the recording after the recorded time scaled by latency_scale, 0 to answer right away. A request made more
+    often than it was recorded gets the recorded responses again in order, an unrecorded one raises ReplayMissError.
+    """
+
+    def __init__(self, path: Optional[str] = None, mode: str = "replay", latency_scale: float = 0.0, sleep: Callable[[float], None] = time.sleep):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown recording mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.sleep = sleep
+        self.entries: list[dict[str, Any]] = []
+        self.replayed = 0
+        self._replays: dict[str, list[dict[str, Any]]] = {}
+        self._positions: dict[str, int] = {}
+        self._lock = threading.Lock()
+        if mode == "replay" and path is not None:
+            self.load(path)
+
+    @staticmethod
+    def key(method: str, url: str, body: Any) -> str:
+        parts = urlsplit(url)
+        target = parts.path + ("?" + parts.query if parts.query else "")
+        digest = hashlib.sha1(_canonical(_body_bytes(body))).hexdigest()[:16]
+        return f"{method.upper()} {target} {digest}"
+
+    def load(self, path: str):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self.add(json.loads(line))
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        opener = gzip.open if path.endswith(".gz") else open
+        with self._lock:
+            entries = list(self.entries)
+        with opener(path, "wt", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n")
+
+    def add(self, entry: dict[str, Any]):
+        with self._lock:
+            self.entries.append(entry)
+            self._replays.setdefault(entry["key"], []).append(entry)
+
+    def record(self, method: str, url: str, body: Any, status: int, headers: Any, content: bytes, elapsed: float):
+        kept = {name: headers[name] for name in KEPT_HEADERS if headers.get(name) is not None}
+        entry: dict[str, Any] = {"key": self.key(method, url, body), "status": status, "headers": kept, "elapsed": round(elapsed, 4)}
+        try:
+            entry["json"] = json.loads(content)
+        except ValueError:
+            entry["text"] = content.decode("utf-8", "replace")
+        self.add(entry)
+
+    def replay(self, method: str, url: str, body: Any) -> tuple[int, dict[str, str], bytes]:
+        """The status, headers and body of the recorded response to the request, after its recorded time scaled by latency_scale."""
+        key = self.key(method, url, body)
+        with self._lock:
+            entries = self._replays.get(key)
+            if not entries:
+                raise ReplayMissError(f"No recorded response to {key}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            self.replayed += 1
+        entry = entries[position % len(entries)]
+        if self.latency_scale:
+            self.sleep(entry["elapsed"] * self.latency_scale)
+        content = json.dumps(entry["json"]).encode("utf-8") if "json" in entry else entry["text"].encode("utf-8")
+        return entry["status"], dict(entry["headers"]), content
+
+    def requests_session(self) -> requests.Session:
+        """A session of the requests library recording or replaying its requests, for openai.requestssession."""
+        session = requests.Session()
+        adapter = RecordingAdapter(self)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def transport(self, inner: Optional[HttpTransport] = None) -> RecordingTransport:
+        """A transport of the Azure SDK recording the requests it sends with inner, or replaying them."""
+        return RecordingTransport(self, inner)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter of the requests library, used by the OpenAI SDK, that records or replays with a Recording."""
+
+    def __init__(self, recording: Recording, **kwargs):
+        super().__init__(**kwargs)
+        self.recording = recording
+
+    def send(self, request, **kwargs):
+        if self.recording.mode == "replay":
+            status, headers, content = self.recording.replay(request.method, request.url, request.body)
+            response = requests.Response()
+            response.status_code = status
+            response.headers.update(headers)
+            response._content = content
+            response.url = request.url
+            response.request = request
+            return response
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        self.recording.record(request.method, request.url, request.body, response.status_code, response.headers, response.content,
+                              time.perf_counter() - started)
+        return response
+
+
+class RecordingTransport(HttpTransport):
+    """Transport of the Azure SDK, for the transport argument of SearchClient, that records or replays with a Recording."""
+
+    def __init__(self, recording: Recording, inner: Optional[HttpTransport] = None):
+        self.recording = recording
+        self.inner = inner if inner is not None or recording.mode == "replay" else RequestsTransport()
+
+    def __enter__(self):
+        if self.inner is not None:
+            self.inner.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.inner is not None:
+            self.inner.__exit__(*exc_info)
+
+    def open(self):
+        if self.inner is not None:
+            self.inner.open()
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+    def send(self, request, **kwargs):
+        body = request.body if isinstance(request.body, (str, bytes)) else request.data
+        if self.recording.mode == "replay":
+            status, headers, content = self.recording.replay(request.method, request.url, body)
+            response = requests.Response()
+            response.status_code = status
+            response.headers.update(headers)
+            response._content = content
+            return RequestsTransportResponse(request, response)
+        started = time.perf_counter()
+        response = self.inner.send(request, **kwargs)
+        self.recording.record(request.method, request.url, body, response.status_code, response.headers, response.body(),
+                              time.perf_counter() - started)
+        return response
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Optional, Sequence, Union
+
+import openai
+from azure.search.documents.models import QueryType
+
+from .localsearch import reciprocal_rank_fusion
+from .openaiauth import api_key
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetrievalStats:
+    queries: int = 0
+    cache_hits: int = 0
+    embedding_calls: int = 0
+    searches: int = 0
+    documents: int = 0
+    embedding_time: float = 0.0
+    search_time: float = 0.0
+    total_time: float = 0.0
+
+    def add(self, other: RetrievalStats):
+        for name in self.__dataclass_fields__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+@dataclass
+class Retrieval:
+    documents: list[dict[str, Any]]
+    stats: RetrievalStats = field(default_factory=RetrievalStats)
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class Retriever:
+    """
+    Retrieves the sources of the approaches for one or many queries, following the retrieval_mode, semantic_ranker,
+    semantic_captions, top and exclude_category overrides. The embeddings of all queries are computed in batched
+    calls, the searches run concurrently, and the results of several queries are merged with reciprocal rank fusion
+    and deduplicated by document key, so that searching for variants of a question costs about as much time as
+    searching for one. Results are looked up in and stored to cache, any object with get(key) and set(key, value)
+    methods, and every call is timed in the stats of its Retrieval and the totals of the Retriever.
+    """
+
+    def __init__(self, search_client: Any, embedding_deployment: str, sourcepage_field: str, content_field: str, key_field: str = "id",
+                 query_language: str = "en-us", cache: Optional[Any] = None, embeddings: Optional[Any] = None, max_workers: int = 8,
+                 max_batch_size: int = 16):
+        self.search_client = search_client
+        self.embedding_deployment = embedding_deployment
+        self.sourcepage_field = sourcepage_field
+        self.content_field = content_field
+        self.key_field = key_field
+        self.query_language = query_language
+        self.cache = cache
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.totals = RetrievalStats()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+
+    def retrieve(self, queries: Union[str, Sequence[str]], overrides: dict[str, Any]) -> Retrieval:
+        started = time.perf_counter()
+        queries = [queries] if isinstance(queries, str) else list(queries)
+        results, stats = self._retrieve(queries, overrides)
+        documents = results[0] if len(results) == 1 else self._fuse(results, overrides.get("top") or 3)
+        return Retrieval(list(documents), self._finish(stats, len(documents), started))
+
+    def retrieve_each(self, queries: Sequence[str], overrides: dict[str, Any]) -> list[Retrieval]:
+        """
+        Like retrieve, but returns the results of every query separately instead of fusing them. All returned
+        Retrievals share the stats of the call.
+        """
+        started = time.perf_counter()
+        results, stats = self._retrieve(list(queries), overrides)
+        stats = self._finish(stats, sum(len(documents) for documents in results), started)
+        return [Retrieval(list(documents), stats) for documents in results]
+
+    def _retrieve(self, queries: list[str], overrides: dict[str, Any]) -> tuple[list[list[dict[str, Any]]], RetrievalStats]:
+        stats = RetrievalStats(queries=len(queries))
+        has_text = overrides.get("retrieval_mode") in ["text", "hybrid", None]
+        has_vector = overrides.get("retrieval_mode") in ["vectors", "hybrid", None]
+        options = {
+            "top": overrides.get("top") or 3,
+            "filter": self.filter(overrides),
+            "semantic": bool(overrides.get("semantic_ranker") and has_text),
+            "captions": bool(overrides.get("semantic_captions") and has_text),
+        }
+
+        keys = [(query if has_text else None, query if has_vector else None, options["filter"], options["top"], options["semantic"],
+                 options["captions"], self.query_language, self.embedding_deployment) for query in queries]
+        results: list[Optional[list[dict[str, Any]]]] = [self.cache.get(key) if self.cache is not None else None for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        stats.cache_hits = len(queries) - len(misses)
+
+        vectors: dict[int, list[float]] = {}
+        if has_vector and misses:
+            t = time.perf_counter()
+            vectors = self._embed([queries[i] for i in misses], misses, stats)
+            stats.embedding_time = time.perf_counter() - t
+
+        if misses:
+            t = time.perf_counter()
+            searches = [(i, queries[i] if has_text else None, vectors.get(i)) for i in misses]
+            if len(searches) == 1:
+                found = [self._search(searches[0][1], searches[0][2], options)]
+            else:
+                found = list(self._executor.map(lambda s: self._search(s[1], s[2], options), searches))
+            stats.searches = len(searches)
+            stats.search_time = time.perf_counter() - t
+            for (i, _, _), documents in zip(searches, found):
+                results[i] = documents
+                if self.cache is not None:
+                    self.cache.set(keys[i], documents)
+
+        return [documents or [] for documents in results], stats
+
+    def _finish(self, stats: RetrievalStats, documents: int, started: float) -> RetrievalStats:
+        stats.documents = documents
+        stats.total_time = time.perf_counter() - started
+        with self._lock:
+            self.totals.add(stats)
+        logger.debug("Retrieved %d documents for %d queries (%d cached) in %.3f s, embeddings %.3f s, searches %.3f s",
+                     stats.documents, stats.queries, stats.cache_hits, stats.total_time, stats.embedding_time, stats.search_time)
+        return stats
+
+    @staticmethod
+    def filter(overrides: dict[str, Any]) -> Optional[str]:
+        exclude_category = overrides.get("exclude_category") or None
+        return "category ne '{}'".format(exclude_category.replace("'", "''")) if exclude_category else None
+
+    def _embed(self, texts: list[str], positions: list[int], stats: RetrievalStats) -> dict[int, list[float]]:
+        embeddings = self.embeddings or openai.Embedding
+        vectors: dict[int, list[float]] = {}
+        for start in range(0, len(texts), self.max_batch_size):
+            response = embeddings.create(engine=self.embedding_deployment, input=texts[start:start + self.max_batch_size], api_key=api_key())
+            stats.embedding_calls += 1
+            for item in response["data"]:
+                vectors[positions[start + item["index"]]] = item["embedding"]
+        return vectors
+
+    def _search(self, query_text: Optional[str], query_vector: Optional[list[float]], options: dict[str, Any]) -> list[dict[str, Any]]:
+        select = [self.key_field, self.sourcepage_field, self.content_field]
+        if options["semantic"]:
+            r = self.search_client.search(query_text,
+                                          filter=options["filter"],
+                                          select=select,
+                                          query_type=QueryType.SEMANTIC,
+                                          query_language=self.query_language,
+                                          query_speller="lexicon",
+                                          semantic_configuration_name="default",
+                                          top=options["top"],
+                                          query_caption="extractive|highlight-false" if options["captions"] else None,
+                                          vector=query_vector,
+                                          top_k=50 if query_vector else None,
+                                          vector_fields="embedding" if query_vector else None)
+        else:
+            r = self.search_client.search(query_text,
+                                          filter=options["filter"],
+                                          select=select,
+                                          top=options["top"],
+                                          vector=query_vector,
+                                          top_k=50 if query_vector else None,
+                                          vector_fields="embedding" if query_vector else None)
+        # Read all pages here, so that concurrent searches also receive their results concurrently
+        return list(r)
+
+    def _key(self, document: dict[str, Any]) -> Any:
+        return document.get(self.key_field) or (document.get(self.sourcepage_field), document.get(self.content_field))
+
+    def _fuse(self, results: list[list[dict[str, Any]]], top: int) -> list[dict[str, Any]]:
+        by_key: dict[Any, dict[str, Any]] = {}
+        rankings = []
+        for documents in results:
+            rankings.append([(self._key(document), 0.0) for document in documents])
+            for document in documents:
+                by_key.setdefault(self._key(document), document)
+        return [by_key[key] for key, _ in reciprocal_rank_fusion(rankings)[:top]]
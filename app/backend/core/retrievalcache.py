@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalCache:
+    """
+    Bounded cache of search results for the Retriever, keyed on the query, retrieval mode, filter, top and semantic
+    options. Entries expire after ttl seconds and the least recently used entries are evicted beyond max_entries.
+    Only the given fields and the @search annotations of the results are kept. version returns the version of the
+    search index, which prepdocs changes when it modifies the index. Once started, a background thread polls it
+    every version_interval seconds and clears the cache when it changes, so that requests never wait for it.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 300.0, fields: Optional[Sequence[str]] = None,
+                 version: Optional[Callable[[], Optional[str]]] = None, version_interval: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fields = set(fields) if fields is not None else None
+        self.version = version
+        self.version_interval = version_interval
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[float, list[dict[str, Any]]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._index_version: Optional[str] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[list[dict[str, Any]]]:
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def set(self, key: Hashable, documents: Sequence[dict[str, Any]]):
+        if self.max_entries <= 0:
+            return
+        projected = [self._project(document) for document in documents]
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, projected)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _project(self, document: dict[str, Any]) -> dict[str, Any]:
+        if self.fields is None:
+            return dict(document)
+        return {k: v for k, v in document.items() if k in self.fields or k.startswith("@search.")}
+
+    def start(self) -> RetrievalCache:
+        """Starts polling the index version in the background, if there is a version to poll."""
+        if self.version is not None:
+            # New, in case of a process forked while the thread of its parent waited
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="index-version", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+        """Gets the index version and clears the cache if it changed. Errors are logged and the cached results kept."""
+        try:
+            version = self.version()
+        except Exception:
+            logger.warning("Could not get the search index version, keeping the cached results", exc_info=True)
+            return
+        with self._lock:
+            if version != self._index_version:
+                if self._entries:
+                    logger.info("Search index version changed to %s, clearing %d cached results", version, len(self._entries))
+                self._entries.clear()
+                self._index_version = version
+
+    def _run(self):
+        while True:
+            self.poll()
+            if self._stopped.wait(self.version_interval):
+                return
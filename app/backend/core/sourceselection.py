@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, Optional, Sequence
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+
+# Candidates fetched for selection unless overridden, as many as the vector queries consider
+DEFAULT_CANDIDATES = 50
+DEFAULT_MMR_LAMBDA = 0.5
+
+
+def relevance(documents: Sequence[dict[str, Any]]) -> np.ndarray:
+    """
+    Relevance of search results relative to the best one, from the semantic reranker score if present and the
+    search score otherwise. Results without scores, like fused results of several queries, are scored by their rank.
+    """
+    scores = [d.get("@search.reranker_score") if d.get("@search.reranker_score") is not None else d.get("@search.score") for d in documents]
+    if not documents or any(score is None for score in scores):
+        return 1 - np.arange(len(documents)) / max(len(documents), 1)
+    values = np.clip(np.array(scores, dtype=np.float64), 0, None)
+    return values / values.max() if values.max() > 0 else np.ones(len(values))
+
+
+def lexical_similarity(texts: Sequence[str]) -> np.ndarray:
+    """Cosine similarities of the word count vectors of texts, as a matrix."""
+    vocabulary: dict[str, int] = {}
+    rows = [[vocabulary.setdefault(word, len(vocabulary)) for word in _WORD_RE.findall(text.lower())] for text in texts]
+    counts = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+    for i, row in enumerate(rows):
+        np.add.at(counts[i], row, 1)
+    norms = np.linalg.norm(counts, axis=1, keepdims=True)
+    counts /= np.where(norms > 0, norms, 1)
+    return counts @ counts.T
+
+
+def select_sources(sources: Sequence[str], relevance: np.ndarray, k: int, mmr_lambda: float = DEFAULT_MMR_LAMBDA, token_budget: Optional[int] = None,
+                   count_tokens: Optional[Callable[[str], int]] = None) -> list[int]:
+    """
+    Picks up to k sources by maximal marginal relevance (Carbonell and Goldstein, 1998): each step takes the source
+    with the best mmr_lambda * relevance - (1 - mmr_lambda) * similarity to the sources already taken, so that
+    overlapping chunks and passages repeated across documents do not crowd out other information. With a
+    token_budget, sources that would exceed it are skipped. Returns the positions of the picked sources in order.
+    """
+    if token_budget is not None and count_tokens is None:
+        raise ValueError("count_tokens is needed to keep to a token budget")
+    similarity = lexical_similarity(sources)
+    remaining = list(range(len(sources)))
+    selected: list[int] = []
+    # Highest similarity of every source to the selected ones
+    redundancy = np.zeros(len(sources))
+    tokens = 0
+    while remaining and len(selected) < k:
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        if token_budget is not None:
+            needed = count_tokens(sources[best])
+            if tokens + needed > token_budget:
+                continue
+            tokens += needed
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+class SourceSelector:
+    """
+    Post-retrieval selection of the sources for a prompt, configured by overrides: with "mmr" the approaches fetch
+    "mmr_candidates" results instead of "top" and keep the top sources picked by select_sources with "mmr_lambda",
+    within "sources_token_budget" tokens if given.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int]):
+        self.count_tokens = count_tokens
+
+    @staticmethod
+    def enabled(overrides: dict[str, Any]) -> bool:
+        return bool(overrides.get("mmr"))
+
+    @staticmethod
+    def retrieval_overrides(overrides: dict[str, Any]) -> dict[str, Any]:
+        """The overrides to retrieve the candidates with."""
+        if not SourceSelector.enabled(overrides):
+            return overrides
+        return {**overrides, "top": overrides.get("mmr_candidates") or DEFAULT_CANDIDATES}
+
+    def select(self, documents: Sequence[dict[str, Any]], sources: Sequence[str], overrides: dict[str, Any]) -> list[str]:
+        """Returns the sources formatted from documents that go into the prompt."""
+        if not self.enabled(overrides):
+            return list(sources)
+        mmr_lambda = overrides.get("mmr_lambda")
+        picked = select_sources(sources, relevance(documents), overrides.get("top") or 3,
+                                mmr_lambda=DEFAULT_MMR_LAMBDA if mmr_lambda is None else mmr_lambda,
+                                token_budget=overrides.get("sources_token_budget"), count_tokens=self.count_tokens)
+        return [sources[i] for i in picked]
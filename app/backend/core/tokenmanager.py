@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """
+    Keeps an Azure AD access token for scope fresh from a background thread shared by all threads of a worker, so
+    that requests never wait for Azure AD. The token is refreshed refresh_margin seconds before it expires and
+    handed to publish, failed refreshes are retried every retry_interval seconds while the current token is still
+    valid.
+    """
+
+    def __init__(self, credential: Any, scope: str, publish: Optional[Callable[[str], None]] = None, refresh_margin: float = 300.0,
+                 retry_interval: float = 10.0, clock: Callable[[], float] = time.time):
+        self.credential = credential
+        self.scope = scope
+        self.publish = publish
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.refreshes = 0
+        self.failures = 0
+        self._token: Any = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def token(self) -> str:
+        """The current token. It is only ever replaced as a whole, so every caller gets a consistent, valid one."""
+        return self._token.token
+
+    @property
+    def expires_on(self) -> int:
+        return self._token.expires_on
+
+    def start(self) -> TokenManager:
+        """Gets the first token unless there is one, which blocks, and starts refreshing it in the background."""
+        if self._token is None:
+            self.refresh()
+        # New, in case of a process forked while the thread of its parent waited
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def refresh(self):
+        token = self.credential.get_token(self.scope)
+        self._token = token
+        self.refreshes += 1
+        logger.info("Refreshed the token for %s, it expires in %.0f s", self.scope, token.expires_on - self.clock())
+        if self.publish is not None:
+            self.publish(token.token)
+
+    def step(self) -> float:
+        """Refreshes the token if it is due and returns the seconds to wait until the next step."""
+        if self.clock() >= self.expires_on - self.refresh_margin:
+            try:
+                self.refresh()
+            except Exception:
+                self.failures += 1
+                remaining = self.expires_on - self.clock()
+                if remaining > 0:
+                    logger.warning("Could not refresh the token for %s, the current one expires in %.0f s", self.scope, remaining, exc_info=True)
+                else:
+                    logger.error("Could not refresh the token for %s, the current one has expired", self.scope, exc_info=True)
+                return self.retry_interval
+        return max(self.expires_on - self.refresh_margin - self.clock(), self.retry_interval)
+
+    def _run(self):
+        while not self._stopped.wait(self.step()):
+            pass
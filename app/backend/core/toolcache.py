@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from .trace import Trace
+
+# Returned by the caches for keys they do not have, since None is a valid result of a tool
+MISSING = object()
+
+
+def normalize_query(text: str) -> str:
+    """Lower cases a query and collapses its whitespace and surrounding punctuation, so that the same action written differently shares its result."""
+    return " ".join(text.lower().split()).strip(" .,;:!?\"'")
+
+
+class ToolResultCache:
+    """
+    Bounded cache of tool results shared by the runs of an agent, keyed on the action, normalized query and the
+    options that change the result. Entries expire after ttl seconds, short since unlike the RetrievalCache it does
+    not follow the version of the search index, and the least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, result: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ToolMemo:
+    """
+    Results of the tool calls of one agent run, so that an action repeated in the run is not sent again, backed by
+    a ToolResultCache shared with other runs. Every result reused instead of calling the tool is noted in trace.
+    """
+
+    def __init__(self, cache: Optional[ToolResultCache] = None, trace: Optional[Trace] = None):
+        self.cache = cache
+        self.trace = trace
+        self.calls = 0
+        self.run_hits = 0
+        self.shared_hits = 0
+        self._results: dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(action: str, argument: str, options: Hashable = ()) -> Hashable:
+        return (action, normalize_query(argument), options)
+
+    def get(self, action: str, argument: str, options: Hashable = ()) -> Any:
+        """The result of the action from this run or the shared cache, or MISSING."""
+        key = self.key(action, argument, options)
+        with self._lock:
+            result = self._results.get(key, MISSING)
+            if result is not MISSING:
+                self.run_hits += 1
+                self._note(f"{action}[{argument}] answered from an earlier action of this run, no remote call")
+                return result
+        if self.cache is None:
+            return MISSING
+        result = self.cache.get(key)
+        if result is not MISSING:
+            with self._lock:
+                self.shared_hits += 1
+                self._results[key] = result
+                self._note(f"{action}[{argument}] answered from the tool cache, no remote call")
+        return result
+
+    def set(self, action: str, argument: str, result: Any, options: Hashable = ()):
+        key = self.key(action, argument, options)
+        with self._lock:
+            self.calls += 1
+            self._results[key] = result
+        if self.cache is not None:
+            self.cache.set(key, result)
+
+    def call(self, action: str, argument: str, fn: Callable[[], Any], options: Hashable = ()) -> Any:
+        result = self.get(action, argument, options)
+        if result is MISSING:
+            result = fn()
+            self.set(action, argument, result, options)
+        return result
+
+    @property
+    def hits(self) -> int:
+        return self.run_hits + self.shared_hits
+
+    def summarize(self):
+        """Notes in trace how many remote calls the run avoided."""
+        if self.hits:
+            self._note(f"{self.hits} of {self.hits + self.calls} searches and lookups answered without a remote call "
+                       f"({self.run_hits} from this run, {self.shared_hits} from the tool cache)")
+
+    def _note(self, text: str):
+        if self.trace is not None:
+            self.trace.note(text)
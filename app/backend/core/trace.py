@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from typing import Any, Sequence
+
+
+def ch(text: Any) -> str:
+    s = text if isinstance(text, str) else str(text)
+    return s.replace("<", "&lt;").replace(">", "&gt;").replace("\r", "").replace("\n", "<br>")
+
+
+class Trace:
+    """
+    Thought process of one request as a list of events, each a tuple of its kind and values, which keep references
+    to the prompts and messages instead of copies. Rendered to the HTML of the thought process panel only on demand.
+    """
+
+    def __init__(self):
+        self.events: list[tuple[Any, ...]] = []
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def add(self, kind: str, *values: Any):
+        self.events.append((kind, *values))
+
+    def section(self, title: str, text: Any):
+        self.add("section", title, text)
+
+    def messages(self, title: str, messages: Sequence[Any]):
+        self.add("messages", title, messages)
+
+    def note(self, text: str):
+        self.add("note", text)
+
+    def extend(self, other: Trace):
+        self.events.extend(other.events)
+
+    def to_html(self) -> str:
+        return "".join(_render(*event) for event in self.events)
+
+
+def _render(kind: str, *values: Any) -> str:
+    if kind == "section":
+        title, text = values
+        return f"{title}:<br>{ch(text)}<br><br>"
+    if kind == "messages":
+        title, messages = values
+        return f"{title}:<br>" + ch("\n\n".join(str(message) for message in messages))
+    if kind == "note":
+        return f"{ch(values[0])}<br><br>"
+    if kind == "llm_start":
+        return "LLM prompts:<br>" + "<br>".join(ch(prompt) for prompt in values[0]) + "<br>"
+    if kind == "chain_start":
+        return f"Entering chain: {ch(values[0])}<br>"
+    if kind == "chain_end":
+        return "Finished chain<br>"
+    if kind == "tool_end":
+        output, color, observation_prefix, llm_prefix = values
+        return f"{ch(observation_prefix)}<br><span style='color:{color}'>{ch(output)}</span><br>{ch(llm_prefix)}<br>"
+    if kind == "text":
+        text, color = values
+        return f"<span style='color:{color}'>{ch(text)}</span><br>"
+    if kind == "error":
+        label, error = values
+        return f"<span style='color:red'>{label} error: {ch(error)}</span><br>"
+    raise ValueError(f"Unknown trace event {kind}")
@@ -1,4 +1,6 @@
 import multiprocessing
+import os
+import sys
 
 max_requests = 1000
 max_requests_jitter = 50
@@ -9,3 +11,12 @@ num_cpus = multiprocessing.cpu_count()
 workers = (num_cpus * 2) + 1
 threads = 1 if num_cpus == 1 else 2
 timeout = 600
+
+# Import the app once in the master and fork the workers from it, so that they share its modules, approaches, local
+# search sections and tokenizer encodings, and a worker recycled after max_requests starts in a fraction of a second
+preload_app = (os.environ.get("GUNICORN_PRELOAD_APP") or "true").lower() == "true"
+
+def post_fork(server, worker):
+    app = sys.modules.get("app")
+    if app is not None:
+        app.after_fork()
@@ -1,45 +1,49 @@
-from typing import Any, Dict, List, Optional, Union
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
 from langchain.callbacks.base import BaseCallbackHandler
+from langchain.llms.openai import AzureOpenAI
 from langchain.schema import AgentAction, AgentFinish, LLMResult
+from core.openaiauth import api_key
+from core.trace import Trace
 
-def ch(text: Union[str, object]) -> str:
-    s = text if isinstance(text, str) else str(text)
-    return s.replace("<", "&lt;").replace(">", "&gt;").replace("\r", "").replace("\n", "<br>")
+class KeyedAzureOpenAI(AzureOpenAI):
+    """AzureOpenAI passing the current key of core.openaiauth with every call, rather than the one it was created with."""
 
-class HtmlCallbackHandler (BaseCallbackHandler):
-    html: str = ""
+    @property
+    def _invocation_params(self) -> Dict[str, Any]:
+        params = super()._invocation_params
+        key = api_key()
+        return {**params, "api_key": key} if key is not None else params
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Records the thought process of an agent in a Trace, to be rendered if it is asked for."""
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
 
-    def get_and_reset_log(self) -> str:
-        result = self.html
-        self.html = ""
-        return result
-    
     def on_llm_start(
         self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
     ) -> None:
-        """Print out the prompts."""
-        self.html += f"LLM prompts:<br>" + "<br>".join(ch(prompts)) + "<br>";
+        self.trace.add("llm_start", prompts)
 
     def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
         """Do nothing."""
         pass
 
     def on_llm_error(self, error: Exception, **kwargs: Any) -> None:
-        self.html += f"<span style='color:red'>LLM error: {ch(error)}</span><br>"
+        self.trace.add("error", "LLM", error)
 
     def on_chain_start(
         self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
     ) -> None:
-        """Print out that we are entering a chain."""
-        class_name = serialized["name"]
-        self.html += f"Entering chain: {ch(class_name)}<br>"
+        self.trace.add("chain_start", serialized["name"])
 
     def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> None:
-        """Print out that we finished a chain."""
-        self.html += f"Finished chain<br>"
+        self.trace.add("chain_end")
 
     def on_chain_error(self, error: Exception, **kwargs: Any) -> None:
-        self.html += f"<span style='color:red'>Chain error: {ch(error)}</span><br>"
+        self.trace.add("error", "Chain", error)
 
     def on_tool_start(
         self,
@@ -48,7 +52,6 @@ class HtmlCallbackHandler (BaseCallbackHandler):
         color: Optional[str] = None,
         **kwargs: Any,
     ) -> None:
-        """Print out the log in specified color."""
         pass
 
     def on_tool_end(
@@ -59,11 +62,11 @@ class HtmlCallbackHandler (BaseCallbackHandler):
         llm_prefix: Optional[str] = None,
         **kwargs: Any,
     ) -> None:
-        """If not the final action, print out observation."""
-        self.html += f"{ch(observation_prefix)}<br><span style='color:{color}'>{ch(output)}</span><br>{ch(llm_prefix)}<br>"
+        """If not the final action, record the observation."""
+        self.trace.add("tool_end", output, color, observation_prefix, llm_prefix)
 
     def on_tool_error(self, error: Exception, **kwargs: Any) -> None:
-        self.html += f"<span style='color:red'>Tool error: {ch(error)}</span><br>"
+        self.trace.add("error", "Tool", error)
 
     def on_text(
         self,
@@ -71,18 +74,45 @@ class HtmlCallbackHandler (BaseCallbackHandler):
         color: Optional[str] = None,
         **kwargs: Optional[str],
     ) -> None:
-        """Run when agent ends."""
-        self.html += f"<span style='color:{color}'>{ch(text)}</span><br>"
+        self.trace.add("text", text, color)
 
     def on_agent_action(
         self, 
         action: AgentAction, 
         color: Optional[str] = None,
         **kwargs: Any) -> Any:
-        self.html += f"<span style='color:{color}'>{ch(action.log)}</span><br>"
+        self.trace.add("text", action.log, color)
 
     def on_agent_finish(
         self, finish: AgentFinish, color: Optional[str] = None, **kwargs: Any
     ) -> None:
-        """Run on agent end."""
-        self.html += f"<span style='color:{color}'>{ch(finish.log)}</span><br>"
+        self.trace.add("text", finish.log, color)
+
+class RequestCallbackHandler(BaseCallbackHandler):
+    """
+    Forwards the events of chains and tools that are built once and shared by requests to the handler bound for
+    the current request, if any.
+    """
+
+    def __init__(self):
+        self._handler: ContextVar[Optional[BaseCallbackHandler]] = ContextVar("request_callback_handler", default=None)
+
+    @contextmanager
+    def bind(self, handler: BaseCallbackHandler) -> Iterator[BaseCallbackHandler]:
+        token = self._handler.set(handler)
+        try:
+            yield handler
+        finally:
+            self._handler.reset(token)
+
+def _forward(name: str):
+    def forward(self: RequestCallbackHandler, *args: Any, **kwargs: Any) -> Any:
+        handler = self._handler.get()
+        if handler is not None:
+            return getattr(handler, name)(*args, **kwargs)
+    forward.__name__ = name
+    return forward
+
+for _name in ["on_llm_start", "on_llm_new_token", "on_llm_end", "on_llm_error", "on_chain_start", "on_chain_end", "on_chain_error",
+              "on_tool_start", "on_tool_end", "on_tool_error", "on_text", "on_agent_action", "on_agent_finish"]:
+    setattr(RequestCallbackHandler, _name, _forward(_name))
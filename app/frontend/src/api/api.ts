@@ -17,7 +17,8 @@ export async function askApi(options: AskRequest): Promise<AskResponse> {
                 prompt_template: options.overrides?.promptTemplate,
                 prompt_template_prefix: options.overrides?.promptTemplatePrefix,
                 prompt_template_suffix: options.overrides?.promptTemplateSuffix,
-                exclude_category: options.overrides?.excludeCategory
+                exclude_category: options.overrides?.excludeCategory,
+                include_thoughts: options.overrides?.includeThoughts ?? false
             }
         })
     });
@@ -48,7 +49,8 @@ export async function chatApi(options: ChatRequest): Promise<AskResponse> {
                 prompt_template_prefix: options.overrides?.promptTemplatePrefix,
                 prompt_template_suffix: options.overrides?.promptTemplateSuffix,
                 exclude_category: options.overrides?.excludeCategory,
-                suggest_followup_questions: options.overrides?.suggestFollowupQuestions
+                suggest_followup_questions: options.overrides?.suggestFollowupQuestions,
+                include_thoughts: options.overrides?.includeThoughts ?? false
             }
         })
     });
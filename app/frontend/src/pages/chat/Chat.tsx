@@ -22,6 +22,7 @@ const Chat = () => {
     const [useSemanticCaptions, setUseSemanticCaptions] = useState<boolean>(false);
     const [excludeCategory, setExcludeCategory] = useState<string>("");
     const [useSuggestFollowupQuestions, setUseSuggestFollowupQuestions] = useState<boolean>(false);
+    const [includeThoughts, setIncludeThoughts] = useState<boolean>(false);
 
     const lastQuestionRef = useRef<string>("");
     const chatMessageStreamEnd = useRef<HTMLDivElement | null>(null);
@@ -54,7 +55,8 @@ const Chat = () => {
                     top: retrieveCount,
                     semanticRanker: useSemanticRanker,
                     semanticCaptions: useSemanticCaptions,
-                    suggestFollowupQuestions: useSuggestFollowupQuestions
+                    suggestFollowupQuestions: useSuggestFollowupQuestions,
+                    includeThoughts
                 }
             };
             const result = await chatApi(request);
@@ -100,6 +102,10 @@ const Chat = () => {
         setUseSuggestFollowupQuestions(!!checked);
     };
 
+    const onIncludeThoughtsChange = (_ev?: React.FormEvent<HTMLElement | HTMLInputElement>, checked?: boolean) => {
+        setIncludeThoughts(!!checked);
+    };
+
     const onExampleClicked = (example: string) => {
         makeApiRequest(example);
     };
@@ -253,6 +259,12 @@ const Chat = () => {
                         label="Passende Fragen vorschlagen lassen"
                         onChange={onUseSuggestFollowupQuestionsChange}
                     />
+                    <Checkbox
+                        className={styles.chatSettingsSeparator}
+                        checked={includeThoughts}
+                        label="Gedankengang der Antworten anzeigen"
+                        onChange={onIncludeThoughtsChange}
+                    />
                 </Panel>
             </div>
         </div>
@@ -20,6 +20,7 @@ const OneShot = () => {
     const [useSemanticRanker, setUseSemanticRanker] = useState<boolean>(true);
     const [useSemanticCaptions, setUseSemanticCaptions] = useState<boolean>(false);
     const [excludeCategory, setExcludeCategory] = useState<string>("");
+    const [includeThoughts, setIncludeThoughts] = useState<boolean>(false);
 
     const lastQuestionRef = useRef<string>("");
 
@@ -49,7 +50,8 @@ const OneShot = () => {
                     excludeCategory: excludeCategory.length === 0 ? undefined : excludeCategory,
                     top: retrieveCount,
                     semanticRanker: useSemanticRanker,
-                    semanticCaptions: useSemanticCaptions
+                    semanticCaptions: useSemanticCaptions,
+                    includeThoughts
                 }
             };
             const result = await askApi(request);
@@ -93,6 +95,10 @@ const OneShot = () => {
         setExcludeCategory(newValue || "");
     };
 
+    const onIncludeThoughtsChange = (_ev?: React.FormEvent<HTMLElement | HTMLInputElement>, checked?: boolean) => {
+        setIncludeThoughts(!!checked);
+    };
+
     const onExampleClicked = (example: string) => {
         makeApiRequest(example);
     };
@@ -243,6 +249,12 @@ const OneShot = () => {
                     onChange={onUseSemanticCaptionsChange}
                     disabled={!useSemanticRanker}
                 />
+                <Checkbox
+                    className={styles.oneshotSettingsSeparator}
+                    checked={includeThoughts}
+                    label="Show the thought process of answers"
+                    onChange={onIncludeThoughtsChange}
+                />
             </Panel>
         </div>
     );
@@ -0,0 +1,175 @@
+import argparse
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+
+import openai
+from openai.openai_object import OpenAIObject
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from approaches.readdecomposeask import ReadDecomposeAsk  # noqa: E402
+from approaches.readretrieveread import ReadRetrieveReadApproach  # noqa: E402
+from bench_projection import synthetic_sections  # noqa: E402
+from core.localsearch import LocalSearchClient  # noqa: E402
+from core.queryplan import INSUFFICIENT  # noqa: E402
+from core.retrievalcache import RetrievalCache  # noqa: E402
+
+from fakes import FakeEmbeddings  # noqa: E402
+
+# Typical latencies of the services per request in seconds, scaled with --latency
+COMPLETION_LATENCY = 1.0
+EMBEDDING_LATENCY = 0.05
+SEARCH_LATENCY = 0.1
+
+# Fixed questions with the actions a model would take for them. The plan is what the planning completion returns,
+# react the actions of the ReAct agent, one completion each. insufficient makes the answer completion of the plan
+# reply that the observations do not answer the question.
+QUESTIONS = [
+    {"question": "Zahlt der Tarif Zahnersatz und Brillen?",
+     "plan": ["Search[Tarif Zahnersatz]", "Search[Tarif Brille]"],
+     "react": ["Search[Tarif Zahnersatz]", "Search[Tarif Brille]"]},
+    {"question": "Welche Kosten erstattet die Reiseversicherung bei Storno und im Krankenhaus?",
+     "plan": ["Search[Reise Storno Kosten]", "Search[Reise Krankenhaus Kosten]", "Lookup[Erstattung]"],
+     "react": ["Search[Reise Storno Kosten]", "Search[Reise Krankenhaus Kosten]", "Lookup[Erstattung]"]},
+    {"question": "Wie hoch ist der Beitrag für Kinder?",
+     "plan": ["Search[Beitrag Kinder]"],
+     "react": ["Search[Beitrag Kinder]"]},
+    {"question": "Welche Leistungen hat die Police, die Kinder schützt?",
+     "plan": ["Search[Police Kinder Schutz]", "Sequential"],
+     "react": ["Search[Police Kinder Schutz]", "Search[Police Leistung]"]},
+    {"question": "Wann endet der Vertrag nach einer Erstattung?",
+     "plan": ["Search[Vertrag Erstattung]"],
+     "react": ["Search[Vertrag Erstattung]", "Lookup[Vertrag]"],
+     "insufficient": True},
+]
+
+
+class ScriptedCompletion:
+    """
+    Stand-in for openai.Completion that replies to the planning, answer and ReAct prompts of ReadDecomposeAsk with
+    the actions scripted in QUESTIONS, after the latency of the service. Counts calls.
+    """
+
+    def __init__(self, questions, latency=0.0):
+        self.questions = {q["question"]: q for q in questions}
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        choices = [{"text": self.reply(p), "index": i, "finish_reason": "stop", "logprobs": None} for i, p in enumerate(prompts)]
+        return OpenAIObject.construct_from({"choices": choices, "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+
+    def reply(self, prompt):
+        head, _, tail = prompt.rpartition("Question: ")
+        script = self.questions[tail.split("\n")[0].strip()]
+        source = re.search(r"([\w\-]+\.pdf):", tail) or re.search(r"([\w\-]+\.pdf):", head.rpartition("Observations:")[2])
+        citation = f" <{source.group(1)}>" if source else ""
+        if prompt.startswith("Plan the actions"):
+            return "\n".join(script["plan"])
+        if tail.rstrip().endswith("Answer:"):
+            return INSUFFICIENT if script.get("insufficient") else f"Die Antwort steht in den Bedingungen{citation}."
+        step = tail.count("\nObservation:")
+        if step < len(script["react"]):
+            return f" I need to find out more.\nAction: {script['react'][step]}"
+        return f" I have the facts to answer.\nAction: Finish[Die Antwort steht in den Bedingungen{citation}]"
+
+
+class ImmediateCompletion:
+    """Stand-in for openai.Completion that answers right away, in the format of the ReAct or the zero shot agent."""
+
+    def create(self, prompt, **kwargs):
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        texts = [" I now know the final answer.\nFinal Answer: Ja [p-1.pdf]" if "Final Answer:" in p else " I know the answer.\nAction: Finish[Ja <p-1.pdf>]" for p in prompts]
+        choices = [{"text": text, "index": i, "finish_reason": "stop", "logprobs": None} for i, text in enumerate(texts)]
+        return OpenAIObject.construct_from({"choices": choices, "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+
+
+class SlowSearchClient(LocalSearchClient):
+    def __init__(self, *args, latency=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def search(self, search_text, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return super().search(search_text, **kwargs)
+
+
+def measure(approach, completion, search_client, embeddings, overrides):
+    rows = []
+    for script in QUESTIONS:
+        calls = (completion.calls, search_client.calls, embeddings.calls)
+        t = time.perf_counter()
+        response = approach.run(script["question"], overrides)
+        elapsed = time.perf_counter() - t
+        fell_back = "running the ReAct agent" in response["trace"].to_html()
+        rows.append((elapsed, completion.calls - calls[0], search_client.calls - calls[1], embeddings.calls - calls[2], fell_back))
+    return rows
+
+
+def measure_setup(approach, overrides, runs):
+    """Mean seconds per request of approach when the first completion answers, which is about the cost of setting up its agent."""
+    approach.run("Sind Stornokosten versichert?", overrides)
+    t = time.perf_counter()
+    for _ in range(runs):
+        approach.run("Sind Stornokosten versichert?", overrides)
+    return (time.perf_counter() - t) / runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the latency and service calls of the ReAct agent of ReadDecomposeAsk with its plan and execute mode on a fixed question set, with local stand-ins for OpenAI and Cognitive Search.")
+    parser.add_argument("--count", type=int, default=1000, help="Number of synthetic sections")
+    parser.add_argument("--latency", type=float, default=1.0, help="Scale of the simulated service latencies")
+    parser.add_argument("--cache", action="store_true", help="Cache retrieval results, so that the searches of a plan are reused by its fallback")
+    parser.add_argument("--setup", type=int, metavar="RUNS", help="Instead, measure the time per request of the agents of the rrr and rda approaches when the first completion answers")
+    args = parser.parse_args()
+
+    if args.setup:
+        # The employee tool of rrr reads its data relative to the backend directory
+        os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend"))
+        openai.Completion = ImmediateCompletion()
+        openai.api_key = "local"
+        search_client = LocalSearchClient([])
+        for name, approach in [("rrr", ReadRetrieveReadApproach(search_client, "gpt", "embedding", "sourcepage", "content")),
+                               ("rda", ReadDecomposeAsk(search_client, "gpt", "embedding", "sourcepage", "content"))]:
+            elapsed = measure_setup(approach, {"temperature": 0.3}, args.setup)
+            print(f"{name} {1000 * elapsed:.2f} ms per request")
+        sys.exit()
+
+    completion = ScriptedCompletion(QUESTIONS, latency=COMPLETION_LATENCY * args.latency)
+    openai.Completion = completion
+    openai.api_key = "local"
+    search_client = SlowSearchClient(synthetic_sections(args.count), latency=SEARCH_LATENCY * args.latency)
+    embeddings = FakeEmbeddings(latency=EMBEDDING_LATENCY * args.latency)
+    approach = ReadDecomposeAsk(search_client, "gpt", "embedding", "sourcepage", "content", RetrievalCache() if args.cache else None)
+    approach.retriever.embeddings = embeddings
+
+    results = {}
+    for name, overrides in [("react", {}), ("plan", {"plan_and_execute": True})]:
+        if approach.retriever.cache is not None:
+            approach.retriever.cache.clear()
+        results[name] = measure(approach, completion, search_client, embeddings, overrides)
+
+    # After the verbose output of the agent
+    print(f"{len(QUESTIONS)} questions, {len(search_client)} sections")
+    for name, rows in results.items():
+        for (elapsed, completions, searches, embedding_calls, fell_back), script in zip(rows, QUESTIONS):
+            print(f"{name:<6} {elapsed:>6.2f} s {completions:>2} completions {searches:>2} searches {embedding_calls:>2} embedding calls{' (fallback)' if fell_back else ''}  {script['question']}")
+        print(f"{name:<6} median {statistics.median(r[0] for r in rows):.2f} s, total {sum(r[0] for r in rows):.2f} s, "
+              f"{sum(r[1] for r in rows)} completions, {sum(r[2] for r in rows)} searches, {sum(r[3] for r in rows)} embedding calls")
@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend"))
+
+from core.ivfpq import IvfPqIndex  # noqa: E402
+from core.localsearch import read_sections_file  # noqa: E402
+
+
+def clustered_vectors(count, dimensions, clusters=100, spread=0.5, seed=0):
+    """Synthetic embeddings that form clusters like the sections of related documents do."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimensions))
+    return (centers[rng.integers(0, clusters, count)] + spread * rng.normal(size=(count, dimensions))).astype(np.float32)
+
+
+def brute_force(vectors, queries, k):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    t = time.perf_counter()
+    neighbors = []
+    for q in queries:
+        similarities = vectors @ q
+        top = np.argpartition(-similarities, k - 1)[:k]
+        neighbors.append(top[np.argsort(-similarities[top], kind="stable")])
+    return neighbors, len(queries) / (time.perf_counter() - t)
+
+
+def measure(index, queries, truth, k, nprobe, refine):
+    t = time.perf_counter()
+    found = [index.search(q, k, nprobe=nprobe, refine=refine)[0] for q in queries]
+    qps = len(queries) / (time.perf_counter() - t)
+    recall = np.mean([len(set(f.tolist()) & set(t.tolist())) / k for f, t in zip(found, truth)])
+    return recall, qps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare recall@k and queries per second of the IVF-PQ vector index with exhaustive search, and the time to build and to load it.")
+    parser.add_argument("--sections", help="Use the embeddings of a file written by prepdocs --export instead of synthetic vectors, queries are perturbed copies of them")
+    parser.add_argument("--count", type=int, default=100000, help="Number of synthetic vectors")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Dimensions of the synthetic vectors")
+    parser.add_argument("--clusters", type=int, help="Number of clusters of the synthetic vectors, one per 100 vectors by default so that every query has more than k close neighbors")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("-k", type=int, default=50, help="Neighbors per query, the top_k of the approaches")
+    parser.add_argument("--nlist", type=int, help="Inverted lists, about sqrt(count) by default")
+    parser.add_argument("--subquantizers", type=int, help="Bytes per vector code, a divisor of the dimensions with 16 dimensions each by default")
+    parser.add_argument("--nprobe", default="4,8,16", help="Comma separated numbers of lists probed per query to compare")
+    parser.add_argument("--refine", default="2,4,8", help="Comma separated numbers of candidates per neighbor scored exactly to compare")
+    args = parser.parse_args()
+
+    if args.sections:
+        vectors = np.array([s["embedding"] for s in read_sections_file(args.sections) if s.get("embedding") is not None], dtype=np.float32)
+        rng = np.random.default_rng(1)
+        picks = vectors[rng.integers(0, len(vectors), args.queries)]
+        queries = picks + 0.1 * np.std(vectors) * rng.normal(size=picks.shape).astype(np.float32)
+    else:
+        # Queries from the same clusters as the vectors, like questions about the documents
+        vectors = clustered_vectors(args.count + args.queries, args.dimensions, args.clusters or max(1, args.count // 100))
+        vectors, queries = vectors[:args.count], vectors[args.count:]
+    k = min(args.k, len(vectors))
+
+    truth, brute_qps = brute_force(vectors, queries, k)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, {len(queries)} queries, k={k}")
+    print(f"{'brute force':<22} recall@{k} 1.000 {brute_qps:>9.1f} queries/s")
+
+    t = time.perf_counter()
+    index = IvfPqIndex.build(vectors, nlist=args.nlist, subquantizers=args.subquantizers)
+    print(f"built nlist={index.nlist} subquantizers={index.codebooks.shape[0]} in {time.perf_counter() - t:.1f} s")
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "vectors.ivfpq")
+        index.save(path)
+        del index
+        t = time.perf_counter()
+        index = IvfPqIndex.load(path)
+        print(f"loaded {os.path.getsize(path) / 1024 / 1024:.1f} MB memory mapped in {1000 * (time.perf_counter() - t):.1f} ms")
+        for nprobe in sorted(int(n) for n in args.nprobe.split(",")):
+            for refine in sorted(int(r) for r in args.refine.split(",")):
+                recall, qps = measure(index, queries, truth, k, nprobe, refine)
+                print(f"nprobe={nprobe:<4} refine={refine:<4} recall@{k} {recall:.3f} {qps:>9.1f} queries/s  x{qps / brute_qps:.2f}")
+        del index
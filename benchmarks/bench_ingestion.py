@@ -0,0 +1,27 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from ingestion import run_ingestion  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the prepdocs pipeline over the bundled PDFs with local stand-ins for all Azure services and report the time spent per stage. Other arguments are passed on to prepdocs.",
+        epilog="Example: bench_ingestion.py --latency 0 --localpdfparser --pdfworkers 4",
+    )
+    parser.add_argument("--files", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "*.pdf"), help="Files to ingest")
+    parser.add_argument("--latency", type=float, default=1.0, help="Scale of the simulated service latencies, 0 to measure the local work only")
+    parser.add_argument("--report", help="Copy the JSON profile report to this file")
+    args, prepdocs_args = parser.parse_known_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        report, clients = run_ingestion(args.files, workdir, args.latency, prepdocs_args)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+    print(f"{len(clients['search'].documents)} sections indexed, {clients['blobs'].requests} blob requests, {clients['layout'].calls} layout calls, {clients['embeddings'].calls} embedding calls")
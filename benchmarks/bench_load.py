@@ -0,0 +1,287 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import runpy
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from fakeservices import FakeServices
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCHMARKS, "..", "app", "backend")
+
+# Conversations of users of the app, a question and its follow up questions each, in the words of the synthetic
+# sections of the fake search service
+HISTORIES = [
+    ["Welche Kosten erstattet die Reiseversicherung bei Storno?", "Und im Krankenhaus?", "Gilt das auch für Kinder?"],
+    ["Zahlt der Tarif Zahnersatz?", "Wie hoch ist der Beitrag dafür?", "Und Brillen?"],
+    ["Wann endet der Vertrag?", "Welche Leistungen hat die Police dann noch?"],
+    ["Wie hoch ist der Beitrag für Kinder?", "Welche Erstattung gibt es im Krankenhaus?", "Was kostet der Schutz auf einer Reise?", "Und bei Storno?"],
+    ["Welche Versicherung schützt bei Kosten für Zahnersatz?", "Muss ich dafür einen Tarif wechseln?"],
+]
+
+SCENARIOS = [f"ask:{approach}:{mode}" for approach in ("rtr", "rrr", "rda") for mode in ("hybrid", "text", "vectors")] + \
+            [f"chat:rrr:{mode}" for mode in ("hybrid", "text", "vectors")]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def default_config(conf):
+    settings = runpy.run_path(conf)
+    return settings["workers"], settings["threads"]
+
+
+def parse_configs(text, conf):
+    configs = []
+    for name in text.split(","):
+        workers, threads = default_config(conf) if name == "default" else map(int, name.split("x"))
+        configs.append((f"{workers}x{threads}", workers, threads))
+    return configs
+
+
+class Backend:
+    """The backend served by gunicorn with workers and threads, or in this process by a threading WSGI server when workers is None."""
+
+    def __init__(self, backend_dir, env, workers=None, threads=None):
+        self.backend_dir = os.path.abspath(backend_dir)
+        self.env = env
+        self.workers = workers
+        self.threads = threads
+        self.url = f"http://127.0.0.1:{free_port()}"
+        self.process = None
+        self.server = None
+        self.log = None
+
+    def __enter__(self):
+        port = int(self.url.rsplit(":", 1)[1])
+        if self.workers is None:
+            os.environ.update(self.env)
+            os.chdir(self.backend_dir)
+            sys.path.insert(0, self.backend_dir)
+            from loadapp import app
+            self.server = make_server("127.0.0.1", port, app, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        else:
+            self.log = tempfile.TemporaryFile()
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-c", os.path.join(self.backend_dir, "gunicorn.conf.py"), "--workers", str(self.workers),
+                 "--threads", str(self.threads), "--bind", f"127.0.0.1:{port}", "--chdir", self.backend_dir, "--pythonpath", BENCHMARKS, "loadapp:app"],
+                env={**os.environ, **self.env}, stdout=self.log, stderr=subprocess.STDOUT)
+        self.wait_until_ready()
+        return self
+
+    def wait_until_ready(self, timeout=120.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                break
+            try:
+                # Any response, the static files may not be built
+                requests.get(self.url + "/", timeout=1)
+                return
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("The backend did not start:\n" + self.output())
+
+    def output(self):
+        if self.log is None:
+            return ""
+        self.log.seek(0)
+        return self.log.read().decode("utf-8", "replace")[-4000:]
+
+    def __exit__(self, *exc_info):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(30)
+            self.log.close()
+
+
+def run_scenario(url, scenario, histories, concurrency, total):
+    """Replays histories from concurrency users until total requests are sent. Returns the latencies of the answered requests, the errors and the seconds taken."""
+    endpoint, approach, mode = scenario.split(":")
+    conversations = itertools.cycle(histories)
+    sent = itertools.count()
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def user():
+        session = requests.Session()
+        while True:
+            with lock:
+                conversation = next(conversations)
+            history = []
+            for question in conversation:
+                if next(sent) >= total:
+                    return
+                overrides = {"retrieval_mode": mode, "top": 3, "semantic_ranker": mode != "vectors", "semantic_captions": False}
+                if endpoint == "chat":
+                    history.append({"user": question})
+                    body = {"history": history, "approach": approach, "overrides": overrides}
+                else:
+                    body = {"question": question, "approach": approach, "overrides": overrides}
+                t = time.perf_counter()
+                try:
+                    response = session.post(f"{url}/{endpoint}", json=body, timeout=300)
+                    elapsed = time.perf_counter() - t
+                    answer = response.json().get("answer") if response.status_code == 200 else None
+                except (requests.RequestException, ValueError) as e:
+                    errors.append(type(e).__name__)
+                    continue
+                if answer is None:
+                    errors.append(str(response.status_code))
+                    continue
+                latencies.append(elapsed)
+                if endpoint == "chat":
+                    history[-1]["bot"] = answer
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(user) for _ in range(concurrency)]:
+            future.result()
+    return latencies, errors, time.perf_counter() - started
+
+
+def percentile(values, p):
+    """The nearest rank percentile p of values, None without values."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] if ordered else None
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / max(1, len(latencies) + len(errors)), 4),
+        "throughput": round(len(latencies) / elapsed, 3),
+        **{f"p{p}": round(1000 * percentile(latencies, p), 1) if latencies else None for p in (50, 95, 99)},
+    }
+
+
+def combine(runs):
+    """The result of repeated runs of a scenario: the medians of their throughputs and percentiles, which a single slow run does not move, and the total errors."""
+    requests, errors = sum(run["requests"] for run in runs), sum(run["errors"] for run in runs)
+    result = {"requests": requests, "errors": errors, "error_rate": round(errors / max(1, requests), 4), "throughput": round(statistics.median(run["throughput"] for run in runs), 3)}
+    for p in (50, 95, 99):
+        values = [run[f"p{p}"] for run in runs if run[f"p{p}"] is not None]
+        result[f"p{p}"] = round(statistics.median(values), 1) if values else None
+    return {**result, "runs": runs}
+
+
+def regressions(report, baseline, tolerance, max_error_rate):
+    """The results of report worse than the results of the same configuration and scenario in baseline, beyond tolerance, comparing the medians of their runs."""
+    found = []
+    for key, result in report["results"].items():
+        if result["error_rate"] > max_error_rate:
+            found.append(f"{key}: error rate {result['error_rate']:.1%}")
+        before = baseline["results"].get(key)
+        if before is None or result["p95"] is None or before["p95"] is None:
+            continue
+        if result["p95"] > before["p95"] * (1 + tolerance):
+            found.append(f"{key}: p95 {result['p95']} ms, was {before['p95']} ms")
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            found.append(f"{key}: throughput {result['throughput']}/s, was {before['throughput']}/s")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /ask and /chat of the backend per approach and retrieval mode, with fake OpenAI, Search and Blob services, "
+                                                 "under gunicorn worker and thread configurations. Compares with a baseline report to gate performance regressions.")
+    parser.add_argument("--backend", default=BACKEND, help="Backend directory to serve, for example a checkout of the base branch to record a baseline")
+    parser.add_argument("--compare-backend", help="Backend directory to compare with, for example a checkout of the base branch. Its runs alternate with the ones of --backend "
+                                                  "on the same fake services, so that both see the same load of the machine, and regressions fail the run")
+    parser.add_argument("--configs", default="default,1x1", help="Comma separated gunicorn configurations, WORKERSxTHREADS or default for the ones of gunicorn.conf.py")
+    parser.add_argument("--inprocess", action="store_true", help="Serve the backend of this checkout in this process with a threading WSGI server instead of gunicorn")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated ENDPOINT:APPROACH:RETRIEVAL_MODE to run")
+    parser.add_argument("--histories", help="JSON file with a list of conversations, each a list of questions, instead of the built in ones")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent users")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and run")
+    parser.add_argument("--warmup", type=int, help="Requests per scenario and run sent before the measured ones, which load tokenizers and clients (the number of concurrent users by default)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of every configuration, results are the medians of the runs")
+    parser.add_argument("--count", type=int, default=1000, help="Number of synthetic sections of the fake search service")
+    parser.add_argument("--latency-scale", type=float, default=0.2, help="Scale of the simulated latencies of the services")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of OpenAI calls answered with 429")
+    parser.add_argument("--retrieval-cache", action="store_true", help="Keep the retrieval and tool caches of the backend, which answer repeated questions without searching")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", help="Fail if results are worse than the ones of this report")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative increase of the median p95 and decrease of the median throughput against the baseline")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Fail if more requests than this fraction fail")
+    args = parser.parse_args()
+    if args.inprocess and args.compare_backend:
+        parser.error("--compare-backend needs gunicorn, it cannot be used with --inprocess")
+
+    histories = json.load(open(args.histories, encoding="utf-8")) if args.histories else HISTORIES
+    scenarios = args.scenarios.split(",")
+    configs = [("inprocess", None, None)] if args.inprocess else parse_configs(args.configs, os.path.join(args.backend, "gunicorn.conf.py"))
+    backends = [("head", args.backend)] + ([("base", args.compare_backend)] if args.compare_backend else [])
+    settings = {k: v for k, v in vars(args).items() if k not in ("backend", "compare_backend", "output", "baseline")}
+    reports = {label: {"settings": settings, "results": {}, "services": {}} for label, _ in backends}
+    runs = {label: {} for label, _ in backends}
+    env = {"ASK_APPROACHES": ",".join(sorted({s.split(":")[1] for s in scenarios if s.startswith("ask:")})),
+           "CHAT_APPROACHES": ",".join(sorted({s.split(":")[1] for s in scenarios if s.startswith("chat:")}))}
+    if not args.retrieval_cache:
+        env.update(RETRIEVAL_CACHE_SIZE="0", TOOL_CACHE_TTL="0")
+
+    with FakeServices(args.count, args.latency_scale, args.rate_limit) as services:
+        # Backends and configurations take turns in every repeat, so that a slower phase of a shared machine affects all of them
+        for repeat in range(args.repeats):
+            for label, backend_dir in backends:
+                for name, workers, threads in configs:
+                    with Backend(backend_dir, {**env, **services.environment()}, workers, threads) as backend:
+                        for scenario in scenarios:
+                            run_scenario(backend.url, scenario, histories, args.concurrency, args.concurrency if args.warmup is None else args.warmup)
+                            result = summarize(*run_scenario(backend.url, scenario, histories, args.concurrency, args.requests))
+                            runs[label].setdefault(f"{name} {scenario}", []).append(result)
+                            latencies = "  ".join(f"p{p} {result[f'p{p}'] or 0:>7.1f} ms" for p in (50, 95, 99))
+                            print(f"{repeat + 1}/{args.repeats} {label:<4} {name:<9} {scenario:<18} {result['throughput']:>7.2f}/s  {latencies}  {result['errors']} errors of {result['requests']}", flush=True)
+        for label, _ in backends:
+            reports[label]["results"] = {key: combine(results) for key, results in runs[label].items()}
+        reports["head"]["services"] = services.counts()
+
+    report = reports["head"]
+    if "base" in reports:
+        report["baseline"] = reports["base"]
+    for label, _ in backends:
+        for key, result in reports[label]["results"].items():
+            latencies = "  ".join(f"p{p} {result[f'p{p}'] or 0:>7.1f} ms" for p in (50, 95, 99))
+            print(f"median {label:<4} {key:<28} {result['throughput']:>7.2f}/s  {latencies}  {result['errors']} errors of {result['requests']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    baseline = reports.get("base")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if baseline is not None:
+        found = regressions(report, baseline, args.tolerance, args.max_error_rate)
+        for regression in found:
+            print(f"Regression: {regression}")
+        sys.exit(1 if found else 0)
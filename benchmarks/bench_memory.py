@@ -0,0 +1,49 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from legacytextsplitter import legacy_split_text  # noqa: E402
+from prepdocslib.textsplitter import TextSplitter  # noqa: E402
+
+SENTENCE = "Die Versicherung leistet bei Schäden (z.B. Diebstahl, Raub) weltweit; Ausnahmen regelt Abschnitt {}. "
+
+
+def generate_pages(pages, page_length):
+    """Yields the pages of a synthetic document one at a time, each with its own text like an extracted page."""
+    offset = 0
+    for page_num in range(pages):
+        text = ""
+        while len(text) < page_length:
+            text += SENTENCE.format(f"{page_num}.{len(text)}")
+        yield (page_num, offset, text)
+        offset += len(text)
+
+
+def measure(split, pages):
+    tracemalloc.start()
+    t = time.perf_counter()
+    sections = sum(1 for _ in split(pages))
+    elapsed = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return sections, elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the peak memory of splitting documents of growing length with the legacy splitter, which needs the whole page map, and the streaming TextSplitter.")
+    parser.add_argument("--pages", default="100,1000,3000", help="Comma separated page counts of the synthetic documents")
+    parser.add_argument("--pagelength", type=int, default=3000, help="Characters per page")
+    args = parser.parse_args()
+
+    for pages in [int(p) for p in args.pages.split(",")]:
+        for name, split, materialize in [("legacy", legacy_split_text, True), ("streaming", TextSplitter().split_pages, False)]:
+            # The legacy splitter takes a complete page map, the streaming splitter reads the pages as they are extracted
+            def run(page_stream):
+                return split(list(page_stream) if materialize else page_stream)
+            sections, elapsed, peak = measure(run, generate_pages(pages, args.pagelength))
+            print(f"{name:<10} {pages:>6} pages {sections:>8} sections {elapsed:>8.2f} s  peak {peak / 1024 / 1024:>8.2f} MB")
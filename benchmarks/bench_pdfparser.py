@@ -0,0 +1,28 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from prepdocslib.pdfparser import PdfParser  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report how local PDF parsing (text extraction and page splitting) scales with the number of worker processes.")
+    parser.add_argument("--files", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "*.pdf"), help="PDF files to parse")
+    parser.add_argument("--workers", default=f"1,2,4,{os.cpu_count()}", help="Comma separated worker counts to compare")
+    parser.add_argument("--nosplit", action="store_true", help="Only extract text, don't split the PDFs into single page documents")
+    args = parser.parse_args()
+
+    filenames = sorted(glob.glob(args.files))
+    baseline = None
+    print(f"{len(filenames)} files, {os.cpu_count()} CPUs")
+    for workers in sorted(set(int(w) for w in args.workers.split(","))):
+        with PdfParser(workers) as pdf_parser:
+            t = time.perf_counter()
+            pages = sum(sum(1 for _ in p) for _, p in pdf_parser.iter_files(filenames, split_pages=not args.nosplit) if p)
+            elapsed = time.perf_counter() - t
+        pages_per_second = pages / elapsed
+        baseline = baseline or pages_per_second
+        print(f"workers={workers:<3} {pages:>6} pages {elapsed:>8.2f} s {pages_per_second:>8.1f} pages/s  x{pages_per_second / baseline:.2f}")
@@ -0,0 +1,135 @@
+import argparse
+import contextlib
+import cProfile
+import os
+import pstats
+import statistics
+import sys
+import time
+
+import openai
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCHMARKS, "..", "app", "backend")
+sys.path.insert(0, BACKEND)
+
+from bench_load import HISTORIES  # noqa: E402
+from core.recording import Recording  # noqa: E402
+
+AZURE_SEARCH_SERVICE = os.environ.get("AZURE_SEARCH_SERVICE") or "gptkb"
+AZURE_SEARCH_INDEX = os.environ.get("AZURE_SEARCH_INDEX") or "gptkbindex"
+AZURE_OPENAI_SERVICE = os.environ.get("AZURE_OPENAI_SERVICE") or "myopenai"
+AZURE_OPENAI_GPT_DEPLOYMENT = os.environ.get("AZURE_OPENAI_GPT_DEPLOYMENT") or "davinci"
+AZURE_OPENAI_CHATGPT_DEPLOYMENT = os.environ.get("AZURE_OPENAI_CHATGPT_DEPLOYMENT") or "chat"
+AZURE_OPENAI_CHATGPT_MODEL = os.environ.get("AZURE_OPENAI_CHATGPT_MODEL") or "gpt-35-turbo"
+AZURE_OPENAI_EMB_DEPLOYMENT = os.environ.get("AZURE_OPENAI_EMB_DEPLOYMENT") or "embedding"
+KB_FIELDS_CONTENT = os.environ.get("KB_FIELDS_CONTENT") or "content"
+KB_FIELDS_SOURCEPAGE = os.environ.get("KB_FIELDS_SOURCEPAGE") or "sourcepage"
+
+SCENARIOS = ["ask:rtr", "ask:rrr", "ask:rda", "chat:rrr"]
+
+
+def create_approach(scenario, search_client):
+    # Without retrieval and tool caches, so that every run makes the recorded calls
+    if scenario == "ask:rtr":
+        from approaches.retrievethenread import RetrieveThenReadApproach
+        return RetrieveThenReadApproach(search_client, AZURE_OPENAI_CHATGPT_DEPLOYMENT, AZURE_OPENAI_CHATGPT_MODEL, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT)
+    if scenario == "ask:rrr":
+        from approaches.readretrieveread import ReadRetrieveReadApproach
+        return ReadRetrieveReadApproach(search_client, AZURE_OPENAI_GPT_DEPLOYMENT, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT)
+    if scenario == "ask:rda":
+        from approaches.readdecomposeask import ReadDecomposeAsk
+        return ReadDecomposeAsk(search_client, AZURE_OPENAI_GPT_DEPLOYMENT, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT)
+    if scenario == "chat:rrr":
+        from approaches.chatreadretrieveread import ChatReadRetrieveReadApproach
+        return ChatReadRetrieveReadApproach(search_client, AZURE_OPENAI_CHATGPT_DEPLOYMENT, AZURE_OPENAI_CHATGPT_MODEL, AZURE_OPENAI_EMB_DEPLOYMENT, KB_FIELDS_SOURCEPAGE, KB_FIELDS_CONTENT)
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def run_histories(approach, scenario, histories, overrides):
+    """Asks every question of histories, as follow up questions in a chat for chat scenarios. Returns the seconds per question."""
+    elapsed = []
+    for conversation in histories:
+        history = []
+        for question in conversation:
+            t = time.perf_counter()
+            if scenario.startswith("chat:"):
+                history.append({"user": question})
+                history[-1]["bot"] = approach.run(history, overrides)["answer"]
+            else:
+                approach.run(question, overrides)
+            elapsed.append(time.perf_counter() - t)
+    return elapsed
+
+
+@contextlib.contextmanager
+def services(args, recording):
+    """Points the OpenAI SDK and a SearchClient recording or replaying with recording at the services. Yields the SearchClient."""
+    openai.requestssession = recording.requests_session
+    openai.api_version = "2023-05-15"
+    if args.replay:
+        # The host is not part of recorded requests
+        openai.api_type, openai.api_base, openai.api_key = "azure", "https://replay.openai.azure.com", "replay"
+        yield SearchClient("https://replay.search.windows.net", AZURE_SEARCH_INDEX, AzureKeyCredential("replay"), transport=recording.transport())
+    elif args.fake:
+        from fakeservices import FakeServices
+        with FakeServices(args.count, args.latency_scale) as fake:
+            urls = fake.environment()
+            openai.api_type, openai.api_base, openai.api_key = "azure", urls["FAKE_OPENAI_URL"], "local"
+            yield SearchClient(urls["FAKE_SEARCH_URL"], AZURE_SEARCH_INDEX, AzureKeyCredential("local"), transport=recording.transport())
+    else:
+        from azure.identity import DefaultAzureCredential
+        credential = DefaultAzureCredential(exclude_shared_token_cache_credential=True)
+        openai.api_type, openai.api_base = "azure_ad", f"https://{AZURE_OPENAI_SERVICE}.openai.azure.com"
+        openai.api_key = credential.get_token("https://cognitiveservices.azure.com/.default").token
+        yield SearchClient(f"https://{AZURE_SEARCH_SERVICE}.search.windows.net", AZURE_SEARCH_INDEX, credential, transport=recording.transport())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record the OpenAI and Cognitive Search calls of the approaches answering fixed conversations, or replay them to measure "
+                                                 "and profile the time the approaches spend in the backend itself, without the services.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--record", metavar="FILE", help="Call the services configured like the backend, or the fake ones with --fake, and record the calls to FILE, .jsonl or .jsonl.gz")
+    mode.add_argument("--replay", metavar="FILE", help="Answer the calls from a recording")
+    parser.add_argument("--fake", action="store_true", help="Record the fake services of fakeservices.py instead of the configured ones")
+    parser.add_argument("--count", type=int, default=1000, help="Number of synthetic sections of the fake search service")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated ENDPOINT:APPROACH to run")
+    parser.add_argument("--retrieval-mode", default="hybrid", help="Retrieval mode of the requests")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="Replay: scale of the recorded latencies to reproduce, 0 answers right away. Record with --fake: scale of the simulated latencies")
+    parser.add_argument("--runs", type=int, default=5, help="Replay: runs of all questions per scenario")
+    parser.add_argument("--profile", type=int, metavar="TOP", help="Replay: profile the runs and print the TOP functions by cumulative time per scenario")
+    args = parser.parse_args()
+
+    # The employee tool of rrr reads its data relative to the backend directory
+    os.chdir(BACKEND)
+    recording = Recording(args.replay, "replay", args.latency_scale) if args.replay else Recording(args.record, "record")
+    overrides = {"retrieval_mode": args.retrieval_mode, "top": 3, "semantic_ranker": args.retrieval_mode != "vectors", "semantic_captions": False}
+    questions = sum(len(conversation) for conversation in HISTORIES)
+
+    with services(args, recording) as search_client:
+        for scenario in args.scenarios.split(","):
+            approach = create_approach(scenario, search_client)
+            if args.record:
+                elapsed = run_histories(approach, scenario, HISTORIES, overrides)
+                print(f"{scenario:<9} recorded {questions} questions in {sum(elapsed):.2f} s")
+                continue
+            # The first run loads tokenizers and sets up clients
+            run_histories(approach, scenario, HISTORIES, overrides)
+            replayed = recording.replayed
+            profiler = cProfile.Profile() if args.profile else None
+            if profiler is not None:
+                profiler.enable()
+            elapsed = [e for _ in range(args.runs) for e in run_histories(approach, scenario, HISTORIES, overrides)]
+            if profiler is not None:
+                profiler.disable()
+            calls = (recording.replayed - replayed) / (args.runs * questions)
+            print(f"{scenario:<9} median {1000 * statistics.median(elapsed):>7.2f} ms, mean {1000 * statistics.mean(elapsed):>7.2f} ms per question, "
+                  f"{calls:.1f} calls replayed per question")
+            if profiler is not None:
+                pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(args.profile)
+
+    if args.record:
+        recording.save()
+        print(f"{len(recording.entries)} calls recorded to {args.record}")
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import requests
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import HttpTransport, RequestsTransportResponse
+from azure.search.documents import SearchClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from core.localsearch import LocalSearchClient  # noqa: E402
+
+from fakes import fake_embedding  # noqa: E402
+
+WORDS = "Versicherung Leistung Beitrag Vertrag Zahnersatz Tarif Kinder Police Schutz Kosten Erstattung Reise Storno Krankenhaus Brille".split()
+
+
+class LocalSearchTransport(HttpTransport):
+    """
+    Answers the search requests of a SearchClient with a LocalSearchClient, serialized like responses of the
+    service, so that the client's serialization and deserialization can be measured without the service. Fields
+    in hidden are left out of results like non-retrievable fields. received and responded are the times the last
+    request was received and answered.
+    """
+
+    def __init__(self, local_client: LocalSearchClient, hidden=()):
+        self.local_client = local_client
+        self.hidden = set(hidden)
+        self.response_bytes = 0
+        self.received = self.responded = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, request, **kwargs):
+        self.received = time.perf_counter()
+        body = search_response(self.local_client, json.loads(request.body if isinstance(request.body, (str, bytes)) else request.data), self.hidden)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json; odata.metadata=none; charset=utf-8"
+        response._content = json.dumps(body).encode("utf-8")
+        self.response_bytes += len(response._content)
+        self.responded = time.perf_counter()
+        return RequestsTransportResponse(request, response)
+
+
+def search_response(local_client, query, hidden=()):
+    """The body of the response of the search service to the body of a search request, answered with local_client."""
+    vector = query.get("vector") or {}
+    results = local_client.search(
+        query.get("search"), filter=query.get("filter"), select=query["select"].split(",") if query.get("select") else None, top=query.get("top"),
+        skip=query.get("skip"), include_total_count=query.get("count", False), vector=vector.get("value"), top_k=vector.get("k"),
+        vector_fields=vector.get("fields"), query_caption=query.get("captions"))
+    value = []
+    for result in results:
+        document = {k: v for k, v in result.items() if k not in hidden and v is not None}
+        if document.get("@search.captions") is not None:
+            document["@search.captions"] = [{"text": c.text, "highlights": c.highlights} for c in document["@search.captions"]]
+        value.append(document)
+    body = {"value": value}
+    if results.get_count() is not None:
+        body["@odata.count"] = results.get_count()
+    return body
+
+
+def synthetic_sections(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        content = ". ".join(" ".join(rng.choice(WORDS) + rng.choice(["", "n", "s"]) for _ in range(10)) for _ in range(15)) + "."
+        yield {"id": f"section-{i}", "content": content, "category": None, "sourcepage": f"doc-{i // 10}-{i % 10}.pdf", "sourcefile": f"doc-{i // 10}.pdf",
+               "embedding": fake_embedding(content)}
+
+
+def measure(local_client, queries, hidden, select, top, captions):
+    transport = LocalSearchTransport(local_client, hidden)
+    search_client = SearchClient("https://local.search.windows.net", "local", AzureKeyCredential("local"), transport=transport)
+    vectors = [fake_embedding(query) for query in queries]
+    request_time = response_time = 0.0
+    for query, vector in zip(queries, vectors):
+        t = time.perf_counter()
+        for document in search_client.search(query, select=select, top=top, vector=vector, top_k=50, vector_fields="embedding",
+                                             query_caption="extractive|highlight-false" if captions else None):
+            pass
+        request_time += transport.received - t
+        response_time += time.perf_counter() - transport.responded
+    return transport.response_bytes / len(queries), 1000 * request_time / len(queries), 1000 * response_time / len(queries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the size of hybrid search responses and the client time to deserialize them with and without the embedding field in the results, through the SearchClient of the app.")
+    parser.add_argument("--sections", help="Search the sections of a file written by prepdocs --export instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=1000, help="Number of synthetic sections")
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries")
+    parser.add_argument("--top", default="3,50", help="Comma separated numbers of results per query to compare")
+    args = parser.parse_args()
+
+    local_client = LocalSearchClient.from_file(args.sections) if args.sections else LocalSearchClient(synthetic_sections(args.count))
+    rng = random.Random(1)
+    queries = [" ".join(rng.sample(WORDS, 3)) for _ in range(args.queries)]
+    print(f"{len(local_client)} sections, {len(queries)} hybrid queries")
+    for top in [int(t) for t in args.top.split(",")]:
+        for name, hidden, select, captions in [
+            ("retrievable", (), None, False),
+            ("hidden", ("embedding",), None, False),
+            ("select", (), ["sourcepage", "content"], False),
+            ("select+captions", (), ["sourcepage", "content"], True),
+        ]:
+            size, request_ms, response_ms = measure(local_client, queries, hidden, select, top, captions)
+            print(f"top={top:<4} {name:<16} {size / 1024:>9.1f} KB/response {response_ms:>8.2f} ms to deserialize {request_ms:>8.2f} ms to serialize the request")
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend")
+
+# Runs in a new process like a gunicorn worker without preload_app: imports the app, with a stand-in for the Azure
+# AD credential, then forks like gunicorn does from a preloaded master and times the forked worker until it answers
+# a request. Prints the times as JSON.
+WORKER = """
+import json, logging, os, sys, time
+logging.disable(logging.WARNING)
+started = time.perf_counter()
+import azure.identity
+from azure.core.credentials import AccessToken
+
+class LocalCredential:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_token(self, *scopes, **kwargs):
+        return AccessToken("local", int(time.time()) + 3600)
+
+azure.identity.DefaultAzureCredential = LocalCredential
+sys.path.insert(0, os.getcwd())
+import app
+imported = time.perf_counter() - started
+
+read, write = os.pipe()
+forked = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    try:
+        from werkzeug.test import Client
+        app.after_fork()
+        Client(app.app).get("/")
+        os.write(write, b"x")
+    finally:
+        os._exit(0)
+os.close(write)
+answered = os.read(read, 1)
+recycled = time.perf_counter() - forked
+os.waitpid(pid, 0)
+if not answered:
+    sys.exit("The forked worker failed")
+print(json.dumps({"import": imported, "recycle": recycled}))
+"""
+
+
+def measure(env, runs):
+    rows = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", WORKER], cwd=BACKEND, env={**os.environ, **env}, capture_output=True, text=True, check=True).stdout
+        rows.append(json.loads(output.strip().splitlines()[-1]))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the time a worker of the backend takes to start on its own and when forked from a preloaded app, for different sets of enabled approaches.")
+    parser.add_argument("--runs", type=int, default=5, help="Worker starts per configuration")
+    args = parser.parse_args()
+
+    configurations = [
+        ("all approaches", {"ASK_APPROACHES": "rtr,rrr,rda", "CHAT_APPROACHES": "rrr"}),
+        ("rtr and chat", {"ASK_APPROACHES": "rtr", "CHAT_APPROACHES": "rrr"}),
+        ("chat only", {"ASK_APPROACHES": "", "CHAT_APPROACHES": "rrr"}),
+    ]
+    for name, env in configurations:
+        rows = measure(env, args.runs)
+        print(f"{name:<16} start {statistics.median(r['import'] for r in rows):.2f} s, "
+              f"recycled from preload {1000 * statistics.median(r['recycle'] for r in rows):.1f} ms (median of {args.runs})")
@@ -0,0 +1,71 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from legacytextsplitter import legacy_split_text  # noqa: E402
+from prepdocslib.formrecognizer import LAYOUT_MODEL_ID, LayoutCache, layout_to_page_map  # noqa: E402
+from prepdocslib.textsplitter import TextSplitter  # noqa: E402
+
+
+def load_page_maps(pattern, layout_cache=None):
+    from pypdf import PdfReader
+
+    page_maps = []
+    for filename in sorted(glob.glob(pattern)):
+        if os.path.splitext(filename)[1].lower() != ".pdf":
+            continue
+        if layout_cache:
+            # Prefer the Form Recognizer results cached by prepdocs, they include the tables as html
+            with open(filename, "rb") as f:
+                result = layout_cache.get(LayoutCache.key(f.read(), LAYOUT_MODEL_ID))
+            if result is not None:
+                page_maps.append(layout_to_page_map(result))
+                continue
+        offset = 0
+        page_map = []
+        for page_num, page in enumerate(PdfReader(filename).pages):
+            page_text = page.extract_text()
+            page_map.append((page_num, offset, page_text))
+            offset += len(page_text)
+        page_maps.append(page_map)
+    return page_maps
+
+
+def synthetic_page_maps(pages, page_length):
+    sentence = "Die Versicherung leistet bei Schäden (z.B. Diebstahl, Raub) weltweit; Ausnahmen regelt Abschnitt 4. "
+    page_text = (sentence * (page_length // len(sentence) + 1))[:page_length]
+    return [[(i, i * page_length, page_text) for i in range(pages)]]
+
+
+def run(name, split, page_maps, repeat):
+    chars = sum(len(p[2]) for page_map in page_maps for p in page_map)
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        sections = sum(1 for page_map in page_maps for _ in split(page_map))
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<12} {sections:>8} sections {best * 1000:>10.1f} ms {chars / best / 1e6:>8.2f} Mchars/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the throughput of the legacy prepdocs splitter with TextSplitter in character and token mode.")
+    parser.add_argument("--files", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "*.pdf"), help="PDF files whose text (extracted with pypdf) is split")
+    parser.add_argument("--layoutcache", help="Use the Form Recognizer results cached by prepdocs in this directory where available")
+    parser.add_argument("--synthetic", type=int, default=0, help="Split a synthetic document with this many pages instead of the PDF files")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best one is reported")
+    parser.add_argument("--tokens", action="store_true", help="Also benchmark token mode (needs the cl100k_base tiktoken encoding)")
+    args = parser.parse_args()
+
+    page_maps = synthetic_page_maps(args.synthetic, 3000) if args.synthetic else load_page_maps(args.files, LayoutCache(args.layoutcache) if args.layoutcache else None)
+    run("legacy", legacy_split_text, page_maps, args.repeat)
+    run("chars", TextSplitter().split_pages, page_maps, args.repeat)
+    if args.tokens:
+        import tiktoken
+
+        run("tokens", TextSplitter(250, 25, 25, token_encoding=tiktoken.get_encoding("cl100k_base")).split_pages, page_maps, args.repeat)
@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from bench_projection import search_response, synthetic_sections  # noqa: E402
+from core.localsearch import LocalSearchClient  # noqa: E402
+
+from fakes import fake_embedding  # noqa: E402
+
+# Typical latencies of the services per call in seconds
+LATENCY = {"chat/completions": 1.5, "completions": 1.0, "embeddings": 0.05, "search": 0.05, "blob": 0.02}
+
+_SOURCE_RE = re.compile(r"([\w\-]+\.pdf):")
+_OPENAI_PATH_RE = re.compile(r"/openai/deployments/[^/]+/(chat/completions|completions|embeddings)$")
+
+
+def _json(status, body, headers=None):
+    return status, {"Content-Type": "application/json", **(headers or {})}, json.dumps(body).encode("utf-8")
+
+
+class FakeService:
+    """
+    A service answering requests with handle(method, path, headers, body), which returns the status, headers and
+    body of the response, after the latency of the service scaled by latency_scale and jittered by up to a half.
+    """
+
+    name = "service"
+
+    def __init__(self, latency_scale=1.0, seed=0):
+        self.latency_scale = latency_scale
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, kind):
+        with self._lock:
+            self.calls += 1
+            jitter = self._random.uniform(0.5, 1.5)
+        if self.latency_scale:
+            time.sleep(LATENCY[kind] * self.latency_scale * jitter)
+
+    def handle(self, method, path, headers, body):
+        raise NotImplementedError
+
+
+class FakeOpenAI(FakeService):
+    """
+    Azure OpenAI with chat completions, completions and embeddings. Replies like a model would to the prompts of the
+    approaches: search queries and answers citing the first source of the prompt for chat, and actions of the agents
+    of rrr and rda, searching once before answering, for completions. A rate_limit fraction of the calls is answered
+    with 429 like an exhausted quota.
+    """
+
+    name = "openai"
+
+    def __init__(self, latency_scale=1.0, rate_limit=0.0, seed=0):
+        super().__init__(latency_scale, seed)
+        self.rate_limit = rate_limit
+        self.rate_limited = 0
+
+    def handle(self, method, path, headers, body):
+        match = _OPENAI_PATH_RE.match(urlparse(path).path)
+        if method != "POST" or match is None:
+            return _json(404, {"error": {"code": "404", "message": "Resource not found"}})
+        operation = match.group(1)
+        with self._lock:
+            limited = self._random.random() < self.rate_limit
+        if limited:
+            with self._lock:
+                self.rate_limited += 1
+            return _json(429, {"error": {"code": "429", "message": "Requests have exceeded the call rate limit of your current pricing tier."}}, {"Retry-After": "1"})
+        self.wait(operation)
+        request = json.loads(body)
+        if operation == "embeddings":
+            texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            return _json(200, {"object": "list", "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text)} for i, text in enumerate(texts)],
+                               "usage": self._usage(" ".join(texts), "")})
+        if operation == "chat/completions":
+            prompt = "\n".join(message["content"] for message in request["messages"])
+            text = self.chat_reply(request["messages"])
+            return _json(200, {"id": "chatcmpl-local", "object": "chat.completion", "created": int(time.time()), "model": request.get("model", "gpt-35-turbo"),
+                               "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                               "usage": self._usage(prompt, text)})
+        prompts = request["prompt"] if isinstance(request["prompt"], list) else [request["prompt"]]
+        texts = [self.completion_reply(prompt) for prompt in prompts]
+        return _json(200, {"id": "cmpl-local", "object": "text_completion", "created": int(time.time()), "model": "text-davinci-003",
+                           "choices": [{"text": text, "index": i, "finish_reason": "stop", "logprobs": None} for i, text in enumerate(texts)],
+                           "usage": self._usage("".join(prompts), "".join(texts))})
+
+    @staticmethod
+    def _usage(prompt, completion):
+        # About four characters per token
+        return {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(completion) // 4, "total_tokens": (len(prompt) + len(completion)) // 4}
+
+    @staticmethod
+    def chat_reply(messages):
+        question = messages[-1]["content"]
+        if question.startswith("Generate search query for: "):
+            return question[len("Generate search query for: "):].rstrip("?")
+        source = _SOURCE_RE.search("\n".join(message["content"] for message in messages))
+        return "Die Antwort steht in den Bedingungen" + (f" [{source.group(1)}]." if source else ".")
+
+    @staticmethod
+    def completion_reply(prompt):
+        head, _, tail = prompt.rpartition("Question: ")
+        question = tail.split("\n")[0].strip()
+        source = _SOURCE_RE.search(tail)
+        if prompt.startswith("Plan the actions"):
+            return f"Search[{question}]"
+        if tail.rstrip().endswith("Answer:"):
+            return "Die Antwort steht in den Bedingungen" + (f" <{source.group(1)}>." if source else ".")
+        searched = "\nObservation:" in tail
+        if "Action Input:" in head:
+            # The zero shot agent of rrr
+            if not searched:
+                return f" I need to search the documents.\nAction: CognitiveSearch\nAction Input: {question}"
+            return " I now know the final answer.\nFinal Answer: Die Antwort steht in den Bedingungen" + (f" [{source.group(1)}]" if source else "")
+        # The ReAct agent of rda
+        if not searched:
+            return f" I need to search {question}.\nAction: Search[{question}]"
+        return " I have the facts to answer.\nAction: Finish[Die Antwort steht in den Bedingungen" + (f" <{source.group(1)}>" if source else "") + "]"
+
+
+class FakeSearch(FakeService):
+    """Cognitive Search answering the search requests of a SearchClient from a LocalSearchClient, with the embedding field not retrievable."""
+
+    name = "search"
+
+    def __init__(self, local_client, latency_scale=1.0, seed=0):
+        super().__init__(latency_scale, seed)
+        self.local_client = local_client
+
+    def handle(self, method, path, headers, body):
+        if method != "POST" or not urlparse(path).path.endswith("/docs/search.post.search"):
+            return _json(404, {"error": {"code": "", "message": "Not found"}})
+        self.wait("search")
+        return _json(200, search_response(self.local_client, json.loads(body), hidden={"embedding"}),
+                     {"Content-Type": "application/json; odata.metadata=none; charset=utf-8"})
+
+
+class FakeBlob(FakeService):
+    """Blob Storage serving the properties of a container, with the search index version in its metadata, and the blobs in it."""
+
+    name = "blob"
+
+    def __init__(self, blobs, index_version="1", latency_scale=1.0, seed=0):
+        super().__init__(latency_scale, seed)
+        self.blobs = blobs
+        self.index_version = index_version
+
+    def handle(self, method, path, headers, body):
+        url = urlparse(path)
+        # Path style URLs of an account: /account/container[/blob]
+        parts = url.path.strip("/").split("/", 2)
+        common = {"ETag": '"0x8DB0000000000001"', "Last-Modified": formatdate(usegmt=True), "x-ms-version": headers.get("x-ms-version", "2021-12-02")}
+        if method not in ("GET", "HEAD") or len(parts) < 2:
+            return 404, {**common, "x-ms-error-code": "ResourceNotFound", "Content-Type": "application/xml"}, b""
+        self.wait("blob")
+        if len(parts) == 2 and parse_qs(url.query).get("restype") == ["container"]:
+            return 200, {**common, "x-ms-meta-searchindexversion": self.index_version, "x-ms-lease-status": "unlocked",
+                         "x-ms-lease-state": "available", "x-ms-has-immutability-policy": "false", "x-ms-has-legal-hold": "false"}, b""
+        data = self.blobs.get(parts[2]) if len(parts) == 3 else None
+        if data is None:
+            return 404, {**common, "x-ms-error-code": "BlobNotFound", "Content-Type": "application/xml"}, b""
+        blob_headers = {**common, "Content-Type": "application/pdf", "x-ms-blob-type": "BlockBlob", "Accept-Ranges": "bytes",
+                        "x-ms-creation-time": common["Last-Modified"], "x-ms-server-encrypted": "true"}
+        range_match = re.match(r"bytes=(\d+)-(\d*)", headers.get("x-ms-range") or headers.get("Range") or "")
+        if range_match is None:
+            return 200, blob_headers, data
+        start = int(range_match.group(1))
+        end = min(int(range_match.group(2)) if range_match.group(2) else len(data) - 1, len(data) - 1)
+        return 206, {**blob_headers, "Content-Range": f"bytes {start}-{end}/{len(data)}"}, data[start:end + 1]
+
+
+def synthetic_blobs(sections):
+    """A small PDF-like blob for every source page of sections."""
+    return {section["sourcepage"]: b"%PDF-1.4\n% " + section["content"][:200].encode("utf-8") + b"\n%%EOF\n" for section in sections}
+
+
+def serve(service, host="127.0.0.1", port=0):
+    """Serves service over HTTP/1.1 with keep-alive from a background thread. Returns the server, its URL is server.url."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, headers, content = service.handle(self.command, self.path, self.headers, body)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = do_HEAD = _respond
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name=f"fake-{service.name}", daemon=True).start()
+    return server
+
+
+class FakeServices:
+    """The fake OpenAI, Search and Blob services of the backend on local ports, with count synthetic sections."""
+
+    def __init__(self, count=1000, latency_scale=1.0, rate_limit=0.0, seed=0):
+        sections = list(synthetic_sections(count, seed))
+        self.openai = FakeOpenAI(latency_scale, rate_limit, seed)
+        self.search = FakeSearch(LocalSearchClient(sections), latency_scale, seed)
+        self.blob = FakeBlob(synthetic_blobs(sections), latency_scale=latency_scale, seed=seed)
+        self.servers = []
+
+    def __enter__(self):
+        self.servers = [serve(service) for service in (self.openai, self.search, self.blob)]
+        return self
+
+    def __exit__(self, *exc_info):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def environment(self):
+        """The environment variables of loadapp.py pointing the backend at the services."""
+        openai_server, search_server, blob_server = self.servers
+        return {"FAKE_OPENAI_URL": openai_server.url, "FAKE_SEARCH_URL": search_server.url, "FAKE_BLOB_URL": blob_server.url}
+
+    def counts(self):
+        return {"openai_calls": self.openai.calls, "openai_rate_limited": self.openai.rate_limited, "search_calls": self.search.calls, "blob_calls": self.blob.calls}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run fake Azure OpenAI, Cognitive Search and Blob Storage services for the backend, served with benchmarks/loadapp.py.")
+    parser.add_argument("--count", type=int, default=1000, help="Number of synthetic sections")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Scale of the simulated service latencies")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of OpenAI calls answered with 429")
+    args = parser.parse_args()
+
+    with FakeServices(args.count, args.latency_scale, args.rate_limit) as services:
+        for name, value in services.environment().items():
+            print(f"export {name}={value}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
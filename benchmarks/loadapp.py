@@ -0,0 +1,43 @@
+"""
+The backend with its Azure services replaced by the fake services of fakeservices.py at FAKE_OPENAI_URL,
+FAKE_SEARCH_URL and FAKE_BLOB_URL, and Azure AD by a local credential. Serve it from the backend directory, for
+example with gunicorn -c gunicorn.conf.py --pythonpath ../../benchmarks loadapp:app, as bench_load.py does.
+"""
+import base64
+import os
+import time
+
+import azure.identity
+import azure.search.documents
+import azure.storage.blob
+from azure.core.credentials import AccessToken, AzureKeyCredential
+
+_SearchClient = azure.search.documents.SearchClient
+_BlobServiceClient = azure.storage.blob.BlobServiceClient
+
+
+class LocalCredential:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_token(self, *scopes, **kwargs):
+        return AccessToken("local", int(time.time()) + 3600)
+
+
+def search_client(endpoint, index_name, credential, **kwargs):
+    # Azure AD tokens are only sent over https, keys also over http
+    return _SearchClient(os.environ["FAKE_SEARCH_URL"], index_name, AzureKeyCredential("local"), **kwargs)
+
+
+def blob_service_client(account_url, credential=None, **kwargs):
+    return _BlobServiceClient(os.environ["FAKE_BLOB_URL"] + "/local", credential={"account_name": "local", "account_key": base64.b64encode(b"local").decode()}, **kwargs)
+
+
+azure.identity.DefaultAzureCredential = LocalCredential
+azure.search.documents.SearchClient = search_client
+azure.storage.blob.BlobServiceClient = blob_service_client
+
+import app as backend  # noqa: E402
+
+backend.openai.api_base = os.environ["FAKE_OPENAI_URL"]
+app = backend.app
@@ -0,0 +1,33 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend"))
+
+from core.ivfpq import DEFAULT_NPROBE, DEFAULT_REFINE  # noqa: E402
+from core.localsearch import LocalSearchClient  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the vector index that the backend uses with LOCAL_SEARCH_VECTOR_INDEX over the sections of LOCAL_SEARCH_SECTIONS. Run it again whenever the sections are exported again, the backend refuses an index of other sections.",
+        epilog="Example: buildvectorindex.py sections.jsonl.gz vectors.ivfpq"
+    )
+    parser.add_argument("sections", help="File written by prepdocs --export")
+    parser.add_argument("output", help="File to write the index to, replaced atomically")
+    parser.add_argument("--nlist", type=int, required=False, help="Optional. Number of inverted lists, about the square root of the number of sections by default")
+    parser.add_argument("--subquantizers", type=int, required=False, help="Optional. Bytes per vector code, a divisor of the dimensions with 16 dimensions each by default")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="Lists searched per query, more is slower and finds more of the nearest sections")
+    parser.add_argument("--refine", type=int, default=DEFAULT_REFINE, help="Candidates per requested result whose similarity is computed exactly")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    client = LocalSearchClient.from_file(args.sections)
+    if args.verbose:
+        print(f"Loaded {len(client)} sections from '{args.sections}' in {time.perf_counter() - start:.1f} s")
+    start = time.perf_counter()
+    vector_index = client.build_vector_index(nlist=args.nlist, subquantizers=args.subquantizers, nprobe=args.nprobe, refine=args.refine)
+    vector_index.save(args.output)
+    if args.verbose:
+        print(f"Indexed {len(vector_index)} embeddings in {vector_index.nlist} lists to '{args.output}' in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import urllib.request
+
+# The files of the encodings, as tiktoken downloads them
+ENCODINGS = {
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+    "p50k_base": "https://openaipublic.blob.core.windows.net/encodings/p50k_base.tiktoken",
+}
+
+
+def bundle(directory: str, names: list[str]):
+    """Downloads the encodings to directory under the names tiktoken looks for in its TIKTOKEN_CACHE_DIR."""
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        url = ENCODINGS[name]
+        path = os.path.join(directory, hashlib.sha1(url.encode()).hexdigest())
+        if os.path.exists(path):
+            print(f"{name} already bundled")
+            continue
+        with urllib.request.urlopen(url) as response:
+            contents = response.read()
+        with open(path + ".tmp", "wb") as f:
+            f.write(contents)
+        os.replace(path + ".tmp", path)
+        print(f"Bundled {name}, {len(contents)} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bundle the tiktoken encodings with the backend, so that workers do not download them when they start.")
+    parser.add_argument("directory", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app", "backend", "tiktoken_cache"),
+                        help="Directory for the encodings, the tiktoken_cache directory of the backend by default")
+    parser.add_argument("--encoding", action="append", choices=sorted(ENCODINGS), help="Encoding to bundle, cl100k_base of the ChatGPT models by default")
+    args = parser.parse_args()
+    bundle(args.directory, args.encoding or ["cl100k_base"])
@@ -1,13 +1,12 @@
 import argparse
 import base64
 import glob
-import html
-import io
 import os
 import re
-import time
+import uuid
 
 import openai
+import tiktoken
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import AzureDeveloperCliCredential
@@ -28,12 +27,23 @@ from azure.search.documents.indexes.models import (
     VectorSearchAlgorithmConfiguration,
 )
 from azure.storage.blob import BlobServiceClient
-from pypdf import PdfReader, PdfWriter
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from prepdocslib.blobmanager import BlobManager
+from prepdocslib.dedup import NearDuplicateDetector, SectionDeduplicator
+from prepdocslib.formrecognizer import LayoutCache, analyze_layout, iter_layout_pages
+from prepdocslib.indexer import BulkIndexer, remove_documents
+from prepdocslib.manifest import IngestionManifest
+from prepdocslib.pdfparser import PdfParser
+from prepdocslib.profiler import Profiler
+from prepdocslib.sectionfile import SectionWriter, read_sections
+from prepdocslib.textsplitter import TextSplitter
+
 MAX_SECTION_LENGTH = 1000
 SENTENCE_SEARCH_LIMIT = 100
 SECTION_OVERLAP = 100
+SENTENCE_SEARCH_LIMIT_TOKENS = 25
+SECTION_OVERLAP_TOKENS = 25
 
 def blob_name_from_file_page(filename, page = 0):
     if os.path.splitext(filename)[1].lower() == ".pdf":
@@ -41,166 +51,68 @@ def blob_name_from_file_page(filename, page = 0):
     else:
         return os.path.basename(filename)
 
-def upload_blobs(filename):
-    blob_service = BlobServiceClient(account_url=f"https://{args.storageaccount}.blob.core.windows.net", credential=storage_creds)
-    blob_container = blob_service.get_container_client(args.container)
-    if not blob_container.exists():
-        blob_container.create_container()
-
+def upload_blobs(filename, pdf_pages=None):
     # if file is PDF split into pages and upload each page as a separate blob
     if os.path.splitext(filename)[1].lower() == ".pdf":
-        reader = PdfReader(filename)
-        pages = reader.pages
-        for i in range(len(pages)):
-            blob_name = blob_name_from_file_page(filename, i)
-            if args.verbose: print(f"\tUploading blob for page {i} -> {blob_name}")
-            f = io.BytesIO()
-            writer = PdfWriter()
-            writer.add_page(pages[i])
-            writer.write(f)
-            f.seek(0)
-            blob_container.upload_blob(blob_name, f, overwrite=True)
+        if pdf_pages is None:
+            pdf_pages = pdf_parser.parse(filename, extract_text=False)
+        for _ in upload_page_blobs(filename, pdf_pages):
+            pass
     else:
-        blob_name = blob_name_from_file_page(filename)
         with open(filename,"rb") as data:
-            blob_container.upload_blob(blob_name, data, overwrite=True)
+            blobs = [(blob_name_from_file_page(filename), data.read())]
+        with profiler.stage("blobs", os.path.basename(filename)):
+            result = blob_manager.upload_blobs(blobs)
+        profiler.add("blobs", os.path.basename(filename), items=len(blobs), bytes=result.bytes)
+        if args.verbose: print(f"\tUploaded {result.uploaded} blobs ({result.bytes} bytes), skipped {result.unchanged} unchanged blobs")
+        if manifest is not None:
+            manifest.record_blobs(os.path.basename(filename), [name for name, _ in blobs])
+
+def upload_page_blobs(filename, pdf_pages):
+    # Pages are passed on as their blobs are uploaded, so the text of a PDF can be split into sections at the same time
+    with profiler.stage("blobs", os.path.basename(filename)):
+        upload = blob_manager.start_upload(os.path.splitext(os.path.basename(filename))[0] + "-")
+    names = []
+    for page in pdf_pages:
+        names.append(blob_name_from_file_page(filename, page.page_num))
+        with profiler.stage("blobs", os.path.basename(filename)):
+            upload.add(names[-1], page.content)
+        yield page
+    with profiler.stage("blobs", os.path.basename(filename)):
+        result = upload.finish()
+    profiler.add("blobs", os.path.basename(filename), items=len(names), bytes=result.bytes)
+    if args.verbose: print(f"\tUploaded {result.uploaded} blobs ({result.bytes} bytes), skipped {result.unchanged} unchanged blobs")
+    if manifest is not None:
+        manifest.record_blobs(os.path.basename(filename), names)
 
 def remove_blobs(filename):
     if args.verbose: print(f"Removing blobs for '{filename or '<all>'}'")
-    blob_service = BlobServiceClient(account_url=f"https://{args.storageaccount}.blob.core.windows.net", credential=storage_creds)
-    blob_container = blob_service.get_container_client(args.container)
-    if blob_container.exists():
-        if filename == None:
-            blobs = blob_container.list_blob_names()
-        else:
-            prefix = os.path.splitext(os.path.basename(filename))[0]
-            blobs = filter(lambda b: re.match(f"{prefix}-\d+\.pdf", b), blob_container.list_blob_names(name_starts_with=os.path.splitext(os.path.basename(prefix))[0]))
-        for b in blobs:
-            if args.verbose: print(f"\tRemoving blob {b}")
-            blob_container.delete_blob(b)
-
-def table_to_html(table):
-    table_html = "<table>"
-    rows = [sorted([cell for cell in table.cells if cell.row_index == i], key=lambda cell: cell.column_index) for i in range(table.row_count)]
-    for row_cells in rows:
-        table_html += "<tr>"
-        for cell in row_cells:
-            tag = "th" if (cell.kind == "columnHeader" or cell.kind == "rowHeader") else "td"
-            cell_spans = ""
-            if cell.column_span > 1: cell_spans += f" colSpan={cell.column_span}"
-            if cell.row_span > 1: cell_spans += f" rowSpan={cell.row_span}"
-            table_html += f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"
-        table_html +="</tr>"
-    table_html += "</table>"
-    return table_html
-
-def get_document_text(filename):
+    if filename == None:
+        removed = blob_manager.remove_blobs()
+    elif manifest is not None and manifest.blobs(os.path.basename(filename)):
+        removed = blob_manager.remove_blobs(names=manifest.blobs(os.path.basename(filename)))
+    else:
+        prefix = os.path.splitext(os.path.basename(filename))[0]
+        removed = blob_manager.remove_blobs(prefix, predicate=lambda b: re.match(rf"{re.escape(prefix)}-\d+\.pdf", b))
+    if args.verbose: print(f"\tRemoved {removed} blobs")
+
+def get_document_text(filename, pdf_pages=None):
     offset = 0
-    page_map = []
     if args.localpdfparser:
-        reader = PdfReader(filename)
-        pages = reader.pages
-        for page_num, p in enumerate(pages):
-            page_text = p.extract_text()
-            page_map.append((page_num, offset, page_text))
-            offset += len(page_text)
+        if pdf_pages is None:
+            pdf_pages = pdf_parser.parse(filename, split_pages=False)
+        for page in pdf_pages:
+            yield (page.page_num, offset, page.text)
+            offset += len(page.text)
     else:
         if args.verbose: print(f"Extracting text from '{filename}' using Azure Form Recognizer")
-        form_recognizer_client = DocumentAnalysisClient(endpoint=f"https://{args.formrecognizerservice}.cognitiveservices.azure.com/", credential=formrecognizer_creds, headers={"x-ms-useragent": "azure-search-chat-demo/1.0.0"})
-        with open(filename, "rb") as f:
-            poller = form_recognizer_client.begin_analyze_document("prebuilt-layout", document = f)
-        form_recognizer_results = poller.result()
-
-        for page_num, page in enumerate(form_recognizer_results.pages):
-            tables_on_page = [table for table in form_recognizer_results.tables if table.bounding_regions[0].page_number == page_num + 1]
-
-            # mark all positions of the table spans in the page
-            page_offset = page.spans[0].offset
-            page_length = page.spans[0].length
-            table_chars = [-1]*page_length
-            for table_id, table in enumerate(tables_on_page):
-                for span in table.spans:
-                    # replace all table spans with "table_id" in table_chars array
-                    for i in range(span.length):
-                        idx = span.offset - page_offset + i
-                        if idx >=0 and idx < page_length:
-                            table_chars[idx] = table_id
-
-            # build page text by replacing characters in table spans with table html
-            page_text = ""
-            added_tables = set()
-            for idx, table_id in enumerate(table_chars):
-                if table_id == -1:
-                    page_text += form_recognizer_results.content[page_offset + idx]
-                elif not table_id in added_tables:
-                    page_text += table_to_html(tables_on_page[table_id])
-                    added_tables.add(table_id)
-
-            page_text += " "
-            page_map.append((page_num, offset, page_text))
-            offset += len(page_text)
-
-    return page_map
-
-def split_text(page_map):
-    SENTENCE_ENDINGS = [".", "!", "?"]
-    WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
-    if args.verbose: print(f"Splitting '{filename}' into sections")
+        with profiler.stage("layout", os.path.basename(filename), bytes=os.path.getsize(filename)):
+            form_recognizer_results = analyze_layout(form_recognizer_client, filename, layout_cache, refresh=args.refresh_layout)
+        yield from profiler.iterate("layout", os.path.basename(filename), iter_layout_pages(form_recognizer_results))
 
-    def find_page(offset):
-        l = len(page_map)
-        for i in range(l - 1):
-            if offset >= page_map[i][1] and offset < page_map[i + 1][1]:
-                return i
-        return l - 1
-
-    all_text = "".join(p[2] for p in page_map)
-    length = len(all_text)
-    start = 0
-    end = length
-    while start + SECTION_OVERLAP < length:
-        last_word = -1
-        end = start + MAX_SECTION_LENGTH
-
-        if end > length:
-            end = length
-        else:
-            # Try to find the end of the sentence
-            while end < length and (end - start - MAX_SECTION_LENGTH) < SENTENCE_SEARCH_LIMIT and all_text[end] not in SENTENCE_ENDINGS:
-                if all_text[end] in WORDS_BREAKS:
-                    last_word = end
-                end += 1
-            if end < length and all_text[end] not in SENTENCE_ENDINGS and last_word > 0:
-                end = last_word # Fall back to at least keeping a whole word
-        if end < length:
-            end += 1
-
-        # Try to find the start of the sentence or at least a whole word boundary
-        last_word = -1
-        while start > 0 and start > end - MAX_SECTION_LENGTH - 2 * SENTENCE_SEARCH_LIMIT and all_text[start] not in SENTENCE_ENDINGS:
-            if all_text[start] in WORDS_BREAKS:
-                last_word = start
-            start -= 1
-        if all_text[start] not in SENTENCE_ENDINGS and last_word > 0:
-            start = last_word
-        if start > 0:
-            start += 1
-
-        section_text = all_text[start:end]
-        yield (section_text, find_page(start))
-
-        last_table_start = section_text.rfind("<table")
-        if (last_table_start > 2 * SENTENCE_SEARCH_LIMIT and last_table_start > section_text.rfind("</table")):
-            # If the section ends with an unclosed table, we need to start the next section with the table.
-            # If table starts inside SENTENCE_SEARCH_LIMIT, we ignore it, as that will cause an infinite loop for tables longer than MAX_SECTION_LENGTH
-            # If last table starts inside SECTION_OVERLAP, keep overlapping
-            if args.verbose: print(f"Section ends with unclosed table, starting next section with the table at page {find_page(start)} offset {start} table start {last_table_start}")
-            start = min(end - SECTION_OVERLAP, start + last_table_start)
-        else:
-            start = end - SECTION_OVERLAP
-        
-    if start + SECTION_OVERLAP < end:
-        yield (all_text[start:end], find_page(start))
+def split_text(filename, page_map):
+    if args.verbose: print(f"Splitting '{filename}' into sections")
+    yield from profiler.iterate("split", filename, text_splitter.split_pages(page_map), size=lambda section: len(section.content))
 
 def filename_to_id(filename):
     filename_ascii = re.sub("[^0-9a-zA-Z_-]", "_", filename)
@@ -209,7 +121,7 @@ def filename_to_id(filename):
 
 def create_sections(filename, page_map, use_vectors):
     file_id = filename_to_id(filename)
-    for i, (content, pagenum) in enumerate(split_text(page_map)):
+    for i, (content, pagenum) in enumerate(split_text(filename, page_map)):
         section = {
             "id": f"{file_id}-page-{i}",
             "content": content,
@@ -217,8 +129,12 @@ def create_sections(filename, page_map, use_vectors):
             "sourcepage": blob_name_from_file_page(filename, pagenum),
             "sourcefile": filename
         }
+        # Near duplicates of earlier sections are not embedded nor indexed, their page is linked to the earlier section
+        if deduplicator is not None and not deduplicator.process(section):
+            continue
         if use_vectors:
-            section["embedding"] = compute_embedding(content)
+            with profiler.stage("embedding", filename, items=1, bytes=len(content)):
+                section["embedding"] = compute_embedding(content)
         yield section
 
 def before_retry_sleep(retry_state):
@@ -226,12 +142,10 @@ def before_retry_sleep(retry_state):
 
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(15), before_sleep=before_retry_sleep)
 def compute_embedding(text):
-    return openai.Embedding.create(engine=args.openaideployment, input=text)["data"][0]["embedding"]
+    return embeddings.create(engine=args.openaideployment, input=text)["data"][0]["embedding"]
 
 def create_search_index():
     if args.verbose: print(f"Ensuring search index {args.index} exists")
-    index_client = SearchIndexClient(endpoint=f"https://{args.searchservice}.search.windows.net/",
-                                     credential=search_creds)
     if args.index not in index_client.list_index_names():
         index = SearchIndex(
             name=args.index,
@@ -239,11 +153,12 @@ def create_search_index():
                 SimpleField(name="id", type="Edm.String", key=True),
                 SearchableField(name="content", type="Edm.String", analyzer_name="de.microsoft"),
                 SearchField(name="embedding", type=SearchFieldDataType.Collection(SearchFieldDataType.Single), 
-                            hidden=False, searchable=True, filterable=False, sortable=False, facetable=False,
+                            hidden=True, searchable=True, filterable=False, sortable=False, facetable=False,
                             vector_search_dimensions=1536, vector_search_configuration="default"),
                 SimpleField(name="category", type="Edm.String", filterable=True, facetable=True),
                 SimpleField(name="sourcepage", type="Edm.String", filterable=True, facetable=True),
-                SimpleField(name="sourcefile", type="Edm.String", filterable=True, facetable=True)
+                SimpleField(name="sourcefile", type="Edm.String", filterable=True, facetable=True),
+                SimpleField(name="sourcepages", type=SearchFieldDataType.Collection(SearchFieldDataType.String), filterable=True)
             ],
             semantic_settings=SemanticSettings(
                 configurations=[SemanticConfiguration(
@@ -264,51 +179,116 @@ def create_search_index():
         index_client.create_index(index)
     else:
         if args.verbose: print(f"Search index {args.index} already exists")
+        update_index_fields()
+
+def update_index_fields():
+    # Indexes created before the embedding field was hidden return every vector with every search result, and indexes
+    # created before --dedup lack the sourcepages field its documents have. Both can be changed in place, so
+    # existing indexes are updated instead of rebuilt.
+    index = index_client.get_index(args.index)
+    changed = False
+    field = next((f for f in index.fields if f.name == "embedding"), None)
+    if field is not None and not field.hidden:
+        if args.verbose: print(f"Making the embedding field of search index {args.index} non-retrievable")
+        field.hidden = True
+        changed = True
+    if not any(f.name == "sourcepages" for f in index.fields):
+        if args.verbose: print(f"Adding the sourcepages field to search index {args.index}")
+        index.fields.append(SimpleField(name="sourcepages", type=SearchFieldDataType.Collection(SearchFieldDataType.String), filterable=True))
+        changed = True
+    if changed:
+        index_client.create_or_update_index(index)
 
 def index_sections(filename, sections):
     if args.verbose: print(f"Indexing sections from '{filename}' into search index '{args.index}'")
-    search_client = SearchClient(endpoint=f"https://{args.searchservice}.search.windows.net/",
-                                    index_name=args.index,
-                                    credential=search_creds)
-    i = 0
-    batch = []
-    for s in sections:
-        batch.append(s)
-        i += 1
-        if i % 1000 == 0:
-            results = search_client.upload_documents(documents=batch)
-            succeeded = sum([1 for r in results if r.succeeded])
-            if args.verbose: print(f"\tIndexed {len(results)} sections, {succeeded} succeeded")
-            batch = []
-
-    if len(batch) > 0:
-        results = search_client.upload_documents(documents=batch)
-        succeeded = sum([1 for r in results if r.succeeded])
-        if args.verbose: print(f"\tIndexed {len(results)} sections, {succeeded} succeeded")
+    ids = []
+    def track_ids(sections):
+        for section in sections:
+            ids.append(section["id"])
+            yield section
+    with profiler.stage("indexing", filename):
+        summary = bulk_indexer.index(track_ids(sections))
+    profiler.add("indexing", filename, items=summary.documents, bytes=summary.bytes)
+    if args.verbose: print(f"\tIndexed {summary}")
+    if summary.failed_keys:
+        print(f"Failed to index {len(summary.failed_keys)} sections from '{filename}': {', '.join(summary.failed_keys)}")
+    if manifest is not None:
+        # Sections left over from a previous, longer version of the file are removed by key
+        stale_ids = set(manifest.ids(filename)) - set(ids)
+        if stale_ids:
+            bulk_indexer.delete(stale_ids)
+            if args.verbose: print(f"\tRemoved {len(stale_ids)} stale sections from index")
+        manifest.record_ids(filename, ids)
+
+def export_sections(filename, sections):
+    if args.verbose: print(f"Exporting sections from '{filename}' to '{args.exportpath}'")
+    count = section_writer.count
+    for section in sections:
+        with profiler.stage("export", filename, items=1):
+            section_writer.write(section)
+    if args.verbose: print(f"\tExported {section_writer.count - count} sections")
+
+def link_duplicates(filename):
+    updates = deduplicator.pending_updates()
+    if updates:
+        if args.verbose: print(f"\tLinking duplicate pages to {len(updates)} sections ({deduplicator.duplicates} duplicate sections so far)")
+        if section_writer is not None:
+            for update in updates:
+                section_writer.write({**update, "@search.action": "merge"})
+        else:
+            summary = bulk_indexer.merge(updates)
+            if summary.failed_keys:
+                print(f"Failed to link duplicate pages of '{filename}' to {len(summary.failed_keys)} sections: {', '.join(summary.failed_keys)}")
+    if manifest is not None and section_writer is None:
+        # The file is ingested again when a file its duplicates were linked to is removed or indexed again
+        for sourcefile in deduplicator.pending_links():
+            manifest.record_duplicates(sourcefile, manifest.duplicates(sourcefile) + [filename])
+    else:
+        # Without a manifest nothing would bring back sections linked to another file when it is removed, so
+        # duplicates are only looked for within a file
+        deduplicator.clear()
+
+def import_sections(path):
+    print(f"Importing sections from '{path}' into search index '{args.index}'")
+    merges = []
+    def documents():
+        for section in read_sections(path, include_embeddings=not args.novectors):
+            if section.pop("@search.action", None) == "merge":
+                merges.append(section)
+            else:
+                yield section
+    summary = bulk_indexer.index(documents())
+    print(f"\tIndexed {summary}")
+    if summary.failed_keys:
+        print(f"Failed to index {len(summary.failed_keys)} sections: {', '.join(summary.failed_keys)}")
+    if merges:
+        # Duplicate links refer to sections anywhere in the file, so they are applied once all sections are indexed
+        summary = bulk_indexer.merge(merges)
+        print(f"\tLinked duplicate pages to {summary}")
+        if summary.failed_keys:
+            print(f"Failed to link duplicate pages to {len(summary.failed_keys)} sections: {', '.join(summary.failed_keys)}")
 
 def remove_from_index(filename):
     if args.verbose: print(f"Removing sections from '{filename or '<all>'}' from search index '{args.index}'")
-    search_client = SearchClient(endpoint=f"https://{args.searchservice}.search.windows.net/",
-                                    index_name=args.index,
-                                    credential=search_creds)
-    while True:
-        filter = None if filename == None else f"sourcefile eq '{os.path.basename(filename)}'"
-        r = search_client.search("", filter=filter, top=1000, include_total_count=True)
-        if r.get_count() == 0:
-            break
-        r = search_client.delete_documents(documents=[{ "id": d["id"] } for d in r])
-        if args.verbose: print(f"\tRemoved {len(r)} sections from index")
-        # It can take a few seconds for search results to reflect changes, so wait a bit
-        time.sleep(2)
+    sourcefile = None if filename == None else os.path.basename(filename)
+    filter = None if sourcefile == None else f"sourcefile eq '{sourcefile}'"
+    # Keys recorded in the manifest are deleted right away, anything else matching the filter is found by paging through keys only
+    keys = manifest.ids(sourcefile) if manifest is not None else []
+    removed = remove_documents(bulk_indexer, filter, keys)
+    if args.verbose: print(f"\tRemoved {removed} sections from index")
 
+def forget_in_manifest(filename):
+    if manifest is not None:
+        manifest.remove(None if filename == None else os.path.basename(filename))
+        manifest.save()
 
-if __name__ == "__main__":
 
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Prepare documents by extracting content from PDFs, splitting content into sections, uploading to blob storage, and indexing in a search index.",
         epilog="Example: prepdocs.py '..\data\*' --storageaccount myaccount --container mycontainer --searchservice mysearch --index myindex -v"
         )
-    parser.add_argument("files", help="Files to be processed")
+    parser.add_argument("files", nargs="?", help="Files to be processed")
     parser.add_argument("--category", help="Value for the category field in the search index for all sections indexed in this run")
     parser.add_argument("--skipblobs", action="store_true", help="Skip uploading individual pages to Azure Blob Storage")
     parser.add_argument("--storageaccount", help="Azure Blob Storage account name")
@@ -327,25 +307,169 @@ if __name__ == "__main__":
     parser.add_argument("--localpdfparser", action="store_true", help="Use PyPdf local PDF parser (supports only digital PDFs) instead of Azure Form Recognizer service to extract text, tables and layout from the documents")
     parser.add_argument("--formrecognizerservice", required=False, help="Optional. Name of the Azure Form Recognizer service which will be used to extract text, tables and layout from the documents (must exist already)")
     parser.add_argument("--formrecognizerkey", required=False, help="Optional. Use this Azure Form Recognizer account key instead of the current user identity to login (use az login to set current user for Azure)")
+    parser.add_argument("--pdfworkers", type=int, default=os.cpu_count(), help="Optional. Number of processes used to parse PDFs locally, for --localpdfparser and for splitting PDFs into page blobs (defaults to the number of CPUs)")
+    parser.add_argument("--blobworkers", type=int, default=8, help="Optional. Number of page blobs uploaded to Azure Blob Storage concurrently")
+    parser.add_argument("--indexworkers", type=int, default=4, help="Optional. Number of batches of sections uploaded to the search index concurrently")
+    parser.add_argument("--layoutcache", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".layoutcache"), help="Optional. Directory where Azure Form Recognizer results are cached between runs, keyed by file content")
+    parser.add_argument("--refresh-layout", action="store_true", help="Analyze documents with Azure Form Recognizer again even if a cached result exists")
+    parser.add_argument("--export", dest="exportpath", required=False, help="Optional. Write the sections (including embeddings) to this file instead of indexing them, to be loaded later with --import. Compressed if the name ends with .gz")
+    parser.add_argument("--import", dest="importpath", required=False, help="Optional. Load the sections of a file written with --export into the search index, without extracting text or computing embeddings")
+    parser.add_argument("--dedup", nargs="?", const=0.9, type=float, required=False, help="Optional. Don't embed and index sections that are near duplicates of earlier sections (estimated Jaccard similarity of their word 5-grams of at least this value, 0.9 if omitted), and add their page to the sourcepages field of the earlier section instead. The backend cites only the sourcepage of a section, not the pages in sourcepages. "
+                        "Duplicates are looked for across files only with --manifest, which records the links so that files are ingested again when the file their duplicates were linked to is removed or indexed again, and within each file otherwise")
+    parser.add_argument("--manifest", required=False, help="Optional. JSON file recording the search documents and blobs created for every file, used to remove them by key and to remove stale sections when a file is indexed again")
+    parser.add_argument("--maxsectiontokens", required=False, type=int, help="Optional. Size sections by their token count (cl100k_base encoding) with this many tokens per section instead of by character count")
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
-    args = parser.parse_args()
+    parser.add_argument("--profile", required=False, help="Optional. Record wall time, CPU time, items and bytes of every stage (pdf, blobs, layout, split, embedding, indexing) per file, write them as JSON to this file and print a summary")
+    args = parser.parse_args(argv)
+    if args.files == None and args.importpath == None:
+        parser.error("the files argument is required unless --import is used")
+    return args
+
+def create_pipeline(search_client, search_index_client, container_client=None, document_analysis_client=None, embeddings_client=None):
+    # The clients are the only Azure specific part of the pipeline, so it can also run against local stand-ins
+    global bulk_indexer, index_client, blob_manager, form_recognizer_client, layout_cache, embeddings, use_vectors
+    global text_splitter, pdf_parser, manifest, deduplicator, section_writer, profiler
+    use_vectors = not args.novectors and args.importpath == None
+    bulk_indexer = BulkIndexer(search_client, concurrency=args.indexworkers, verbose=args.verbose)
+    index_client = search_index_client
+
+    if args.maxsectiontokens:
+        text_splitter = TextSplitter(args.maxsectiontokens, SENTENCE_SEARCH_LIMIT_TOKENS, SECTION_OVERLAP_TOKENS, token_encoding=tiktoken.get_encoding("cl100k_base"), verbose=args.verbose)
+    else:
+        text_splitter = TextSplitter(MAX_SECTION_LENGTH, SENTENCE_SEARCH_LIMIT, SECTION_OVERLAP, verbose=args.verbose)
+
+    pdf_parser = PdfParser(args.pdfworkers)
+    manifest = IngestionManifest(args.manifest) if args.manifest else None
+    deduplicator = SectionDeduplicator(NearDuplicateDetector(args.dedup)) if args.dedup else None
+    blob_manager = BlobManager(container_client, args.blobworkers, verbose=args.verbose) if container_client is not None else None
+    form_recognizer_client = document_analysis_client
+    layout_cache = LayoutCache(args.layoutcache) if document_analysis_client is not None else None
+    embeddings = embeddings_client
+    section_writer = SectionWriter(args.exportpath) if args.exportpath else None
+    profiler = Profiler(enabled=args.profile != None)
+
+def publish_index_version():
+    # The app caches search results until the index version in the container metadata changes
+    if blob_manager is None:
+        return
+    version = uuid.uuid4().hex
+    if args.verbose: print(f"Publishing search index version {version}")
+    blob_manager.set_index_version(version)
+
+def ingest_file(filename, pdf_pages):
+    # Returns the files with near duplicate sections linked to the previous version of this file, which are only in
+    # the index through its sections and have to be ingested again. The file's own links are recorded anew.
+    dependents = []
+    if manifest is not None and section_writer is None:
+        dependents = manifest.duplicates(os.path.basename(filename))
+        manifest.forget_duplicates_of(os.path.basename(filename))
+    if pdf_pages is not None:
+        pdf_pages = profiler.iterate("pdf", os.path.basename(filename), pdf_pages, size=lambda page: len(page.content or b""))
+    if not args.skipblobs:
+        if pdf_pages is not None and args.localpdfparser:
+            pdf_pages = upload_page_blobs(filename, pdf_pages)
+        else:
+            upload_blobs(filename, pdf_pages)
+    page_map = get_document_text(filename, pdf_pages)
+    sections = create_sections(os.path.basename(filename), page_map, use_vectors)
+    if section_writer is not None:
+        export_sections(os.path.basename(filename), sections)
+    else:
+        index_sections(os.path.basename(filename), sections)
+    if deduplicator is not None:
+        link_duplicates(filename)
+    if manifest is not None and section_writer is None:
+        manifest.save()
+    return dependents
+
+def run():
+    if args.importpath:
+        create_search_index()
+        import_sections(args.importpath)
+    elif args.removeall:
+        if not args.skipblobs:
+            remove_blobs(None)
+        remove_from_index(None)
+        forget_in_manifest(None)
+    else:
+        if not args.remove and section_writer is None:
+            create_search_index()
+
+        print(f"Processing files...")
+        # Parse PDFs once for both the page blobs and the local text extraction, while the next pages are parsed ahead.
+        # Pages flow through blob upload, text extraction, splitting and indexing one at a time, whatever the document length
+        processed, dependents = set(), []
+        for filename, pdf_pages in pdf_parser.iter_files(glob.glob(args.files), extract_text=not args.remove and args.localpdfparser, split_pages=not args.remove and not args.skipblobs):
+            if args.verbose: print(f"Processing '{filename}'")
+            processed.add(os.path.basename(filename))
+            if args.remove:
+                if manifest is not None:
+                    dependents += manifest.duplicates(os.path.basename(filename))
+                if not args.skipblobs:
+                    remove_blobs(filename)
+                remove_from_index(filename)
+                forget_in_manifest(filename)
+            else:
+                dependents += ingest_file(filename, pdf_pages)
+
+        # Ingesting the files again may link their sections to other files, whose dependents are ingested again in turn
+        while dependents:
+            dependents = sorted({path for path in dependents if os.path.basename(path) not in processed})
+            if dependents:
+                print(f"Ingesting {len(dependents)} files again, their near duplicate sections were linked to files removed or indexed again...")
+            for path in dependents:
+                if not os.path.exists(path):
+                    print(f"Cannot ingest '{path}' again as it no longer exists, its near duplicate sections are no longer in the index")
+                    manifest.forget_duplicates_of(os.path.basename(path))
+                    manifest.save()
+            processed.update(os.path.basename(path) for path in dependents)
+            files, dependents = [path for path in dependents if os.path.exists(path)], []
+            for filename, pdf_pages in pdf_parser.iter_files(files, extract_text=args.localpdfparser, split_pages=not args.skipblobs):
+                if args.verbose: print(f"Processing '{filename}'")
+                dependents += ingest_file(filename, pdf_pages)
+
+    if section_writer is not None:
+        section_writer.close()
+        print(f"Exported {section_writer.count} sections to '{args.exportpath}'")
+    else:
+        publish_index_version()
+    if deduplicator is not None:
+        print(f"Skipped {deduplicator.duplicates} near duplicate sections")
+    if args.profile:
+        profiler.save(args.profile)
+        print(profiler.summary())
+    pdf_parser.close()
+    if blob_manager is not None:
+        blob_manager.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
 
     # Use the current user identity to connect to Azure services unless a key is explicitly set for any of them
     azd_credential = AzureDeveloperCliCredential() if args.tenantid == None else AzureDeveloperCliCredential(tenant_id=args.tenantid, process_timeout=60)
     default_creds = azd_credential if args.searchkey == None or args.storagekey == None else None
     search_creds = default_creds if args.searchkey == None else AzureKeyCredential(args.searchkey)
-    use_vectors = not args.novectors
 
+    search_client = SearchClient(endpoint=f"https://{args.searchservice}.search.windows.net/", index_name=args.index, credential=search_creds)
+    search_index_client = SearchIndexClient(endpoint=f"https://{args.searchservice}.search.windows.net/", credential=search_creds)
+
+    container_client = None
     if not args.skipblobs:
         storage_creds = default_creds if args.storagekey == None else args.storagekey
-    if not args.localpdfparser:
+        blob_service = BlobServiceClient(account_url=f"https://{args.storageaccount}.blob.core.windows.net", credential=storage_creds)
+        container_client = blob_service.get_container_client(args.container)
+
+    document_analysis_client = None
+    if not args.localpdfparser and args.importpath == None:
         # check if Azure Form Recognizer credentials are provided
         if args.formrecognizerservice == None:
             print("Error: Azure Form Recognizer service is not provided. Please provide formrecognizerservice or use --localpdfparser for local pypdf parser.")
             exit(1)
         formrecognizer_creds = default_creds if args.formrecognizerkey == None else AzureKeyCredential(args.formrecognizerkey)
+        document_analysis_client = DocumentAnalysisClient(endpoint=f"https://{args.formrecognizerservice}.cognitiveservices.azure.com/", credential=formrecognizer_creds, headers={"x-ms-useragent": "azure-search-chat-demo/1.0.0"})
 
-    if use_vectors:
+    if not args.novectors and args.importpath == None:
         if args.openaikey == None:
             openai.api_key = azd_credential.get_token("https://cognitiveservices.azure.com/.default").token
             openai.api_type = "azure_ad"
@@ -356,25 +480,5 @@ if __name__ == "__main__":
         openai.api_base = f"https://{args.openaiservice}.openai.azure.com"
         openai.api_version = "2022-12-01"
 
-    if args.removeall:
-        remove_blobs(None)
-        remove_from_index(None)
-    else:
-        if not args.remove:
-            create_search_index()
-        
-        print(f"Processing files...")
-        for filename in glob.glob(args.files):
-            if args.verbose: print(f"Processing '{filename}'")
-            if args.remove:
-                remove_blobs(filename)
-                remove_from_index(filename)
-            elif args.removeall:
-                remove_blobs(None)
-                remove_from_index(None)
-            else:
-                if not args.skipblobs:
-                    upload_blobs(filename)
-                page_map = get_document_text(filename)
-                sections = create_sections(os.path.basename(filename), page_map, use_vectors)
-                index_sections(os.path.basename(filename), sections)
+    create_pipeline(search_client, search_index_client, container_client, document_analysis_client, openai.Embedding)
+    run()
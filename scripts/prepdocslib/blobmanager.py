@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import mimetypes
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, NamedTuple, Optional
+
+from azure.storage.blob import ContentSettings
+
+# Maximum number of sub requests in a blob batch request
+MAX_DELETE_BATCH = 256
+# Container metadata with the version of the search index, which the app reads to invalidate cached search results
+INDEX_VERSION_METADATA = "searchindexversion"
+
+
+class UploadResult(NamedTuple):
+    uploaded: int
+    unchanged: int
+    bytes: int
+
+
+class BlobManager:
+    """
+    Uploads blobs to one container through a single container client created once per run. Uploads run
+    concurrently on a bounded thread pool, and blobs whose content MD5 matches the existing blob are skipped.
+    """
+
+    def __init__(self, container_client: Any, max_workers: int = 8, verbose: bool = False):
+        self.container_client = container_client
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self._container_checked = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def ensure_container(self):
+        if not self._container_checked:
+            if not self.container_client.exists():
+                self.container_client.create_container()
+            self._container_checked = True
+
+    def set_index_version(self, version: str):
+        """Records the version of the search index in the container metadata, keeping the other metadata."""
+        self.ensure_container()
+        metadata = dict(self.container_client.get_container_properties().metadata or {})
+        metadata[INDEX_VERSION_METADATA] = version
+        self.container_client.set_container_metadata(metadata)
+
+    def existing_md5s(self, prefix: str) -> dict[str, bytes]:
+        """Returns the content MD5 of all blobs starting with prefix, with a single listing request."""
+        return {b.name: bytes(b.content_settings.content_md5) for b in self.container_client.list_blobs(name_starts_with=prefix)
+                if b.content_settings and b.content_settings.content_md5}
+
+    def upload_blobs(self, blobs: Iterable[tuple[str, bytes]]) -> UploadResult:
+        self.ensure_container()
+        blobs = list(blobs)
+        if not blobs:
+            return UploadResult(0, 0, 0)
+        upload = self.start_upload(os.path.commonprefix([name for name, _ in blobs]))
+        for name, data in blobs:
+            upload.add(name, data)
+        return upload.finish()
+
+    def start_upload(self, prefix: str) -> BlobUpload:
+        """Starts uploading blobs whose names all start with prefix, as they are added to the returned BlobUpload."""
+        self.ensure_container()
+        return BlobUpload(self, prefix)
+
+    def _upload(self, existing: dict[str, bytes], name: str, data: bytes) -> bool:
+        md5 = hashlib.md5(data).digest()
+        if existing.get(name) == md5:
+            if self.verbose: print(f"\tSkipping unchanged blob {name}")
+            return False
+        if self.verbose: print(f"\tUploading blob {name}")
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.container_client.upload_blob(name, data, overwrite=True, content_settings=ContentSettings(content_type=content_type, content_md5=bytearray(md5)))
+        return True
+
+    def remove_blobs(self, prefix: Optional[str] = None, names: Optional[Iterable[str]] = None, predicate: Optional[Callable[[str], bool]] = None) -> int:
+        """
+        Deletes the given blobs, or all blobs starting with prefix and matching the predicate, using concurrent
+        batch requests. Returns the number of deleted blobs.
+        """
+        if not self.container_client.exists():
+            return 0
+        if names is None:
+            names = self.container_client.list_blob_names(name_starts_with=prefix)
+        names = [name for name in names if predicate is None or predicate(name)]
+        if self.verbose:
+            for name in names:
+                print(f"\tRemoving blob {name}")
+
+        def delete(batch: list[str]) -> int:
+            responses = self.container_client.delete_blobs(*batch, raise_on_any_failure=False)
+            # Blobs that are already gone count as removed
+            return sum(1 for r in responses if r.status_code in (202, 404))
+
+        batches = [names[i:i + MAX_DELETE_BATCH] for i in range(0, len(names), MAX_DELETE_BATCH)]
+        return sum(self._executor.map(delete, batches))
+
+
+class BlobUpload:
+    """
+    Uploads blobs as they are added, at most twice as many at a time as the manager has workers, so that the
+    blobs of a large document are never all held in memory. The MD5s of existing blobs are listed once up front.
+    """
+
+    def __init__(self, manager: BlobManager, prefix: str):
+        self.manager = manager
+        self._existing = manager.existing_md5s(prefix)
+        self._pending: deque[tuple[Future, int]] = deque()
+        self._uploaded = 0
+        self._unchanged = 0
+        self._bytes = 0
+
+    def _collect(self):
+        future, size = self._pending.popleft()
+        if future.result():
+            self._uploaded += 1
+            self._bytes += size
+        else:
+            self._unchanged += 1
+
+    def add(self, name: str, data: bytes):
+        if len(self._pending) >= 2 * self.manager.max_workers:
+            self._collect()
+        self._pending.append((self.manager._executor.submit(self.manager._upload, self._existing, name, data), len(data)))
+
+    def finish(self) -> UploadResult:
+        while self._pending:
+            self._collect()
+        return UploadResult(self._uploaded, self._unchanged, self._bytes)
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import re
+import zlib
+from typing import Any, Optional
+
+import numpy as np
+
+# Mersenne prime used as modulus of the MinHash permutations, larger than any 32 bit shingle hash
+_PRIME = np.uint64((1 << 61) - 1)
+_WORD_RE = re.compile(r"\w+")
+
+
+class NearDuplicateDetector:
+    """
+    Finds near duplicate texts with MinHash signatures over word shingles and locality sensitive hashing: texts
+    that share all rows of any band of their signatures are candidates, and a candidate is a duplicate if the
+    estimated Jaccard similarity of the shingle sets reaches the threshold. Texts are only compared to texts added
+    earlier, so the first of a group of duplicates is the canonical one.
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, bands: int = 16, shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Permutation coefficients below 2^32, so that a * hash never overflows 64 bits
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._buckets: list[dict[bytes, list[str]]] = [{} for _ in range(bands)]
+        self._signatures: dict[str, np.ndarray] = {}
+
+    def shingles(self, text: str) -> set[int]:
+        words = _WORD_RE.findall(text.lower())
+        n = self.shingle_size
+        grams = [" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))]
+        return {zlib.crc32(gram.encode("utf-8")) for gram in grams}
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(self.shingles(text), dtype=np.uint64)
+        return ((self._a * hashes % _PRIME + self._b) % _PRIME).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find(self, text: str) -> Optional[str]:
+        """Returns the key of the most similar earlier text if it is a near duplicate of text."""
+        return self._find(self.signature(text))
+
+    def _find(self, signature: np.ndarray) -> Optional[str]:
+        candidates = {key for band, band_key in zip(self._buckets, self._band_keys(signature)) for key in band.get(band_key, ())}
+        best, best_similarity = None, self.threshold
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+    def add(self, key: str, text: str, signature: Optional[np.ndarray] = None):
+        signature = self.signature(text) if signature is None else signature
+        self._signatures[key] = signature
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(band_key, []).append(key)
+
+    def clear(self):
+        """Forgets the texts added so far."""
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures.clear()
+
+    def check(self, key: str, text: str) -> Optional[str]:
+        """Returns the key of the earlier near duplicate of text, or adds text under key and returns None."""
+        signature = self.signature(text)
+        duplicate_of = self._find(signature)
+        if duplicate_of is None:
+            self.add(key, text, signature)
+        return duplicate_of
+
+
+class SectionDeduplicator:
+    """
+    Collapses near duplicate sections before they are embedded and indexed. The first section of a group is kept
+    and collects the source pages of all its duplicates in its sourcepages field. The backend only cites the
+    sourcepage of a section, so the pages of its duplicates are kept in the index but not cited.
+    Updates of sections that were already passed on are collected until taken with pending_updates, and the source
+    files of sections that gained duplicates from other files until taken with pending_links.
+    """
+
+    def __init__(self, detector: Optional[NearDuplicateDetector] = None, content_field: str = "content", key_field: str = "id", file_field: str = "sourcefile"):
+        self.detector = detector or NearDuplicateDetector()
+        self.content_field = content_field
+        self.key_field = key_field
+        self.file_field = file_field
+        self.duplicates = 0
+        self._sourcepages: dict[str, list[str]] = {}
+        self._sourcefiles: dict[str, Optional[str]] = {}
+        self._updated: set[str] = set()
+        self._linked_files: set[str] = set()
+
+    def process(self, section: dict[str, Any]) -> bool:
+        """Returns True if the section is unique and should be indexed, and links it to its duplicate otherwise."""
+        key = section[self.key_field]
+        duplicate_of = self.detector.check(key, section[self.content_field])
+        if duplicate_of is None:
+            self._sourcepages[key] = list(section.get("sourcepages") or [section["sourcepage"]])
+            self._sourcefiles[key] = section.get(self.file_field)
+            section["sourcepages"] = list(self._sourcepages[key])
+            return True
+        self.duplicates += 1
+        sourcefile = self._sourcefiles[duplicate_of]
+        if sourcefile is not None and sourcefile != section.get(self.file_field):
+            self._linked_files.add(sourcefile)
+        pages = self._sourcepages[duplicate_of]
+        if section["sourcepage"] not in pages:
+            pages.append(section["sourcepage"])
+            self._updated.add(duplicate_of)
+        return False
+
+    def pending_updates(self) -> list[dict[str, Any]]:
+        """Returns partial documents with the new sourcepages of sections that gained duplicates, once."""
+        updates = [{self.key_field: key, "sourcepages": list(self._sourcepages[key])} for key in sorted(self._updated)]
+        self._updated.clear()
+        return updates
+
+    def pending_links(self) -> list[str]:
+        """Returns the source files of sections that gained duplicates from other files, once."""
+        linked_files = sorted(self._linked_files)
+        self._linked_files.clear()
+        return linked_files
+
+    def clear(self):
+        """Forgets the sections processed so far, after their updates were taken, so that later sections are not linked to them."""
+        self.detector.clear()
+        self._sourcepages.clear()
+        self._sourcefiles.clear()
+        self._updated.clear()
+        self._linked_files.clear()
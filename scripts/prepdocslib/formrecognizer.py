@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import html
+import json
+import os
+import tempfile
+from typing import Any, Iterator, Optional
+
+from azure.ai.formrecognizer import AnalyzeResult
+
+LAYOUT_MODEL_ID = "prebuilt-layout"
+
+
+class LayoutCache:
+    """
+    Stores Form Recognizer analysis results on disk as gzip compressed JSON, keyed by the SHA-256 hash of the
+    analyzed file content and the model id, so that unchanged files are never analyzed (and billed) twice.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @staticmethod
+    def key(content: bytes, model_id: str) -> str:
+        return hashlib.sha256(model_id.encode("utf-8") + b"\0" + content).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json.gz")
+
+    def get(self, key: str) -> Optional[AnalyzeResult]:
+        try:
+            with gzip.open(self.path(key), "rt", encoding="utf-8") as f:
+                return AnalyzeResult.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, result: AnalyzeResult):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so that concurrent or interrupted runs never leave a truncated entry behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(result.to_dict(), separators=(",", ":")).encode("utf-8"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def analyze_layout(client: Any, filename: str, cache: Optional[LayoutCache] = None, refresh: bool = False, model_id: str = LAYOUT_MODEL_ID) -> AnalyzeResult:
+    """
+    Analyzes a file with the given DocumentAnalysisClient, reusing a cached result for the same content and model
+    unless refresh is set. Fresh results are always written back to the cache.
+    """
+    with open(filename, "rb") as f:
+        content = f.read()
+    key = LayoutCache.key(content, model_id) if cache else None
+    if cache and not refresh:
+        result = cache.get(key)
+        if result is not None:
+            return result
+    result = client.begin_analyze_document(model_id, document=content).result()
+    if cache:
+        cache.put(key, result)
+    return result
+
+
+def table_to_html(table):
+    table_html = "<table>"
+    rows = [sorted([cell for cell in table.cells if cell.row_index == i], key=lambda cell: cell.column_index) for i in range(table.row_count)]
+    for row_cells in rows:
+        table_html += "<tr>"
+        for cell in row_cells:
+            tag = "th" if (cell.kind == "columnHeader" or cell.kind == "rowHeader") else "td"
+            cell_spans = ""
+            if cell.column_span > 1: cell_spans += f" colSpan={cell.column_span}"
+            if cell.row_span > 1: cell_spans += f" rowSpan={cell.row_span}"
+            table_html += f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"
+        table_html +="</tr>"
+    table_html += "</table>"
+    return table_html
+
+
+def layout_to_page_map(form_recognizer_results: AnalyzeResult) -> list[tuple[int, int, str]]:
+    return list(iter_layout_pages(form_recognizer_results))
+
+
+def iter_layout_pages(form_recognizer_results: AnalyzeResult) -> Iterator[tuple[int, int, str]]:
+    """Yields the (page_num, offset, text) tuples of the page map one page at a time, with tables as HTML."""
+    offset = 0
+    for page_num, page in enumerate(form_recognizer_results.pages):
+        tables_on_page = [table for table in form_recognizer_results.tables if table.bounding_regions[0].page_number == page_num + 1]
+
+        # mark all positions of the table spans in the page
+        page_offset = page.spans[0].offset
+        page_length = page.spans[0].length
+        table_chars = [-1]*page_length
+        for table_id, table in enumerate(tables_on_page):
+            for span in table.spans:
+                # replace all table spans with "table_id" in table_chars array
+                for i in range(span.length):
+                    idx = span.offset - page_offset + i
+                    if idx >=0 and idx < page_length:
+                        table_chars[idx] = table_id
+
+        # build page text by replacing characters in table spans with table html
+        page_text = ""
+        added_tables = set()
+        for idx, table_id in enumerate(table_chars):
+            if table_id == -1:
+                page_text += form_recognizer_results.content[page_offset + idx]
+            elif not table_id in added_tables:
+                page_text += table_to_html(tables_on_page[table_id])
+                added_tables.add(table_id)
+
+        page_text += " "
+        yield (page_num, offset, page_text)
+        offset += len(page_text)
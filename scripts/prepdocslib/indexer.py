@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Optional
+
+from azure.core.exceptions import HttpResponseError
+
+# Azure Cognitive Search accepts up to 1000 documents and 16 MB per indexing request, stay below the size limit
+# to leave room for the request envelope and differences in serialization
+MAX_BATCH_COUNT = 1000
+MAX_BATCH_BYTES = 12 * 1024 * 1024
+
+# Per document status codes worth retrying, see https://learn.microsoft.com/rest/api/searchservice/addupdate-or-delete-documents#response
+RETRIABLE_STATUS_CODES = {409, 422, 429, 500, 503}
+
+
+@dataclass
+class IndexSummary:
+    documents: int = 0
+    succeeded: int = 0
+    bytes: int = 0
+    batches: int = 0
+    retries: int = 0
+    failed_keys: list[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.succeeded / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.succeeded}/{self.documents} documents in {self.batches} batches ({self.bytes} bytes), {self.retries} retries, {len(self.failed_keys)} failed, {self.docs_per_second:.1f} docs/s"
+
+
+class BulkIndexer:
+    """
+    Uploads, merges or deletes documents in a search index in batches limited by both document count and serialized size. Several
+    batches are sent concurrently, and documents that fail with a transient error are retried individually
+    with exponential backoff. Documents are consumed lazily, so at most a few batches are held in memory.
+    """
+
+    def __init__(self, search_client: Any, max_batch_count: int = MAX_BATCH_COUNT, max_batch_bytes: int = MAX_BATCH_BYTES, concurrency: int = 4,
+                 max_retries: int = 5, backoff: float = 1.0, key_field: str = "id", verbose: bool = False, sleep: Callable[[float], None] = time.sleep):
+        self.search_client = search_client
+        self.max_batch_count = max_batch_count
+        self.max_batch_bytes = max_batch_bytes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.key_field = key_field
+        self.verbose = verbose
+        self.sleep = sleep
+
+    def index(self, documents: Iterable[dict[str, Any]]) -> IndexSummary:
+        return self._run(documents, self.search_client.upload_documents)
+
+    def delete(self, keys: Iterable[str]) -> IndexSummary:
+        return self._run(({self.key_field: key} for key in keys), self.search_client.delete_documents)
+
+    def merge(self, documents: Iterable[dict[str, Any]]) -> IndexSummary:
+        return self._run(documents, self.search_client.merge_documents)
+
+    def _run(self, documents: Iterable[dict[str, Any]], operation: Callable[..., list[Any]]) -> IndexSummary:
+        summary = IndexSummary()
+        lock = threading.Lock()
+        # Bound the number of batches in flight so that a fast producer does not buffer the whole document stream
+        slots = threading.BoundedSemaphore(2 * self.concurrency)
+        started = time.perf_counter()
+
+        def send(batch: list[dict[str, Any]], batch_bytes: int):
+            try:
+                succeeded, retries, failed_keys = self._send_with_retries(batch, operation)
+                with lock:
+                    summary.succeeded += succeeded
+                    summary.retries += retries
+                    summary.failed_keys.extend(failed_keys)
+                if self.verbose: print(f"\tProcessed {len(batch)} documents ({batch_bytes} bytes), {succeeded} succeeded")
+            finally:
+                slots.release()
+
+        futures: list[Future] = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            batch: list[dict[str, Any]] = []
+            batch_bytes = 0
+            for document in documents:
+                document_bytes = len(json.dumps(document, separators=(",", ":")))
+                if batch and (len(batch) >= self.max_batch_count or batch_bytes + document_bytes > self.max_batch_bytes):
+                    slots.acquire()
+                    futures.append(executor.submit(send, batch, batch_bytes))
+                    summary.batches += 1
+                    batch, batch_bytes = [], 0
+                batch.append(document)
+                batch_bytes += document_bytes
+                summary.documents += 1
+                summary.bytes += document_bytes
+            if batch:
+                slots.acquire()
+                futures.append(executor.submit(send, batch, batch_bytes))
+                summary.batches += 1
+        for future in futures:
+            # Surface unexpected (non retriable) errors of any batch
+            future.result()
+        summary.elapsed = time.perf_counter() - started
+        return summary
+
+    def _send_with_retries(self, batch: list[dict[str, Any]], operation: Callable[..., list[Any]]) -> tuple[int, int, list[str]]:
+        succeeded = 0
+        retries = 0
+        failed_keys = []
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                retries += len(pending)
+                self.sleep(self._backoff_delay(attempt))
+            try:
+                results = operation(documents=pending)
+            except HttpResponseError as e:
+                if e.status_code not in RETRIABLE_STATUS_CODES or attempt == self.max_retries:
+                    raise
+                continue
+            succeeded += sum(1 for r in results if r.succeeded)
+            failed_keys.extend(r.key for r in results if not r.succeeded and r.status_code not in RETRIABLE_STATUS_CODES)
+            retriable_keys = {r.key for r in results if not r.succeeded and r.status_code in RETRIABLE_STATUS_CODES}
+            pending = [d for d in pending if d[self.key_field] in retriable_keys]
+            if not pending:
+                break
+        return succeeded, retries, failed_keys + [d[self.key_field] for d in pending]
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+
+
+
+# Azure Cognitive Search does not allow skipping more than 100000 results
+MAX_SKIP = 100000
+
+
+def find_keys(search_client: Any, filter: Optional[str], key_field: str = "id", page_size: int = 1000) -> list[str]:
+    """Pages through the keys of all documents matching the filter, without retrieving any other field."""
+    keys: list[str] = []
+    while len(keys) <= MAX_SKIP - page_size:
+        page = [d[key_field] for d in search_client.search("", filter=filter, select=[key_field], top=page_size, skip=len(keys) or None)]
+        keys.extend(page)
+        if len(page) < page_size:
+            break
+    return keys
+
+
+def remove_documents(indexer: BulkIndexer, filter: Optional[str], keys: Iterable[str] = (), timeout: float = 120.0, sleep: Callable[[float], None] = time.sleep) -> int:
+    """
+    Deletes all documents matching the filter, starting with the given keys (e.g. from an ingestion manifest) and
+    then any other matching keys found in the index. Returns once the index no longer returns matching documents,
+    polling with exponential backoff while deletions become visible.
+    """
+    search_client = indexer.search_client
+    deleted: set[str] = set()
+    removed = 0
+    pending = list(keys)
+    delay = 0.05
+    deadline = time.monotonic() + timeout
+    while True:
+        if pending:
+            summary = indexer.delete(pending)
+            if summary.failed_keys:
+                raise RuntimeError(f"Failed to remove {len(summary.failed_keys)} documents from the index: {', '.join(summary.failed_keys)}")
+            removed += summary.succeeded
+            deleted.update(pending)
+        if search_client.search("", filter=filter, select=[indexer.key_field], top=0, include_total_count=True).get_count() == 0:
+            return removed
+        pending = [key for key in find_keys(search_client, filter, indexer.key_field) if key not in deleted]
+        if not pending:
+            # Everything found has been deleted already, wait for the deletions to become visible in search results
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Documents matching {filter!r} are still returned by the index after {timeout} seconds")
+            sleep(delay)
+            delay = min(delay * 2, 2.0)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from typing import Iterable, Optional
+
+
+class IngestionManifest:
+    """
+    Records which search documents and blobs were created for every source file, in a JSON file next to the
+    data. This allows removing a file's documents by key, without searching the index for them first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: dict[str, dict[str, list[str]]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def __contains__(self, sourcefile: str) -> bool:
+        return sourcefile in self._entries
+
+    def sourcefiles(self) -> list[str]:
+        return list(self._entries)
+
+    def ids(self, sourcefile: Optional[str] = None) -> list[str]:
+        """Returns the document keys recorded for the source file, or for all source files."""
+        entries = self._entries.values() if sourcefile is None else [self._entries.get(sourcefile, {})]
+        return [key for entry in entries for key in entry.get("ids", [])]
+
+    def blobs(self, sourcefile: Optional[str] = None) -> list[str]:
+        """Returns the blob names recorded for the source file, or for all source files."""
+        entries = self._entries.values() if sourcefile is None else [self._entries.get(sourcefile, {})]
+        return [name for entry in entries for name in entry.get("blobs", [])]
+
+    def duplicates(self, sourcefile: str) -> list[str]:
+        """Returns the paths of the files with sections that were linked to sections of the source file as their near duplicates."""
+        return list(self._entries.get(sourcefile, {}).get("duplicates", []))
+
+    def record_ids(self, sourcefile: str, ids: Iterable[str]):
+        self._entries.setdefault(sourcefile, {})["ids"] = list(ids)
+
+    def record_blobs(self, sourcefile: str, blobs: Iterable[str]):
+        self._entries.setdefault(sourcefile, {})["blobs"] = list(blobs)
+
+    def record_duplicates(self, sourcefile: str, paths: Iterable[str]):
+        self._entries.setdefault(sourcefile, {})["duplicates"] = sorted(set(paths))
+
+    def remove(self, sourcefile: Optional[str] = None):
+        """Forgets the source file, or all source files."""
+        if sourcefile is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(sourcefile, None)
+            self.forget_duplicates_of(sourcefile)
+
+    def forget_duplicates_of(self, sourcefile: str):
+        """Removes the source file from the files with duplicates linked to other source files."""
+        for entry in self._entries.values():
+            if "duplicates" in entry:
+                entry["duplicates"] = [path for path in entry["duplicates"] if os.path.basename(path) != sourcefile]
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
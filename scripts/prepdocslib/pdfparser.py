@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import io
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from pypdf import PdfReader, PdfWriter
+
+PAGES_PER_TASK = 8
+
+
+class PdfPage(NamedTuple):
+    page_num: int
+    text: Optional[str]
+    # The page serialized as a single page PDF document, used for the per page blobs
+    content: Optional[bytes]
+
+
+# Readers of the files each worker process parsed last, by file and modification time, so that a file is parsed at
+# most once per worker even when page tasks of consecutive files interleave
+READER_CACHE_SIZE = 4
+_readers: OrderedDict[tuple[str, float], PdfReader] = OrderedDict()
+# Single page PDFs are serialized into the same buffer, instead of allocating and growing a new one for every page
+_buffer = io.BytesIO()
+
+
+def _get_reader(filename: str) -> PdfReader:
+    key = (filename, os.path.getmtime(filename))
+    reader = _readers.get(key)
+    if reader is None:
+        reader = _readers[key] = PdfReader(filename)
+        while len(_readers) > READER_CACHE_SIZE:
+            _readers.popitem(last=False)
+    else:
+        _readers.move_to_end(key)
+    return reader
+
+
+def _count_pages(filename: str) -> int:
+    return len(_get_reader(filename).pages)
+
+
+def _parse_first_pages(filename: str, stop: int, extract_text: bool, split_pages: bool) -> tuple[int, list[PdfPage]]:
+    # The first task of a file also counts its pages, so that the file is only read in the worker
+    page_count = _count_pages(filename)
+    return page_count, _parse_pages(filename, 0, min(stop, page_count), extract_text, split_pages)
+
+
+def _parse_pages(filename: str, start: int, stop: int, extract_text: bool, split_pages: bool) -> list[PdfPage]:
+    pages = _get_reader(filename).pages
+    result = []
+    for page_num in range(start, stop):
+        page = pages[page_num]
+        text = page.extract_text() if extract_text else None
+        content = None
+        if split_pages:
+            _buffer.seek(0)
+            _buffer.truncate()
+            writer = PdfWriter()
+            writer.add_page(page)
+            writer.write(_buffer)
+            content = _buffer.getvalue()
+        result.append(PdfPage(page_num, text, content))
+    return result
+
+
+class PdfParser:
+    """
+    Parses PDF files with pypdf, extracting the text of every page and/or splitting them into single page PDF
+    documents. With more than one worker the pages are spread over a pool of processes, as pypdf is pure Python
+    and CPU bound. Pages are always returned in page order.
+    """
+
+    def __init__(self, workers: int = 1, pages_per_task: int = PAGES_PER_TASK):
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        # Started with the first task, not for runs where no file needs parsing
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> PdfParser:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def parse(self, filename: str, extract_text: bool = True, split_pages: bool = True) -> Optional[list[PdfPage]]:
+        _, pages = next(self.iter_files([filename], extract_text, split_pages))
+        return list(pages) if pages is not None else None
+
+    def iter_files(self, filenames: Iterable[str], extract_text: bool = True, split_pages: bool = True, max_pending_tasks: Optional[int] = None) -> Iterator[tuple[str, Optional[Iterator[PdfPage]]]]:
+        """
+        Yields (filename, pages) for every file in order, where pages is None for files that are not PDFs or if there
+        is nothing to do. The pages of every file are yielded lazily as they are parsed, so that memory does not grow
+        with the document length. At most max_pending_tasks tasks of pages_per_task pages (twice the number of workers
+        by default) are parsed ahead, across files. The pages of a file must be consumed before the next file is
+        requested, pages left unconsumed are parsed and discarded.
+        """
+        if self.workers <= 1:
+            for filename in filenames:
+                if not self._should_parse(filename, extract_text, split_pages):
+                    yield filename, None
+                else:
+                    yield filename, self._iter_pages(filename, extract_text, split_pages)
+            return
+
+        max_pending_tasks = max_pending_tasks or 2 * self.workers
+        tasks = self._tasks(filenames, extract_text, split_pages)
+        # (filename, future of the pages or None for files that are not parsed, first page after the task)
+        pending: deque[tuple[str, Optional[Future], int]] = deque()
+
+        def submit():
+            while len(pending) < max_pending_tasks:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                pending.append(task)
+
+        def pages_of_file() -> Iterator[PdfPage]:
+            _, future, _ = pending.popleft()
+            page_count, pages = future.result()
+            submit()
+            yield from pages
+            stop = self.pages_per_task
+            while stop < page_count:
+                _, future, stop = pending.popleft()
+                submit()
+                yield from future.result()
+
+        submit()
+        while pending:
+            filename, future, _ = pending[0]
+            if future is None:
+                pending.popleft()
+                submit()
+                yield filename, None
+                continue
+            pages = pages_of_file()
+            yield filename, pages
+            for _ in pages:
+                pass
+
+    def _iter_pages(self, filename: str, extract_text: bool, split_pages: bool) -> Iterator[PdfPage]:
+        page_count = _count_pages(filename)
+        for start in range(0, page_count, self.pages_per_task):
+            yield from _parse_pages(filename, start, min(start + self.pages_per_task, page_count), extract_text, split_pages)
+
+    def _tasks(self, filenames: Iterable[str], extract_text: bool, split_pages: bool) -> Iterator[Optional[tuple[str, Optional[Future], int]]]:
+        """
+        Submits the tasks of the files in order and yields their pending entries. The first task of a file returns its
+        page count, until it is done None is yielded, as the remaining tasks of the file are not known yet.
+        """
+        for filename in filenames:
+            if not self._should_parse(filename, extract_text, split_pages):
+                yield filename, None, 0
+                continue
+            first = self.executor.submit(_parse_first_pages, filename, self.pages_per_task, extract_text, split_pages)
+            yield filename, first, self.pages_per_task
+            while not first.done():
+                yield None
+            # A failed first task raises when its pages are read
+            page_count = first.result()[0] if first.exception() is None else 0
+            for start in range(self.pages_per_task, page_count, self.pages_per_task):
+                stop = min(start + self.pages_per_task, page_count)
+                yield filename, self.executor.submit(_parse_pages, filename, start, stop, extract_text, split_pages), stop
+
+    def _should_parse(self, filename: str, extract_text: bool, split_pages: bool) -> bool:
+        return (extract_text or split_pages) and os.path.splitext(filename)[1].lower() == ".pdf"
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+STAGES = ["pdf", "blobs", "layout", "split", "embedding", "indexing", "export"]
+
+
+@dataclass
+class StageStats:
+    wall: float = 0.0
+    cpu: float = 0.0
+    items: int = 0
+    bytes: int = 0
+
+    def add(self, other: StageStats):
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.items += other.items
+        self.bytes += other.bytes
+
+
+class _Frame:
+    def __init__(self, stats: StageStats, wall: float, cpu: float):
+        self.stats = stats
+        self.wall = wall
+        self.cpu = cpu
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, items and bytes per pipeline stage and file. Stages nest as the lazy pipeline pulls
+    items through them, so time is only counted for the innermost running stage: the time indexing waits for the
+    next section is counted for splitting and embedding instead. Stages must be entered from one thread, the CPU
+    time is that of this thread, so work done by worker threads or processes shows up as wall time of the waiting stage.
+    """
+
+    def __init__(self, enabled: bool = True, clock: Callable[[], float] = time.perf_counter, cpu_clock: Callable[[], float] = time.thread_time):
+        self.enabled = enabled
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+        self.files: dict[str, dict[str, StageStats]] = {}
+        self._stack: list[_Frame] = []
+        self._started = clock()
+
+    def stats(self, stage: str, filename: str) -> StageStats:
+        return self.files.setdefault(filename, {}).setdefault(stage, StageStats())
+
+    def _enter(self, stats: StageStats):
+        wall, cpu = self.clock(), self.cpu_clock()
+        if self._stack:
+            self._pause(self._stack[-1], wall, cpu)
+        self._stack.append(_Frame(stats, wall, cpu))
+
+    def _exit(self):
+        wall, cpu = self.clock(), self.cpu_clock()
+        self._pause(self._stack.pop(), wall, cpu)
+        if self._stack:
+            self._stack[-1].wall, self._stack[-1].cpu = wall, cpu
+
+    @staticmethod
+    def _pause(frame: _Frame, wall: float, cpu: float):
+        frame.stats.wall += wall - frame.wall
+        frame.stats.cpu += cpu - frame.cpu
+        frame.wall, frame.cpu = wall, cpu
+
+    @contextmanager
+    def stage(self, stage: str, filename: str, items: int = 0, bytes: int = 0) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        stats = self.stats(stage, filename)
+        stats.items += items
+        stats.bytes += bytes
+        self._enter(stats)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def add(self, stage: str, filename: str, items: int = 0, bytes: int = 0):
+        if self.enabled:
+            stats = self.stats(stage, filename)
+            stats.items += items
+            stats.bytes += bytes
+
+    def iterate(self, stage: str, filename: str, iterable: Iterable[Any], size: Optional[Callable[[Any], int]] = None) -> Iterable[Any]:
+        """Counts the time spent producing every item of iterable for the stage, and the items and their size."""
+        if not self.enabled:
+            return iterable
+        return self._iterate(self.stats(stage, filename), iter(iterable), size)
+
+    def _iterate(self, stats: StageStats, iterator: Iterator[Any], size: Optional[Callable[[Any], int]]) -> Iterator[Any]:
+        while True:
+            self._enter(stats)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            stats.items += 1
+            if size is not None:
+                stats.bytes += size(item)
+            yield item
+
+    def totals(self) -> dict[str, StageStats]:
+        totals: dict[str, StageStats] = {}
+        for stages in self.files.values():
+            for stage, stats in stages.items():
+                totals.setdefault(stage, StageStats()).add(stats)
+        return dict(sorted(totals.items(), key=lambda item: STAGES.index(item[0]) if item[0] in STAGES else len(STAGES)))
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "elapsed": self.clock() - self._started,
+            "stages": {stage: asdict(stats) for stage, stats in self.totals().items()},
+            "files": {filename: {stage: asdict(stats) for stage, stats in stages.items()} for filename, stages in self.files.items()},
+        }
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=1)
+
+    def summary(self) -> str:
+        elapsed = self.clock() - self._started
+        lines = [f"{'stage':<10} {'wall s':>9} {'cpu s':>9} {'items':>8} {'MB':>9} {'items/s':>9} {'wall %':>7}"]
+        for stage, stats in self.totals().items():
+            rate = stats.items / stats.wall if stats.wall else 0.0
+            lines.append(f"{stage:<10} {stats.wall:>9.3f} {stats.cpu:>9.3f} {stats.items:>8} {stats.bytes / 1024 / 1024:>9.2f} {rate:>9.1f} {100 * stats.wall / elapsed if elapsed else 0:>6.1f}%")
+        lines.append(f"{'total':<10} {elapsed:>9.3f} ({len(self.files)} files)")
+        return "\n".join(lines)
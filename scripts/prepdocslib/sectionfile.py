@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+import sys
+from array import array
+from typing import IO, Any, Iterator, Optional
+
+FORMAT_NAME = "prepdocs-sections"
+FORMAT_VERSION = 1
+EMBEDDING_FIELD = "embedding"
+
+
+def encode_embedding(embedding: list[float]) -> str:
+    """Encodes an embedding as base64 of little endian float32 values, about a quarter of its JSON size."""
+    values = array("f", embedding)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def decode_embedding(data: str) -> list[float]:
+    values = array("f")
+    values.frombytes(base64.b64decode(data))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tolist()
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class SectionWriter:
+    """
+    Writes search index sections to a JSON lines file (gzip compressed if the path ends with .gz), one section per
+    line after a header line describing the format. Embeddings are stored as binary float32 arrays.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = _open(path, "w")
+        self._write({"format": FORMAT_NAME, "version": FORMAT_VERSION, "embedding": "float32-le-base64"})
+
+    def _write(self, record: dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+
+    def write(self, section: dict[str, Any]):
+        record = dict(section)
+        if record.get(EMBEDDING_FIELD) is not None:
+            record[EMBEDDING_FIELD] = encode_embedding(record[EMBEDDING_FIELD])
+        self._write(record)
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> SectionWriter:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_sections(path: str, include_embeddings: bool = True) -> Iterator[dict[str, Any]]:
+    """Yields the sections of a file written by SectionWriter, one at a time."""
+    with _open(path, "r") as f:
+        header: Optional[dict[str, Any]] = json.loads(f.readline() or "null")
+        if not header or header.get("format") != FORMAT_NAME:
+            raise ValueError(f"{path} is not a {FORMAT_NAME} file")
+        if header.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['version']}, only versions up to {FORMAT_VERSION} are supported")
+        for line in f:
+            section = json.loads(line)
+            if EMBEDDING_FIELD in section:
+                if include_embeddings and section[EMBEDDING_FIELD] is not None:
+                    section[EMBEDDING_FIELD] = decode_embedding(section[EMBEDDING_FIELD])
+                elif not include_embeddings:
+                    del section[EMBEDDING_FIELD]
+            yield section
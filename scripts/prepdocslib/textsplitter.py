@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import bisect
+import re
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
+
+SENTENCE_ENDINGS = [".", "!", "?"]
+WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
+
+_SENTENCE_ENDING_RE = re.compile("[" + "".join(re.escape(c) for c in SENTENCE_ENDINGS) + "]")
+_WORD_BREAK_RE = re.compile("[" + "".join(re.escape(c) for c in WORDS_BREAKS) + "]")
+
+# UTF-8 continuation bytes, used to map token byte offsets back to character offsets
+_UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+
+class Page(NamedTuple):
+    """A page of extracted text, compatible with the (page_num, offset, text) tuples of a page map."""
+    page_num: int
+    offset: int
+    text: str
+
+
+class SplitSection(NamedTuple):
+    content: str
+    page_num: int
+
+
+class _TextWindow:
+    """
+    Sliding window over the concatenated text of a stream of pages. Positions are offsets in the full text, pages
+    are read on demand and text before a position that is no longer needed can be dropped.
+    """
+
+    def __init__(self, pages: Iterable[tuple[int, int, str]]):
+        self._pages = iter(pages)
+        self.text = ""
+        # Offset of self.text in the full text, and offset of the end of the text read so far
+        self.base = 0
+        self.end = 0
+        self.exhausted = False
+        self._page_nums: list[int] = []
+        self._page_offsets: list[int] = []
+
+    def fill(self) -> bool:
+        """Reads the next page, returns False at the end of the pages."""
+        page = None if self.exhausted else next(self._pages, None)
+        if page is None:
+            self.exhausted = True
+            return False
+        self._page_nums.append(page[0])
+        self._page_offsets.append(self.end)
+        self.text += page[2]
+        self.end += len(page[2])
+        return True
+
+    def before_end(self, pos: int) -> bool:
+        """Returns whether pos is before the end of the full text, reading as many pages as needed to find out."""
+        while pos >= self.end and self.fill():
+            pass
+        return pos < self.end
+
+    def trim(self, pos: int):
+        """Drops the text before pos, once that is at least half of the window so the window is copied rarely."""
+        if pos - self.base > len(self.text) // 2:
+            self.text = self.text[pos - self.base:]
+            self.base = pos
+            # Keep the page pos is on
+            first_page = bisect.bisect_right(self._page_offsets, pos) - 1
+            del self._page_nums[:first_page]
+            del self._page_offsets[:first_page]
+
+    def find_page(self, pos: int) -> int:
+        return self._page_nums[bisect.bisect_right(self._page_offsets, pos) - 1]
+
+    def char(self, pos: int) -> str:
+        return self.text[pos - self.base]
+
+    def slice(self, start: int, end: int) -> str:
+        return self.text[start - self.base:end - self.base]
+
+    def search(self, pattern: re.Pattern, start: int, end: int) -> Optional[int]:
+        match = pattern.search(self.text, start - self.base, end - self.base)
+        return match.start() + self.base if match else None
+
+    def rfind(self, sub: str, start: int, end: int) -> int:
+        pos = self.text.rfind(sub, start - self.base, end - self.base)
+        return pos + self.base if pos >= 0 else -1
+
+
+class _CharUnits:
+    """Measures section sizes in characters."""
+
+    def __init__(self, window: _TextWindow):
+        self.window = window
+
+    def advance(self, pos: int, n: int) -> int:
+        while pos + n > self.window.end and self.window.fill():
+            pass
+        return min(max(pos + n, 0), self.window.end)
+
+    def trim(self, pos: int):
+        pass
+
+
+class _TokenUnits:
+    """
+    Measures section sizes in tokens, mapping token boundaries to character offsets of the text. The text is
+    tokenized as pages are read: token boundaries are final once two tokenizations of the text after the last
+    final boundary, the second one including another page, agree on them.
+    """
+
+    def __init__(self, window: _TextWindow, encoding: Any):
+        self.window = window
+        self.encoding = encoding
+        self.bounds = [0]
+        self._tentative: Optional[list[int]] = None
+        self._done = False
+
+    def _tokenize(self) -> tuple[list[int], list[bool]]:
+        """Returns the token boundaries of the text after the last final boundary, and which tokens start on a character."""
+        bounds = []
+        aligned = []
+        chars = self.bounds[-1]
+        tokens = self.encoding.encode_ordinary(self.window.slice(chars, self.window.end))
+        for token_bytes in self.encoding.decode_tokens_bytes(tokens):
+            aligned.append(not token_bytes or token_bytes[0] not in _UTF8_CONTINUATION_BYTES)
+            # Count the characters started in this token, a character split across tokens belongs to the first one
+            chars += len(token_bytes.translate(None, _UTF8_CONTINUATION_BYTES))
+            bounds.append(chars)
+        return bounds, aligned
+
+    def _extend(self) -> bool:
+        """Makes more token boundaries final, returns False at the end of the text."""
+        while not self._done:
+            if not self.window.fill():
+                self.bounds.extend(self._tokenize()[0])
+                if self.bounds[-1] != self.window.end:
+                    self.bounds.append(self.window.end)
+                self._done = True
+                return True
+            bounds, aligned = self._tokenize()
+            final = 0
+            if self._tentative is not None:
+                # The last boundary of either tokenization is where the text read so far ended, so it is never final.
+                # Tokenization restarts at the last final boundary, which must therefore not split a character.
+                for i in range(min(len(self._tentative), len(bounds)) - 1):
+                    if self._tentative[i] != bounds[i]:
+                        break
+                    if aligned[i + 1]:
+                        final = i + 1
+            self.bounds.extend(bounds[:final])
+            self._tentative = bounds[final:]
+            if final:
+                return True
+        return False
+
+    def advance(self, pos: int, n: int) -> int:
+        while pos > self.bounds[-1] and self._extend():
+            pass
+        index = bisect.bisect_right(self.bounds, pos) - 1 + n
+        while index >= len(self.bounds) and self._extend():
+            pass
+        return self.bounds[min(max(index, 0), len(self.bounds) - 1)]
+
+    def trim(self, pos: int):
+        first = bisect.bisect_right(self.bounds, pos) - 1
+        if first > len(self.bounds) // 2:
+            del self.bounds[:first]
+
+
+class TextSplitter:
+    """
+    Splits the text of a document into overlapping sections, preferring to end sections at sentence endings
+    and falling back to word breaks. Sections are sized in characters by default, or in tokens when a tiktoken
+    encoding is given, in which case all limits (section length, sentence search limit and overlap) are token counts.
+    Sections are produced lazily by a generator together with the number of the page they start on.
+    """
+
+    def __init__(self, max_section_length: int = 1000, sentence_search_limit: int = 100, section_overlap: int = 100, token_encoding: Optional[Any] = None, verbose: bool = False):
+        self.max_section_length = max_section_length
+        self.sentence_search_limit = sentence_search_limit
+        self.section_overlap = section_overlap
+        self.token_encoding = token_encoding
+        self.verbose = verbose
+
+    def split_pages(self, pages: Iterable[tuple[int, int, str]]) -> Iterator[SplitSection]:
+        """
+        Splits the concatenated text of the pages, reading pages only as far as needed to complete the next section
+        and keeping only the text the next sections can start in, so memory does not grow with the document length.
+        The offsets in the page tuples are ignored, pages are assumed to follow each other.
+        """
+        window = _TextWindow(pages)
+        if not window.before_end(0):
+            return
+        units = _TokenUnits(window, self.token_encoding) if self.token_encoding is not None else _CharUnits(window)
+        # Sections start at most this far before the end of the previous section, see _find_section_start
+        lookback = self.max_section_length + 2 * self.sentence_search_limit
+
+        start = 0
+        end = 0
+        previous_section = None
+        while window.before_end(units.advance(start, self.section_overlap)):
+            end = self._find_section_end(window, start, units)
+            sentence_start = self._find_section_start(window, start, end, units)
+            # Moving the start back to a sentence can repeat the previous section after an unclosed table, which would
+            # loop forever, so in that case the section starts right at the table instead
+            if (sentence_start, end) != previous_section:
+                start = sentence_start
+            previous_section = (start, end)
+
+            section_text = window.slice(start, end)
+            yield SplitSection(section_text, window.find_page(start))
+
+            last_table_start = section_text.rfind("<table")
+            if (units.advance(start, 2 * self.sentence_search_limit) < start + last_table_start and last_table_start > section_text.rfind("</table")):
+                # If the section ends with an unclosed table, we need to start the next section with the table.
+                # If table starts inside SENTENCE_SEARCH_LIMIT, we ignore it, as that will cause an infinite loop for tables longer than MAX_SECTION_LENGTH
+                # If last table starts inside SECTION_OVERLAP, keep overlapping
+                if self.verbose: print(f"Section ends with unclosed table, starting next section with the table at page {window.find_page(start)} offset {start} table start {last_table_start}")
+                start = min(units.advance(end, -self.section_overlap), start + last_table_start)
+            else:
+                start = units.advance(end, -self.section_overlap)
+            keep = units.advance(start, -lookback)
+            window.trim(keep)
+            units.trim(keep)
+
+        if units.advance(start, self.section_overlap) < end:
+            yield SplitSection(window.slice(start, end), window.find_page(start))
+
+    def _find_section_end(self, window: _TextWindow, start: int, units: Any) -> int:
+        end = units.advance(start, self.max_section_length)
+        if window.before_end(end):
+            # Try to find the end of the sentence within the search limit
+            limit = units.advance(start, self.max_section_length + self.sentence_search_limit)
+            sentence_end = window.search(_SENTENCE_ENDING_RE, end, limit)
+            if sentence_end is not None:
+                end = sentence_end
+            else:
+                last_word = max(window.rfind(c, end, limit) for c in WORDS_BREAKS)
+                end = limit
+                if window.before_end(end) and window.char(end) not in SENTENCE_ENDINGS and last_word > 0:
+                    end = last_word # Fall back to at least keeping a whole word
+        if window.before_end(end):
+            end += 1
+        return end
+
+    def _find_section_start(self, window: _TextWindow, start: int, end: int, units: Any) -> int:
+        # Try to find the start of the sentence or at least a whole word boundary
+        lower_bound = units.advance(end, -(self.max_section_length + 2 * self.sentence_search_limit))
+        if start > lower_bound:
+            sentence_end = max(window.rfind(c, lower_bound + 1, start + 1) for c in SENTENCE_ENDINGS)
+            if sentence_end >= 0:
+                start = sentence_end
+            else:
+                first_word = window.search(_WORD_BREAK_RE, lower_bound + 1, start + 1)
+                start = lower_bound
+                if window.char(start) not in SENTENCE_ENDINGS and first_word is not None and first_word > 0:
+                    start = first_word
+        if start > 0:
+            start += 1
+        return start
@@ -0,0 +1,322 @@
+"""
+Local stand-ins for the Azure services used by prepdocs, so that the pipeline can be tested and benchmarked offline.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Iterator, Optional, Union
+
+import numpy as np
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.search.documents.models import IndexingResult
+from azure.storage.blob import BlobProperties, ContainerProperties, ContentSettings
+from pypdf import PdfReader
+
+
+class _CompletedPoller:
+    def __init__(self, result: Any):
+        self._result = result
+
+    def result(self) -> Any:
+        return self._result
+
+
+class FakeDocumentAnalysisClient:
+    """
+    Stand-in for DocumentAnalysisClient that "analyzes" PDFs with pypdf, producing an AnalyzeResult with the page
+    text and spans the real layout model would return (without tables). Counts calls and can simulate service latency.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def begin_analyze_document(self, model_id: str, document: Union[bytes, io.IOBase], **kwargs: Any) -> _CompletedPoller:
+        with self._lock:
+            self.calls += 1
+        content = document if isinstance(document, bytes) else document.read()
+        if self.latency:
+            time.sleep(self.latency)
+        text = ""
+        pages = []
+        for page_num, page in enumerate(PdfReader(io.BytesIO(content)).pages):
+            page_text = page.extract_text()
+            pages.append({"page_number": page_num + 1, "spans": [{"offset": len(text), "length": len(page_text)}], "lines": [], "words": []})
+            text += page_text
+        return _CompletedPoller(AnalyzeResult.from_dict({"api_version": "2022-08-31", "model_id": model_id, "content": text, "pages": pages, "tables": []}))
+
+
+class _BatchSubResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class DirectoryContainerClient:
+    """
+    Stand-in for a blob ContainerClient that stores blobs as files in a local directory. Content MD5s are kept in
+    memory like the service computes them on upload. Counts requests and can simulate a per request latency.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.0):
+        self.directory = directory
+        self.latency = latency
+        self.requests = 0
+        self._md5s: dict[str, bytes] = {}
+        self.metadata: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def exists(self) -> bool:
+        self._request()
+        return os.path.isdir(self.directory)
+
+    def get_container_properties(self, **kwargs: Any) -> ContainerProperties:
+        self._request()
+        properties = ContainerProperties()
+        properties.metadata = dict(self.metadata)
+        return properties
+
+    def set_container_metadata(self, metadata: Optional[dict[str, str]] = None, **kwargs: Any):
+        self._request()
+        self.metadata = dict(metadata or {})
+
+    def create_container(self):
+        self._request()
+        if os.path.isdir(self.directory):
+            raise ResourceExistsError("The specified container already exists.")
+        os.makedirs(self.directory)
+
+    def upload_blob(self, name: str, data: Union[bytes, io.IOBase], overwrite: bool = False, content_settings: Optional[ContentSettings] = None, **kwargs: Any):
+        self._request()
+        content = data if isinstance(data, bytes) else data.read()
+        if not overwrite and os.path.exists(self._path(name)):
+            raise ResourceExistsError(f"The specified blob {name} already exists.")
+        with open(self._path(name), "wb") as f:
+            f.write(content)
+        with self._lock:
+            self._md5s[name] = hashlib.md5(content).digest()
+
+    def list_blob_names(self, name_starts_with: Optional[str] = None, **kwargs: Any) -> Iterator[str]:
+        self._request()
+        names = sorted(os.listdir(self.directory)) if os.path.isdir(self.directory) else []
+        return iter([n for n in names if not name_starts_with or n.startswith(name_starts_with)])
+
+    def list_blobs(self, name_starts_with: Optional[str] = None, **kwargs: Any) -> Iterator[BlobProperties]:
+        blobs = []
+        for name in self.list_blob_names(name_starts_with):
+            blob = BlobProperties(name=name)
+            blob.content_settings = ContentSettings(content_md5=bytearray(self._md5s[name]) if name in self._md5s else None)
+            blobs.append(blob)
+        return iter(blobs)
+
+    def delete_blobs(self, *names: str, **kwargs: Any) -> Iterator[Any]:
+        self._request()
+        responses = []
+        for name in names:
+            try:
+                os.remove(self._path(name))
+                status_code = 202
+            except FileNotFoundError:
+                status_code = 404
+            with self._lock:
+                self._md5s.pop(name, None)
+            responses.append(_BatchSubResponse(status_code))
+        return iter(responses)
+
+    def delete_blob(self, name: str, **kwargs: Any):
+        self._request()
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f"The specified blob {name} does not exist.")
+        with self._lock:
+            self._md5s.pop(name, None)
+
+
+def _indexing_result(key: str, status_code: int, error_message: Optional[str] = None) -> IndexingResult:
+    result = IndexingResult()
+    result.key = key
+    result.succeeded = status_code < 300
+    result.status_code = status_code
+    result.error_message = error_message
+    return result
+
+
+class FakeSearchClient:
+    """
+    Stand-in for a SearchClient over an in-memory index. Transient failures can be injected per document key
+    (fail_keys maps a key to the number of uploads that fail with 503), and requests larger than max_request_bytes
+    are rejected with 413 like the service does. Search only supports listing documents with the simple
+    "field eq/ne 'value'" filters prepdocs uses, and deletions become visible after refresh_delay seconds.
+    """
+
+    def __init__(self, key_field: str = "id", max_request_bytes: int = 16 * 1024 * 1024, latency: float = 0.0, refresh_delay: float = 0.0):
+        self.key_field = key_field
+        self.max_request_bytes = max_request_bytes
+        self.latency = latency
+        self.refresh_delay = refresh_delay
+        self.documents: dict[str, dict[str, Any]] = {}
+        # Deleted documents stay visible to search until the index is refreshed, like in the real service
+        self._deleted: dict[str, tuple[dict[str, Any], float]] = {}
+        self.fail_keys: dict[str, int] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upload_documents(self, documents: list[dict[str, Any]], **kwargs: Any) -> list[IndexingResult]:
+        self._request()
+        if len(json.dumps(documents)) > self.max_request_bytes:
+            error = HttpResponseError(message="Request Entity Too Large")
+            error.status_code = 413
+            raise error
+        results = []
+        with self._lock:
+            for document in documents:
+                key = document[self.key_field]
+                if self.fail_keys.get(key):
+                    self.fail_keys[key] -= 1
+                    results.append(_indexing_result(key, 503, "Service unavailable"))
+                else:
+                    self.documents[key] = dict(document)
+                    results.append(_indexing_result(key, 201))
+        return results
+
+    def merge_documents(self, documents: list[dict[str, Any]], **kwargs: Any) -> list[IndexingResult]:
+        self._request()
+        results = []
+        with self._lock:
+            for document in documents:
+                key = document[self.key_field]
+                if key in self.documents:
+                    self.documents[key].update(document)
+                    results.append(_indexing_result(key, 200))
+                else:
+                    results.append(_indexing_result(key, 404, "Document not found"))
+        return results
+
+    def delete_documents(self, documents: list[dict[str, Any]], **kwargs: Any) -> list[IndexingResult]:
+        self._request()
+        results = []
+        with self._lock:
+            for document in documents:
+                key = document[self.key_field]
+                if key in self.documents:
+                    self._deleted[key] = (self.documents.pop(key), time.monotonic() + self.refresh_delay)
+                results.append(_indexing_result(key, 200))
+        return results
+
+    def search(self, search_text: Optional[str], filter: Optional[str] = None, select: Optional[list[str]] = None, top: Optional[int] = None,
+               skip: Optional[int] = None, include_total_count: bool = False, **kwargs: Any) -> "_FakeSearchResults":
+        self._request()
+        now = time.monotonic()
+        with self._lock:
+            visible = list(self.documents.values()) + [d for d, visible_until in self._deleted.values() if visible_until > now]
+        matches = [d for d in visible if _matches_filter(d, filter)]
+        page = matches[skip or 0:(skip or 0) + (50 if top is None else top)]
+        return _FakeSearchResults([{k: v for k, v in d.items() if not select or k in select} for d in page], len(matches) if include_total_count else None)
+
+
+class _FakeSearchResults:
+    def __init__(self, documents: list[dict[str, Any]], count: Optional[int]):
+        self._documents = documents
+        self._count = count
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return iter(self._documents)
+
+    def get_count(self) -> Optional[int]:
+        return self._count
+
+
+_FILTER_CLAUSE_RE = re.compile(r"\s*(\w+) (eq|ne) '((?:[^']|'')*)'\s*")
+
+
+def _matches_filter(document: dict[str, Any], filter: Optional[str]) -> bool:
+    if not filter:
+        return True
+    for clause in filter.split(" and "):
+        match = _FILTER_CLAUSE_RE.fullmatch(clause)
+        if not match:
+            raise ValueError(f"Unsupported filter: {filter}")
+        field_name, op, value = match.group(1), match.group(2), match.group(3).replace("''", "'")
+        if (document.get(field_name) == value) != (op == "eq"):
+            return False
+    return True
+
+
+class FakeSearchIndexClient:
+    """Stand-in for a SearchIndexClient that only keeps track of the created indexes."""
+
+    def __init__(self):
+        self.indexes: dict[str, Any] = {}
+
+    def list_index_names(self) -> Iterator[str]:
+        return iter(list(self.indexes))
+
+    def create_index(self, index: Any) -> Any:
+        self.indexes[index.name] = index
+        return index
+
+    def get_index(self, name: str) -> Any:
+        if name not in self.indexes:
+            error = HttpResponseError(message=f"Index {name} not found")
+            error.status_code = 404
+            raise error
+        return self.indexes[name]
+
+    def create_or_update_index(self, index: Any) -> Any:
+        self.indexes[index.name] = index
+        return index
+
+
+def fake_embedding(text: str, dimensions: int = 1536) -> list[float]:
+    """A deterministic, normalized pseudo embedding of text, equal texts get equal embeddings."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddings:
+    """
+    Stand-in for openai.Embedding, returning deterministic pseudo embeddings in the shape of the API response.
+    Counts calls and can simulate the latency of the service.
+    """
+
+    def __init__(self, dimensions: int = 1536, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, input: Union[str, list[str]], **kwargs: Any) -> dict[str, Any]:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        texts = [input] if isinstance(input, str) else input
+        return {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, self.dimensions)} for i, text in enumerate(texts)],
+            "usage": {"prompt_tokens": sum(len(text.split()) for text in texts), "total_tokens": sum(len(text.split()) for text in texts)},
+        }
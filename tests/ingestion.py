@@ -0,0 +1,36 @@
+import json
+import os
+
+import prepdocs
+from fakes import DirectoryContainerClient, FakeDocumentAnalysisClient, FakeEmbeddings, FakeSearchClient, FakeSearchIndexClient
+
+# Typical latencies of the services per request in seconds, scaled with the latency argument of run_ingestion
+BLOB_LATENCY = 0.01
+LAYOUT_LATENCY = 1.0
+EMBEDDING_LATENCY = 0.05
+SEARCH_LATENCY = 0.05
+
+# Module globals of prepdocs set by its command line and by create_pipeline
+PIPELINE_GLOBALS = ("args", "bulk_indexer", "index_client", "blob_manager", "form_recognizer_client", "layout_cache", "embeddings", "use_vectors",
+                    "text_splitter", "pdf_parser", "manifest", "deduplicator", "section_writer", "profiler")
+
+
+def run_ingestion(files, workdir, latency=1.0, prepdocs_args=(), clients=None):
+    """
+    Runs the prepdocs pipeline over files with local stand-ins for Blob Storage, Form Recognizer, OpenAI and Cognitive
+    Search, or the stand-ins of clients returned by an earlier run, and returns the profile report together with the stand-ins.
+    """
+    profile_path = os.path.join(workdir, "profile.json")
+    prepdocs.args = prepdocs.parse_args([files, "--index", "bench", "--layoutcache", os.path.join(workdir, "layoutcache"), "--profile", profile_path, *prepdocs_args])
+    if clients is not None:
+        search_client, container_client, document_analysis_client, embeddings = clients["search"], clients["blobs"], clients["layout"], clients["embeddings"]
+    else:
+        search_client = FakeSearchClient(latency=SEARCH_LATENCY * latency)
+        container_client = DirectoryContainerClient(os.path.join(workdir, "blobs"), latency=BLOB_LATENCY * latency)
+        document_analysis_client = FakeDocumentAnalysisClient(latency=LAYOUT_LATENCY * latency)
+        embeddings = FakeEmbeddings(latency=EMBEDDING_LATENCY * latency)
+    prepdocs.create_pipeline(search_client, FakeSearchIndexClient(), container_client, document_analysis_client, embeddings)
+    prepdocs.run()
+    with open(profile_path, encoding="utf-8") as f:
+        report = json.load(f)
+    return report, {"search": search_client, "blobs": container_client, "layout": document_analysis_client, "embeddings": embeddings}
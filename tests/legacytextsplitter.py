@@ -0,0 +1,58 @@
+"""Reference implementation for the tests and the benchmark of TextSplitter."""
+
+SENTENCE_ENDINGS = [".", "!", "?"]
+WORDS_BREAKS = [",", ";", ":", " ", "(", ")", "[", "]", "{", "}", "\t", "\n"]
+
+
+def legacy_split_text(page_map, max_section_length=1000, sentence_search_limit=100, section_overlap=100):
+    """The character scanning splitter prepdocs used before TextSplitter, kept as the baseline to compare against."""
+    def find_page(offset):
+        l = len(page_map)
+        for i in range(l - 1):
+            if offset >= page_map[i][1] and offset < page_map[i + 1][1]:
+                return i
+        return l - 1
+
+    all_text = "".join(p[2] for p in page_map)
+    length = len(all_text)
+    start = 0
+    end = length
+    while start + section_overlap < length:
+        last_word = -1
+        end = start + max_section_length
+
+        if end > length:
+            end = length
+        else:
+            # Try to find the end of the sentence
+            while end < length and (end - start - max_section_length) < sentence_search_limit and all_text[end] not in SENTENCE_ENDINGS:
+                if all_text[end] in WORDS_BREAKS:
+                    last_word = end
+                end += 1
+            if end < length and all_text[end] not in SENTENCE_ENDINGS and last_word > 0:
+                end = last_word # Fall back to at least keeping a whole word
+        if end < length:
+            end += 1
+
+        # Try to find the start of the sentence or at least a whole word boundary
+        last_word = -1
+        while start > 0 and start > end - max_section_length - 2 * sentence_search_limit and all_text[start] not in SENTENCE_ENDINGS:
+            if all_text[start] in WORDS_BREAKS:
+                last_word = start
+            start -= 1
+        if all_text[start] not in SENTENCE_ENDINGS and last_word > 0:
+            start = last_word
+        if start > 0:
+            start += 1
+
+        section_text = all_text[start:end]
+        yield (section_text, find_page(start))
+
+        last_table_start = section_text.rfind("<table")
+        if (last_table_start > 2 * sentence_search_limit and last_table_start > section_text.rfind("</table")):
+            start = min(end - section_overlap, start + last_table_start)
+        else:
+            start = end - section_overlap
+
+    if start + section_overlap < end:
+        yield (all_text[start:end], find_page(start))
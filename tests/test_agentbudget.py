@@ -0,0 +1,83 @@
+from typing import Any, List, Optional
+
+from langchain.agents import Tool, ZeroShotAgent
+from langchain.chains import LLMChain
+from langchain.llms.base import BaseLLM
+from langchain.schema import Generation, LLMResult
+
+from app.backend.core.agentbudget import FINAL_ANSWER_PROMPT, AgentBudget, BudgetedAgentExecutor
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LoopingLLM(BaseLLM):
+    """Never satisfied, always searching again unless told to answer. Every call takes 5 s on the clock and 1000 tokens."""
+    clock: Any
+    prompts: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "looping"
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> LLMResult:
+        self.prompts.extend(prompts)
+        self.clock.now += 5
+        texts = ["Final Answer: Stornokosten sind versichert [p-2.pdf]" if FINAL_ANSWER_PROMPT in p else " I need more.\nAction: Search\nAction Input: Storno" for p in prompts]
+        return LLMResult(generations=[[Generation(text=t)] for t in texts], llm_output={"token_usage": {"total_tokens": 1000}})
+
+    async def _agenerate(self, prompts, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+
+def run_agent(budget, clock, search_time=1.0):
+    def search(q):
+        clock.now += search_time
+        return "p-2.pdf: Stornokosten sind versichert."
+
+    llm = LoopingLLM(clock=clock)
+    tools = [Tool(name="Search", func=search, description="searches")]
+    prompt = ZeroShotAgent.create_prompt(tools, input_variables=["input", "agent_scratchpad"])
+    agent = ZeroShotAgent(llm_chain=LLMChain(llm=llm, prompt=prompt), tools=tools)
+    executor = BudgetedAgentExecutor.from_agent_and_tools(agent, tools)
+    return executor.run_within(budget, "Sind Stornokosten versichert?"), llm
+
+
+def test_agent_answers_when_tokens_run_low():
+    clock = Clock()
+    budget = AgentBudget(600, 5000, clock=clock)
+    answer, llm = run_agent(budget, clock)
+    assert answer == "Stornokosten sind versichert [p-2.pdf]"
+    # Three steps, then no room for another step and a final answer
+    assert (budget.iterations, budget.llm_calls, budget.tool_calls, budget.tokens) == (3, 4, 3, 4000)
+    assert budget.stopped == "tokens" and FINAL_ANSWER_PROMPT in llm.prompts[-1]
+    report = budget.report()
+    assert report["tokens"] == 4000 and report["elapsed"] == 23 and report["stopped"] == "tokens"
+
+
+def test_agent_answers_before_the_deadline():
+    clock = Clock()
+    budget = AgentBudget(40, 100000, clock=clock)
+    answer, _ = run_agent(budget, clock, search_time=4)
+    assert answer == "Stornokosten sind versichert [p-2.pdf]"
+    assert budget.stopped == "deadline" and budget.elapsed() <= 40
+    assert budget.iterations == 3
+
+
+def test_budget_for_request():
+    budget = AgentBudget.for_request({"deadline": 10, "token_budget": 10 ** 6}, deadline=60, token_budget=8000)
+    assert (budget.deadline, budget.token_budget) == (10, 8000)
+    assert AgentBudget.for_request({}, deadline=60, token_budget=8000).deadline == 60
+
+
+def test_no_final_call_without_budget_for_it():
+    clock = Clock()
+    budget = AgentBudget(10, 100000, clock=clock)
+    budget.record_llm_call(6, 1000)
+    clock.now = 6
+    assert budget.exhausted() == "deadline" and not budget.can_answer()
@@ -0,0 +1,87 @@
+import time
+
+from fakes import DirectoryContainerClient
+from prepdocslib import blobmanager
+from prepdocslib.blobmanager import BlobManager
+
+
+def test_upload_blobs_creates_container_once(tmp_path):
+    container = DirectoryContainerClient(str(tmp_path / "content"))
+    manager = BlobManager(container, max_workers=4)
+    manager.upload_blobs([("a-0.pdf", b"page 0"), ("a-1.pdf", b"page 1")])
+    manager.upload_blobs([("b.txt", b"text")])
+    manager.close()
+    assert sorted(p.name for p in (tmp_path / "content").iterdir()) == ["a-0.pdf", "a-1.pdf", "b.txt"]
+    assert (tmp_path / "content" / "a-1.pdf").read_bytes() == b"page 1"
+    # exists + create_container, then one listing and one upload per blob
+    assert container.requests == 2 + 1 + 2 + 1 + 1
+
+
+def test_upload_blobs_skips_unchanged_blobs(tmp_path):
+    container = DirectoryContainerClient(str(tmp_path / "content"))
+    manager = BlobManager(container)
+    blobs = [(f"doc-{i}.pdf", f"page {i}".encode()) for i in range(20)]
+    first = manager.upload_blobs(blobs)
+    assert (first.uploaded, first.unchanged, first.bytes) == (20, 0, sum(len(b) for _, b in blobs))
+
+    blobs[3] = ("doc-3.pdf", b"changed page")
+    second = manager.upload_blobs(blobs)
+    assert (second.uploaded, second.unchanged, second.bytes) == (1, 19, len(b"changed page"))
+    assert (tmp_path / "content" / "doc-3.pdf").read_bytes() == b"changed page"
+    manager.close()
+
+
+def test_upload_blobs_concurrently(tmp_path):
+    container = DirectoryContainerClient(str(tmp_path / "content"), latency=0.05)
+    manager = BlobManager(container, max_workers=10)
+    manager.ensure_container()
+    t = time.perf_counter()
+    manager.upload_blobs([(f"doc-{i}.pdf", b"x") for i in range(20)])
+    # 20 uploads of 50ms on 10 workers, plus the listing
+    assert time.perf_counter() - t < 0.5
+    manager.close()
+
+
+def test_remove_blobs_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobmanager, "MAX_DELETE_BATCH", 3)
+    container = DirectoryContainerClient(str(tmp_path / "content"))
+    manager = BlobManager(container)
+    manager.upload_blobs([(f"a-{i}.pdf", b"x") for i in range(7)] + [("ab.txt", b"x"), ("b-0.pdf", b"x")])
+    requests = container.requests
+    assert manager.remove_blobs("a", predicate=lambda name: name.endswith(".pdf")) == 7
+    # One listing and three batches
+    assert container.requests - requests == 1 + 1 + 3
+    assert sorted(p.name for p in (tmp_path / "content").iterdir()) == ["ab.txt", "b-0.pdf"]
+
+    assert manager.remove_blobs(names=["b-0.pdf", "missing.pdf"]) == 2
+    assert manager.remove_blobs() == 1
+    assert not list((tmp_path / "content").iterdir())
+    manager.close()
+
+
+def test_remove_blobs_without_container(tmp_path):
+    manager = BlobManager(DirectoryContainerClient(str(tmp_path / "content")))
+    assert manager.remove_blobs() == 0
+    manager.close()
+
+
+def test_start_upload_streams_blobs(tmp_path):
+    container = DirectoryContainerClient(str(tmp_path / "content"))
+    manager = BlobManager(container, max_workers=2)
+    manager.upload_blobs([("doc-0.pdf", b"page 0")])
+    upload = manager.start_upload("doc-")
+    for i in range(10):
+        upload.add(f"doc-{i}.pdf", f"page {i}".encode())
+        assert len(upload._pending) <= 4
+    assert upload.finish() == (9, 1, 9 * len(b"page 0"))
+    assert len(list((tmp_path / "content").iterdir())) == 10
+    manager.close()
+
+
+def test_set_index_version_keeps_other_metadata(tmp_path):
+    container = DirectoryContainerClient(str(tmp_path / "content"))
+    container.metadata = {"owner": "team"}
+    manager = BlobManager(container)
+    manager.set_index_version("v1")
+    manager.set_index_version("v2")
+    assert container.metadata == {"owner": "team", blobmanager.INDEX_VERSION_METADATA: "v2"}
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from prepdocslib.dedup import NearDuplicateDetector, SectionDeduplicator
+
+WORDS = ["Versicherung", "Leistung", "Beitrag", "Vertrag", "Zahn", "Tarif", "Kind", "Police", "Schutz", "Kosten", "Jahr", "Monat"]
+
+
+def text(seed, length=150):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + str(rng.randrange(50)) for _ in range(length))
+
+
+def test_signature_is_deterministic():
+    assert (NearDuplicateDetector().signature(text(0)) == NearDuplicateDetector().signature(text(0))).all()
+
+
+def test_detects_near_duplicates_only():
+    detector = NearDuplicateDetector()
+    original = text(0)
+    assert detector.check("a", original) is None
+    assert detector.check("b", text(1)) is None
+    # A changed tariff name in a long section is a near duplicate, a mostly different text is not
+    assert detector.find(original.replace(original.split()[100], "DS90", 1)) == "a"
+    assert detector.find(original[:len(original) // 3] + text(2)) is None
+    assert detector.find("") is None
+
+
+def test_threshold():
+    original = text(0, length=100)
+    words = original.split()
+    changed = " ".join(words[:50] + ["anders"] * 5 + words[55:])
+    assert NearDuplicateDetector(threshold=0.5).find(changed) is None
+    detector = NearDuplicateDetector(threshold=0.5)
+    detector.add("a", original)
+    assert detector.find(changed) == "a"
+    detector = NearDuplicateDetector(threshold=0.95)
+    detector.add("a", original)
+    assert detector.find(changed) is None
+
+
+def test_num_perm_must_be_a_multiple_of_bands():
+    with pytest.raises(ValueError):
+        NearDuplicateDetector(num_perm=100, bands=16)
+
+
+def test_section_deduplicator_links_source_pages():
+    deduplicator = SectionDeduplicator()
+    first = {"id": "ds75-0", "content": text(0), "sourcepage": "ds75-0.pdf"}
+    assert deduplicator.process(first)
+    assert first["sourcepages"] == ["ds75-0.pdf"]
+    assert deduplicator.pending_updates() == []
+
+    assert not deduplicator.process({"id": "ds90-0", "content": text(0), "sourcepage": "ds90-0.pdf"})
+    assert not deduplicator.process({"id": "ds100-0", "content": text(0), "sourcepage": "ds100-0.pdf"})
+    assert deduplicator.process({"id": "ds100-1", "content": text(1), "sourcepage": "ds100-1.pdf"})
+    assert deduplicator.duplicates == 2
+    assert deduplicator.pending_updates() == [{"id": "ds75-0", "sourcepages": ["ds75-0.pdf", "ds90-0.pdf", "ds100-0.pdf"]}]
+    assert deduplicator.pending_updates() == []
+    # The section passed on is not changed afterwards
+    assert first["sourcepages"] == ["ds75-0.pdf"]
+
+
+def test_section_deduplicator_links_files_and_clears():
+    deduplicator = SectionDeduplicator()
+    assert deduplicator.process({"id": "ds75-0", "content": text(0), "sourcepage": "ds75-0.pdf", "sourcefile": "ds75.pdf"})
+    assert not deduplicator.process({"id": "ds75-1", "content": text(0), "sourcepage": "ds75-1.pdf", "sourcefile": "ds75.pdf"})
+    assert deduplicator.pending_links() == []
+    assert not deduplicator.process({"id": "ds90-0", "content": text(0), "sourcepage": "ds90-0.pdf", "sourcefile": "ds90.pdf"})
+    assert deduplicator.pending_links() == ["ds75.pdf"]
+    assert deduplicator.pending_links() == []
+
+    deduplicator.pending_updates()
+    deduplicator.clear()
+    assert deduplicator.process({"id": "ds100-0", "content": text(0), "sourcepage": "ds100-0.pdf", "sourcefile": "ds100.pdf"})
+    assert deduplicator.duplicates == 2
@@ -0,0 +1,78 @@
+import io
+
+from azure.ai.formrecognizer import AnalyzeResult
+from pypdf import PdfWriter
+
+from fakes import FakeDocumentAnalysisClient
+from prepdocslib.formrecognizer import LayoutCache, analyze_layout, layout_to_page_map
+
+
+def write_pdf(path, pages=2):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    f = io.BytesIO()
+    writer.write(f)
+    path.write_bytes(f.getvalue())
+    return str(path)
+
+
+def test_layout_cache_key_depends_on_content_and_model():
+    assert LayoutCache.key(b"abc", "prebuilt-layout") == LayoutCache.key(b"abc", "prebuilt-layout")
+    assert LayoutCache.key(b"abc", "prebuilt-layout") != LayoutCache.key(b"abd", "prebuilt-layout")
+    assert LayoutCache.key(b"abc", "prebuilt-layout") != LayoutCache.key(b"abc", "prebuilt-read")
+
+
+def test_layout_cache_roundtrip(tmp_path):
+    cache = LayoutCache(str(tmp_path))
+    assert cache.get("00ff") is None
+    result = AnalyzeResult.from_dict({"api_version": "2022-08-31", "model_id": "prebuilt-layout", "content": "Hallo Welt", "pages": [{"page_number": 1, "spans": [{"offset": 0, "length": 10}]}], "tables": []})
+    cache.put("00ff", result)
+    assert cache.get("00ff").to_dict() == result.to_dict()
+    assert [p.name for p in tmp_path.iterdir()] == ["00"]
+
+
+def test_analyze_layout_uses_cache(tmp_path):
+    filename = write_pdf(tmp_path / "a.pdf")
+    client = FakeDocumentAnalysisClient()
+    cache = LayoutCache(str(tmp_path / "cache"))
+    first = analyze_layout(client, filename, cache)
+    second = analyze_layout(client, filename, cache)
+    assert client.calls == 1
+    assert second.to_dict() == first.to_dict()
+    assert len(second.pages) == 2
+
+    analyze_layout(client, filename, cache, refresh=True)
+    assert client.calls == 2
+
+    write_pdf(tmp_path / "a.pdf", pages=3)
+    assert len(analyze_layout(client, filename, cache).pages) == 3
+    assert client.calls == 3
+
+
+def test_analyze_layout_without_cache(tmp_path):
+    filename = write_pdf(tmp_path / "a.pdf")
+    client = FakeDocumentAnalysisClient()
+    analyze_layout(client, filename)
+    analyze_layout(client, filename)
+    assert client.calls == 2
+
+
+def test_layout_to_page_map_replaces_tables_with_html():
+    result = AnalyzeResult.from_dict({
+        "api_version": "2022-08-31",
+        "model_id": "prebuilt-layout",
+        "content": "Tarif A 10 Ende",
+        "pages": [{"page_number": 1, "spans": [{"offset": 0, "length": 15}]}],
+        "tables": [{
+            "row_count": 1,
+            "column_count": 2,
+            "cells": [
+                {"kind": "columnHeader", "row_index": 0, "column_index": 0, "content": "A"},
+                {"kind": "content", "row_index": 0, "column_index": 1, "content": "10"},
+            ],
+            "bounding_regions": [{"page_number": 1, "polygon": []}],
+            "spans": [{"offset": 6, "length": 4}],
+        }],
+    })
+    assert layout_to_page_map(result) == [(0, 0, "Tarif <table><tr><th>A</th><td>10</td></tr></table> Ende ")]
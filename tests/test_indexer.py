@@ -0,0 +1,106 @@
+import time
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+
+from fakes import FakeSearchClient
+from prepdocslib.indexer import BulkIndexer, find_keys, remove_documents
+
+
+def sections(count, content_length=100):
+    return ({"id": f"file-page-{i}", "content": "x" * content_length, "embedding": [0.125] * 16} for i in range(count))
+
+
+def test_index_batches_by_count():
+    client = FakeSearchClient()
+    summary = BulkIndexer(client, max_batch_count=10).index(sections(25))
+    assert (summary.documents, summary.succeeded, summary.batches, summary.retries, summary.failed_keys) == (25, 25, 3, 0, [])
+    assert len(client.documents) == 25
+    assert summary.bytes > 25 * 100
+    assert summary.docs_per_second > 0
+
+
+def test_index_batches_by_size():
+    client = FakeSearchClient(max_request_bytes=5000)
+    summary = BulkIndexer(client, max_batch_bytes=4000).index(sections(20, content_length=1000))
+    assert summary.batches == 7
+    assert summary.succeeded == 20
+
+
+def test_index_retries_only_failed_documents():
+    client = FakeSearchClient()
+    client.fail_keys = {"file-page-3": 2, "file-page-7": 1}
+    delays = []
+    summary = BulkIndexer(client, max_batch_count=5, sleep=delays.append).index(sections(10))
+    assert (summary.succeeded, summary.retries, summary.failed_keys) == (10, 3, [])
+    assert len(client.documents) == 10
+    # Two batches, plus two retries for the first batch and one for the second one
+    assert client.requests == 5
+    assert len(delays) == 3
+
+
+def test_index_reports_permanent_failures():
+    client = FakeSearchClient()
+    client.fail_keys = {"file-page-1": 100}
+    summary = BulkIndexer(client, max_retries=2, sleep=lambda _: None).index(sections(3))
+    assert summary.succeeded == 2
+    assert summary.failed_keys == ["file-page-1"]
+    assert summary.retries == 2
+
+
+def test_index_raises_non_retriable_request_errors():
+    client = FakeSearchClient(max_request_bytes=100)
+    with pytest.raises(HttpResponseError):
+        BulkIndexer(client).index(sections(2))
+
+
+def indexed_client(count, **kwargs):
+    client = FakeSearchClient(**kwargs)
+    for i, section in enumerate(sections(count)):
+        section["sourcefile"] = "a.pdf" if i % 2 == 0 else "b.pdf"
+        client.documents[section["id"]] = section
+    return client
+
+
+def test_find_keys_pages_through_keys_only():
+    client = indexed_client(25)
+    keys = find_keys(client, "sourcefile eq 'a.pdf'", page_size=5)
+    assert sorted(keys) == sorted(f"file-page-{i}" for i in range(0, 25, 2))
+    # Two full pages, and a partial one
+    assert client.requests == 3
+
+
+def test_remove_documents_by_filter():
+    client = indexed_client(30)
+    removed = remove_documents(BulkIndexer(client, max_batch_count=4), "sourcefile eq 'b.pdf'", sleep=lambda _: None)
+    assert removed == 15
+    assert sorted(client.documents) == sorted(f"file-page-{i}" for i in range(0, 30, 2))
+
+
+def test_remove_documents_with_known_keys_skips_search():
+    client = indexed_client(10)
+    keys = [f"file-page-{i}" for i in range(0, 10, 2)]
+    assert remove_documents(BulkIndexer(client), "sourcefile eq 'a.pdf'", keys, sleep=lambda _: None) == 5
+    # One delete request and one count request
+    assert client.requests == 2
+
+
+def test_remove_documents_waits_for_deletions_to_become_visible():
+    client = indexed_client(10, refresh_delay=0.2)
+    delays = []
+
+    def sleep(delay):
+        delays.append(delay)
+        time.sleep(delay)
+
+    assert remove_documents(BulkIndexer(client), None, sleep=sleep) == 10
+    assert not client.documents
+    # Polls with exponential backoff instead of fixed sleeps
+    assert delays[:3] == [0.05, 0.1, 0.2]
+    assert sum(delays) < 1
+
+
+def test_remove_documents_times_out():
+    client = indexed_client(2, refresh_delay=10)
+    with pytest.raises(TimeoutError):
+        remove_documents(BulkIndexer(client), None, timeout=0.1, sleep=time.sleep)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from app.backend.core.ivfpq import IvfPqIndex
+
+
+def vectors(count, dimensions=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(10, dimensions))
+    return (centers[rng.integers(0, 10, count)] + 0.3 * rng.normal(size=(count, dimensions))).astype(np.float32)
+
+
+def exact(data, query, k):
+    normalized = data / np.linalg.norm(data, axis=1, keepdims=True)
+    return np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:k]
+
+
+def test_search_finds_nearest_neighbors():
+    data, queries = vectors(2000), vectors(20, seed=1)
+    index = IvfPqIndex.build(data, nlist=16, subquantizers=8, nprobe=8, refine=4)
+    recall = np.mean([len(set(index.search(q, 10)[0].tolist()) & set(exact(data, q, 10).tolist())) / 10 for q in queries])
+    assert recall >= 0.95
+    labels, scores = index.search(data[7], 1)
+    assert labels.tolist() == [7]
+    assert scores[0] == pytest.approx(1.0)
+    # Probing every list and refining every vector is exhaustive
+    assert index.search(queries[0], 10, nprobe=16, refine=200)[0].tolist() == exact(data, queries[0], 10).tolist()
+
+
+def test_labels_and_mask():
+    data = vectors(500)
+    index = IvfPqIndex.build(data, labels=np.arange(1000, 1500), nlist=20, subquantizers=4, nprobe=1, refine=2)
+    mask = np.zeros(1500, dtype=bool)
+    mask[1100:] = True
+    labels, _ = index.search(data[3], 5, mask=mask)
+    assert len(labels) == 5 and all(label >= 1100 for label in labels)
+    # Fewer allowed vectors than candidates are compared exhaustively
+    mask[:] = False
+    mask[[1003, 1450]] = True
+    assert index.search(data[3], 5, mask=mask)[0].tolist() == [1003, 1450]
+
+
+def test_save_and_load(tmp_path):
+    data, queries = vectors(300), vectors(10, seed=1)
+    index = IvfPqIndex.build(data, nlist=8, subquantizers=8, metric="euclidean", nprobe=2, refine=3)
+    index.metadata["keys"] = "abc"
+    path = str(tmp_path / "vectors.ivfpq")
+    index.save(path)
+    loaded = IvfPqIndex.load(path)
+    assert isinstance(loaded.vectors, np.memmap) and isinstance(loaded.codes, np.memmap)
+    assert (loaded.nlist, loaded.nprobe, loaded.refine, loaded.metric, loaded.metadata) == (8, 2, 3, "euclidean", {"keys": "abc"})
+    for q in queries:
+        labels, scores = loaded.search(q, 5)
+        expected_labels, expected_scores = index.search(q, 5)
+        assert labels.tolist() == expected_labels.tolist()
+        assert np.allclose(scores, expected_scores)
+
+
+def test_rejects_invalid_parameters(tmp_path):
+    with pytest.raises(ValueError):
+        IvfPqIndex.build(vectors(10), metric="manhattan")
+    with pytest.raises(ValueError):
+        IvfPqIndex.build(vectors(10), subquantizers=5)
+    with pytest.raises(ValueError):
+        IvfPqIndex.build(np.zeros((0, 16), dtype=np.float32))
+    index = IvfPqIndex.build(vectors(10))
+    with pytest.raises(ValueError):
+        index.search(np.ones(8), 3)
+    path = tmp_path / "vectors.ivfpq"
+    path.write_bytes(b"not an index")
+    with pytest.raises(ValueError):
+        IvfPqIndex.load(str(path))
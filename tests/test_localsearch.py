@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from app.backend.core.localsearch import LocalSearchClient, analyze, german_stem, reciprocal_rank_fusion
+from prepdocslib.sectionfile import SectionWriter
+
+DOCUMENTS = [
+    {"id": "0", "content": "Die Zahnversicherung übernimmt Kosten für Zahnersatz.", "category": None, "sourcepage": "zahn-0.pdf", "sourcefile": "zahn.pdf", "embedding": [1.0, 0.0, 0.0]},
+    {"id": "1", "content": "Die Reiseversicherung gilt weltweit. Stornokosten sind versichert.", "category": "reise", "sourcepage": "reise-0.pdf", "sourcefile": "reise.pdf", "embedding": [0.0, 1.0, 0.0]},
+    {"id": "2", "content": "Kosten für Brillen übernimmt der Tarif nicht.", "category": None, "sourcepage": "zahn-1.pdf", "sourcefile": "zahn.pdf", "embedding": [0.6, 0.8, 0.0]},
+    {"id": "3", "content": "Der Beitrag wird monatlich gezahlt.", "category": "reise", "sourcepage": "reise-1.pdf", "sourcefile": "reise.pdf", "embedding": [0.0, 0.0, 1.0]},
+]
+
+
+def test_german_analysis():
+    assert german_stem("versicherungen") == german_stem("versicherung")
+    assert german_stem("kosten") == german_stem("kost")
+    assert german_stem("häuser") == german_stem("hauser")
+    assert analyze("Die Kosten der Brillen") == [german_stem("kosten"), german_stem("brillen")]
+
+
+def test_text_search_ranks_with_bm25():
+    client = LocalSearchClient(DOCUMENTS)
+    results = list(client.search("Kosten Zahnersatz"))
+    # Compound words are not split, Stornokosten does not match Kosten
+    assert [r["id"] for r in results] == ["0", "2"]
+    assert results[0]["@search.score"] > results[1]["@search.score"] > 0
+    assert list(client.search("Haftpflicht")) == []
+
+
+def test_vector_search_returns_top_k_by_cosine_similarity():
+    client = LocalSearchClient(DOCUMENTS)
+    results = list(client.search(None, vector=[2.0, 0.1, 0.0], top_k=2, vector_fields="embedding"))
+    assert [r["id"] for r in results] == ["0", "2"]
+    assert results[0]["embedding"] == pytest.approx([1.0, 0.0, 0.0])
+    with pytest.raises(ValueError):
+        client.search(None, vector=[1.0, 0.0])
+
+
+def test_hybrid_search_fuses_rankings():
+    client = LocalSearchClient(DOCUMENTS)
+    results = list(client.search("Stornokosten", vector=[0.6, 0.8, 0.0], top_k=3, vector_fields="embedding", top=3))
+    # Document 1 is the only text match and second by vector, so it overtakes document 2 which is first by vector
+    assert [r["id"] for r in results] == ["1", "2", "0"]
+    assert reciprocal_rank_fusion([[(1, 9.0), (2, 5.0)], [(2, 0.9), (3, 0.1)]]) == [(2, 1 / 62 + 1 / 61), (1, 1 / 61), (3, 1 / 62)]
+
+
+def test_filters_top_skip_select_and_count():
+    client = LocalSearchClient(DOCUMENTS)
+    assert [r["id"] for r in client.search("Kosten", filter="category ne 'reise'")] == ["0", "2"]
+    assert [r["id"] for r in client.search(None, filter="sourcefile eq 'reise.pdf' and category eq 'reise'")] == ["1", "3"]
+    results = client.search("*", top=1, skip=1, select=["id", "sourcepage"], include_total_count=True)
+    assert [{k: v for k, v in r.items() if not k.startswith("@")} for r in results] == [{"id": "1", "sourcepage": "reise-0.pdf"}]
+    assert results.get_count() == 4
+    assert results.get_answers() is None
+    with pytest.raises(ValueError):
+        client.search("Kosten", filter="search.ismatch('x')")
+
+
+def test_captions():
+    client = LocalSearchClient(DOCUMENTS)
+    result = next(iter(client.search("Stornokosten", query_type="semantic", query_caption="extractive|highlight-false")))
+    assert [c.text for c in result["@search.captions"]] == ["Stornokosten sind versichert."]
+
+
+def test_loads_exported_sections(tmp_path):
+    path = str(tmp_path / "sections.jsonl.gz")
+    with SectionWriter(path) as writer:
+        for document in DOCUMENTS:
+            writer.write(document)
+        writer.write({"id": "0", "sourcepages": ["zahn-0.pdf", "zahn-3.pdf"], "@search.action": "merge"})
+    client = LocalSearchClient.from_file(path)
+    assert len(client) == 4
+    assert client.get_document("0")["sourcepages"] == ["zahn-0.pdf", "zahn-3.pdf"]
+    assert np.allclose(client.get_document("2")["embedding"], [0.6, 0.8, 0.0])
+
+
+def test_vector_index(tmp_path):
+    path = str(tmp_path / "sections.jsonl")
+    with SectionWriter(path) as writer:
+        for document in DOCUMENTS:
+            writer.write(document)
+    index_path = str(tmp_path / "vectors.ivfpq")
+    with pytest.raises(FileNotFoundError):
+        LocalSearchClient.from_file(path, vector_index_path=index_path)
+    built = LocalSearchClient.from_file(path)
+    built.build_vector_index().save(index_path)
+    loaded = LocalSearchClient.from_file(path, vector_index_path=index_path)
+    assert isinstance(loaded.vector_index.vectors, np.memmap) and loaded.vector_index.metadata["keys"] == loaded.keys_digest()
+    for client in (built, loaded):
+        assert [r["id"] for r in client.search(None, vector=[2.0, 0.1, 0.0], top_k=2)] == ["0", "2"]
+        assert [r["id"] for r in client.search(None, vector=[2.0, 0.1, 0.0], top_k=2, filter="category eq 'reise'")] == ["1", "3"]
+        assert np.allclose(client.get_document("2")["embedding"], [0.6, 0.8, 0.0])
+
+    # An index of other sections is refused instead of being rebuilt
+    with SectionWriter(path) as writer:
+        for document in DOCUMENTS[1:]:
+            writer.write(document)
+    with pytest.raises(ValueError):
+        LocalSearchClient.from_file(path, vector_index_path=index_path)
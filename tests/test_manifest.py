@@ -0,0 +1,46 @@
+from prepdocslib.manifest import IngestionManifest
+
+
+def test_manifest_roundtrip(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestionManifest(path)
+    manifest.record_ids("a.pdf", ["a-0", "a-1"])
+    manifest.record_blobs("a.pdf", ["a-0.pdf"])
+    manifest.record_ids("b.pdf", ["b-0"])
+    manifest.save()
+
+    manifest = IngestionManifest(path)
+    assert "a.pdf" in manifest
+    assert manifest.ids("a.pdf") == ["a-0", "a-1"]
+    assert manifest.blobs("a.pdf") == ["a-0.pdf"]
+    assert manifest.blobs("b.pdf") == []
+    assert manifest.ids() == ["a-0", "a-1", "b-0"]
+    assert manifest.ids("missing.pdf") == []
+
+
+def test_manifest_remove(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestionManifest(path)
+    manifest.record_ids("a.pdf", ["a-0"])
+    manifest.record_ids("b.pdf", ["b-0"])
+    manifest.remove("a.pdf")
+    assert manifest.sourcefiles() == ["b.pdf"]
+    manifest.remove()
+    manifest.save()
+    assert IngestionManifest(path).sourcefiles() == []
+
+
+def test_manifest_duplicates(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestionManifest(path)
+    manifest.record_ids("ds75.pdf", ["ds75-0"])
+    manifest.record_duplicates("ds75.pdf", ["data/ds90.pdf", "data/ds100.pdf", "data/ds90.pdf"])
+    manifest.save()
+    manifest = IngestionManifest(path)
+    assert manifest.duplicates("ds75.pdf") == ["data/ds100.pdf", "data/ds90.pdf"]
+    assert manifest.duplicates("ds90.pdf") == []
+    manifest.forget_duplicates_of("ds100.pdf")
+    assert manifest.duplicates("ds75.pdf") == ["data/ds90.pdf"]
+    manifest.record_ids("ds90.pdf", ["ds90-0"])
+    manifest.remove("ds90.pdf")
+    assert manifest.duplicates("ds75.pdf") == []
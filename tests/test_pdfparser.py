@@ -0,0 +1,66 @@
+import io
+
+from pypdf import PdfReader
+
+from prepdocslib.pdfparser import PdfParser
+
+PDF = "data/leistungsuebersicht-senioren.pdf"
+
+
+def test_parse_extracts_text_and_splits_pages():
+    pages = PdfParser().parse(PDF)
+    assert [p.page_num for p in pages] == [0, 1]
+    assert all(p.text for p in pages)
+    for page in pages:
+        single_page = PdfReader(io.BytesIO(page.content)).pages
+        assert len(single_page) == 1
+        assert single_page[0].extract_text() == page.text
+
+
+def test_parse_only_what_is_needed():
+    assert all(p.content is None for p in PdfParser().parse(PDF, split_pages=False))
+    assert all(p.text is None for p in PdfParser().parse(PDF, extract_text=False))
+
+
+def parse_all(parser, files, **kwargs):
+    return [(filename, pages if pages is None else list(pages)) for filename, pages in parser.iter_files(files, **kwargs)]
+
+
+def test_iter_files_in_process_pool_keeps_file_and_page_order():
+    files = [PDF, "data/hausratversicherung-leistungsuebersicht.pdf", "app/backend/data/employeeinfo.csv", "data/Information-amts-diensthaftpflicht.pdf"]
+    expected = parse_all(PdfParser(), files)
+    with PdfParser(workers=2, pages_per_task=1) as parser:
+        parsed = parse_all(parser, files)
+    assert [filename for filename, _ in parsed] == files
+    assert parsed[2][1] is None
+    assert [[p.text for p in pages] for _, pages in parsed if pages] == [[p.text for p in pages] for _, pages in expected if pages]
+    assert [len(pages) for _, pages in parsed if pages] == [2, 2, 1]
+
+
+def test_iter_files_yields_pages_lazily():
+    files = [PDF, "app/backend/data/employeeinfo.csv", "data/hausratversicherung-leistungsuebersicht.pdf"]
+    expected = [(filename, None if filename.endswith(".csv") else PdfParser().parse(filename)) for filename in files]
+    for workers in (1, 2):
+        with PdfParser(workers=workers, pages_per_task=1) as parser:
+            parsed = parse_all(parser, files, max_pending_tasks=1)
+        assert parsed == expected
+
+
+def test_iter_files_skips_unconsumed_pages():
+    files = [PDF, "data/hausratversicherung-leistungsuebersicht.pdf"]
+    with PdfParser(workers=2, pages_per_task=1) as parser:
+        parsed = parser.iter_files(files, split_pages=False)
+        _, pages = next(parsed)
+        assert next(pages).page_num == 0
+        filename, pages = next(parsed)
+        assert filename == files[1]
+        assert [p.page_num for p in pages] == [0, 1]
+
+
+def test_iter_files_starts_the_pool_for_the_first_task():
+    with PdfParser(workers=2) as parser:
+        assert parse_all(parser, ["app/backend/data/employeeinfo.csv"]) == [("app/backend/data/employeeinfo.csv", None)]
+        assert parse_all(parser, [PDF], extract_text=False, split_pages=False) == [(PDF, None)]
+        assert parser._executor is None
+        assert len(parse_all(parser, [PDF])[0][1]) == 2
+        assert parser._executor is not None
@@ -1,4 +1,20 @@
-from scripts.prepdocs import filename_to_id
+import shutil
+
+import pytest
+from azure.search.documents.indexes.models import SearchField, SearchFieldDataType, SearchIndex, SimpleField
+
+import prepdocs
+from fakes import FakeSearchClient, FakeSearchIndexClient
+from ingestion import PIPELINE_GLOBALS, run_ingestion
+from prepdocs import filename_to_id
+from prepdocslib.manifest import IngestionManifest
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Restores the arguments and pipeline of prepdocs after the test."""
+    for name in PIPELINE_GLOBALS:
+        monkeypatch.setattr(prepdocs, name, getattr(prepdocs, name, None), raising=False)
 
 
 def test_filename_to_id():
@@ -8,3 +24,65 @@ def test_filename_to_id():
     assert filename_to_id("foo\u00A9.txt") == "file-foo__txt-666F6FC2A92E747874"
     # test filenaming starting with unicode
     assert filename_to_id("ファイル名.pdf") == "file-______pdf-E38395E382A1E382A4E383ABE5908D2E706466"
+
+
+def test_ingestion_pipeline_with_stand_ins(tmp_path, pipeline):
+    files = "data/leistungsuebersicht-senioren.pdf"
+    report, clients = run_ingestion(files, str(tmp_path), latency=0, prepdocs_args=["--pdfworkers", "1"])
+    documents = clients["search"].documents
+    assert documents
+    assert all(len(d["embedding"]) == 1536 for d in documents.values())
+    assert sorted(p.name for p in (tmp_path / "blobs").iterdir()) == ["leistungsuebersicht-senioren-0.pdf", "leistungsuebersicht-senioren-1.pdf"]
+    assert list(report["files"]) == ["leistungsuebersicht-senioren.pdf"]
+    assert list(report["stages"]) == ["pdf", "blobs", "layout", "split", "embedding", "indexing"]
+    assert report["stages"]["indexing"]["items"] == len(documents)
+    assert report["stages"]["blobs"]["items"] == 2
+    assert clients["layout"].calls == 1
+
+
+def test_create_search_index_hides_embeddings(monkeypatch, pipeline):
+    monkeypatch.setattr(prepdocs, "args", prepdocs.parse_args(["*.pdf", "--index", "new"]))
+    index_client = FakeSearchIndexClient()
+    prepdocs.create_pipeline(FakeSearchClient(), index_client)
+    prepdocs.create_search_index()
+    assert next(f for f in index_client.indexes["new"].fields if f.name == "embedding").hidden
+
+    # Indexes created before are migrated in place
+    index_client.create_index(SearchIndex(name="old", fields=[
+        SimpleField(name="id", type="Edm.String", key=True),
+        SearchField(name="embedding", type=SearchFieldDataType.Collection(SearchFieldDataType.Single), hidden=False, searchable=True, vector_search_dimensions=1536),
+    ]))
+    monkeypatch.setattr(prepdocs, "args", prepdocs.parse_args(["*.pdf", "--index", "old"]))
+    prepdocs.create_search_index()
+    assert next(f for f in index_client.indexes["old"].fields if f.name == "embedding").hidden
+    assert any(f.name == "sourcepages" and f.filterable for f in index_client.indexes["old"].fields)
+
+
+def test_dedup_ingests_files_again_when_their_duplicates_lose_their_sections(tmp_path, pipeline, capsys):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name in ("a.pdf", "b.pdf"):
+        shutil.copy("data/leistungsuebersicht-senioren.pdf", docs / name)
+    manifest_path = str(tmp_path / "manifest.json")
+    args = ["--pdfworkers", "1", "--dedup", "--manifest", manifest_path]
+    _, clients = run_ingestion(str(docs / "*.pdf"), str(tmp_path), latency=0, prepdocs_args=args)
+    manifest = IngestionManifest(manifest_path)
+    canonical, duplicate = ("a.pdf", "b.pdf") if manifest.duplicates("a.pdf") else ("b.pdf", "a.pdf")
+    assert manifest.duplicates(canonical) == [str(docs / duplicate)]
+    documents = clients["search"].documents
+    assert {d["sourcefile"] for d in documents.values()} == {canonical}
+    sections = len(documents)
+
+    # Indexed again on its own, the duplicates of the file are linked to it again
+    run_ingestion(str(docs / canonical), str(tmp_path), latency=0, prepdocs_args=args, clients=clients)
+    assert "Ingesting 1 files again" in capsys.readouterr().out
+    assert IngestionManifest(manifest_path).duplicates(canonical) == [str(docs / duplicate)]
+    assert {d["sourcefile"] for d in documents.values()} == {canonical}
+
+    # Removed, its duplicates are indexed in its place
+    run_ingestion(str(docs / canonical), str(tmp_path), latency=0, prepdocs_args=[*args, "--remove"], clients=clients)
+    assert {d["sourcefile"] for d in documents.values()} == {duplicate}
+    assert len(documents) == sections
+    manifest = IngestionManifest(manifest_path)
+    assert manifest.sourcefiles() == [duplicate]
+    assert manifest.duplicates(duplicate) == []
@@ -0,0 +1,56 @@
+import itertools
+
+from prepdocslib.profiler import Profiler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_nested_stages_count_exclusive_time():
+    clock = FakeClock()
+    profiler = Profiler(clock=clock, cpu_clock=clock)
+
+    def produce():
+        for i in range(3):
+            clock.now += 1
+            yield i
+
+    with profiler.stage("indexing", "a.pdf"):
+        clock.now += 0.5
+        for _ in profiler.iterate("split", "a.pdf", produce(), size=lambda i: 10):
+            clock.now += 2
+    totals = profiler.totals()
+    assert totals["split"].wall == 3
+    assert totals["split"].items == 3
+    assert totals["split"].bytes == 30
+    assert totals["indexing"].wall == 6.5
+    assert list(totals) == ["split", "indexing"]
+
+
+def test_report_per_file():
+    clock = FakeClock()
+    profiler = Profiler(clock=clock, cpu_clock=clock)
+    for filename in ["a.pdf", "b.pdf"]:
+        with profiler.stage("embedding", filename, items=1, bytes=100):
+            clock.now += 1
+    profiler.add("embedding", "b.pdf", items=2)
+    report = profiler.report()
+    assert report["stages"]["embedding"] == {"wall": 2, "cpu": 2, "items": 4, "bytes": 200}
+    assert report["files"]["b.pdf"]["embedding"]["items"] == 3
+    assert report["elapsed"] == 2
+    assert "embedding" in profiler.summary()
+
+
+def test_disabled_profiler_passes_through():
+    profiler = Profiler(enabled=False)
+    items = iter([1, 2])
+    assert profiler.iterate("split", "a.pdf", items) is items
+    with profiler.stage("split", "a.pdf"):
+        pass
+    assert profiler.files == {}
+    assert list(itertools.islice(items, 2)) == [1, 2]
@@ -0,0 +1,20 @@
+from app.backend.core.queryplan import PlanStep, is_insufficient, parse_plan
+
+
+def test_parse_plan():
+    plan = parse_plan("Search[Nicholas Ray]\n2. search [Elia Kazan]\nAction: Lookup[director]\nSearch[Nicholas Ray]\nI will search twice.")
+    assert plan.steps == [PlanStep("Search", "Nicholas Ray"), PlanStep("Search", "Elia Kazan"), PlanStep("Lookup", "director")]
+    assert plan.executable
+    assert str(plan) == "Search[Nicholas Ray]\nSearch[Elia Kazan]\nLookup[director]"
+
+
+def test_plan_is_not_executable_when_sequential_or_empty():
+    plan = parse_plan("Search[Colorado orogeny]\nSequential")
+    assert plan.steps == [PlanStep("Search", "Colorado orogeny")] and plan.sequential and not plan.executable
+    assert not parse_plan("I cannot plan this.").executable
+    assert len(parse_plan("\n".join(f"Search[{i}]" for i in range(10)), max_steps=3).steps) == 3
+
+
+def test_is_insufficient():
+    assert is_insufficient(" INSUFFICIENT.") and is_insufficient("Insufficient")
+    assert not is_insufficient("1,800 to 7,000 ft <filea.pdf>")
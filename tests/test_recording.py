@@ -0,0 +1,83 @@
+import json
+
+import openai
+import openai.api_requestor
+import pytest
+import requests
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import HttpTransport, RequestsTransportResponse
+from azure.search.documents import SearchClient
+
+from app.backend.core.recording import Recording, ReplayMissError
+
+
+class SearchTransport(HttpTransport):
+    """Answers search requests with one document per request, numbered."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json; odata.metadata=none"
+        response.headers["request-id"] = "abc"
+        response._content = json.dumps({"value": [{"id": str(self.calls), "@search.score": 1.0}]}).encode("utf-8")
+        return RequestsTransportResponse(request, response)
+
+
+def test_recorded_search_replays_without_the_service(tmp_path):
+    path = str(tmp_path / "search.jsonl.gz")
+    recording = Recording(path, "record")
+    inner = SearchTransport()
+    client = SearchClient("https://live.search.windows.net", "index", AzureKeyCredential("key"), transport=recording.transport(inner))
+    assert [d["id"] for d in client.search("Storno")] == ["1"]
+    assert [d["id"] for d in client.search("Storno")] == ["2"]
+    assert [d["id"] for d in client.search("Zahnersatz")] == ["3"]
+    recording.save()
+    assert recording.entries[0]["headers"] == {"Content-Type": "application/json; odata.metadata=none"}
+
+    sleeps = []
+    replay = Recording(path, latency_scale=2.0, sleep=sleeps.append)
+    client = SearchClient("https://other.search.windows.net", "index", AzureKeyCredential("other"), transport=replay.transport())
+    # Responses of a repeated request come back in the recorded order, then again from the first
+    assert [[d["id"] for d in client.search(q)] for q in ("Zahnersatz", "Storno", "Storno", "Storno")] == [["3"], ["1"], ["2"], ["1"]]
+    assert replay.replayed == 4 and len(sleeps) == 4 and inner.calls == 3
+    with pytest.raises(ReplayMissError):
+        list(client.search("Brille"))
+
+
+def test_openai_replays_from_a_session_of_the_recording(monkeypatch):
+    recording = Recording()
+    body = {"input": "Storno", "encoding_format": "base64"}
+    url = "https://any.openai.azure.com/openai/deployments/embedding/embeddings?api-version=2023-05-15"
+    recording.record("POST", url, json.dumps(body), 200, {"Content-Type": "application/json"},
+                     json.dumps({"object": "list", "data": [{"object": "embedding", "index": 0, "embedding": [0.5, 0.25]}]}).encode("utf-8"), 0.1)
+    assert recording.key("POST", url, json.dumps(body)) == recording.key("POST", url.replace("any", "other"), json.dumps(body, indent=2))
+
+    monkeypatch.setattr(openai, "requestssession", recording.requests_session)
+    monkeypatch.setattr(openai, "api_type", "azure")
+    monkeypatch.setattr(openai, "api_base", "https://replay.openai.azure.com")
+    monkeypatch.setattr(openai, "api_version", "2023-05-15")
+    monkeypatch.setattr(openai, "api_key", "replay")
+    monkeypatch.delattr(openai.api_requestor._thread_context, "session", raising=False)
+    try:
+        response = openai.Embedding.create(engine="embedding", input="Storno")
+        assert response["data"][0]["embedding"] == [0.5, 0.25]
+        with pytest.raises(ReplayMissError):
+            openai.Embedding.create(engine="embedding", input="Brille")
+    finally:
+        openai.api_requestor._thread_context.__dict__.pop("session", None)
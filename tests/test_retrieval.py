@@ -0,0 +1,100 @@
+import threading
+import time
+
+from app.backend.core.localsearch import LocalSearchClient
+from app.backend.core.retrieval import Retriever
+from fakes import FakeEmbeddings, fake_embedding
+
+CONTENTS = [
+    "Die Zahnversicherung übernimmt Kosten für Zahnersatz.",
+    "Die Reiseversicherung gilt weltweit.",
+    "Stornokosten sind in der Reiseversicherung versichert.",
+    "Kosten für Brillen übernimmt der Tarif nicht.",
+]
+DOCUMENTS = [{"id": str(i), "content": c, "category": "reise" if "Reise" in c else None, "sourcepage": f"p-{i}.pdf", "embedding": fake_embedding(c, 8)} for i, c in enumerate(CONTENTS)]
+
+
+class RecordingSearchClient(LocalSearchClient):
+    def __init__(self, *args, latency=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+        self.calls = []
+        self.active = self.max_active = 0
+        self._lock = threading.Lock()
+
+    def search(self, search_text, **kwargs):
+        with self._lock:
+            self.calls.append((search_text, kwargs))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency)
+        with self._lock:
+            self.active -= 1
+        return super().search(search_text, **kwargs)
+
+
+class DictCache(dict):
+    def set(self, key, value):
+        self[key] = value
+
+
+def test_single_query_uses_overrides():
+    search_client = RecordingSearchClient(DOCUMENTS)
+    embeddings = FakeEmbeddings(dimensions=8)
+    retriever = Retriever(search_client, "embedding", "sourcepage", "content", embeddings=embeddings)
+    retrieval = retriever.retrieve("Kosten Zahnersatz", {"top": 1, "exclude_category": "reise", "retrieval_mode": "hybrid"})
+    assert [d["id"] for d in retrieval] == ["0"]
+    assert set(retrieval.documents[0]) >= {"id", "sourcepage", "content"} and "embedding" not in retrieval.documents[0]
+    search_text, kwargs = search_client.calls[0]
+    assert search_text == "Kosten Zahnersatz"
+    assert kwargs["filter"] == "category ne 'reise'" and kwargs["top"] == 1 and kwargs["top_k"] == 50
+    assert kwargs["vector"] == fake_embedding("Kosten Zahnersatz", 8)
+    assert (retrieval.stats.queries, retrieval.stats.embedding_calls, retrieval.stats.searches) == (1, 1, 1)
+
+    retriever.retrieve("Kosten", {"retrieval_mode": "text"})
+    assert search_client.calls[1][1]["vector"] is None and embeddings.calls == 1
+    retriever.retrieve("Kosten", {"retrieval_mode": "vectors"})
+    assert search_client.calls[2][0] is None and embeddings.calls == 2
+    assert retriever.totals.searches == 3
+
+
+def test_many_queries_are_embedded_once_searched_concurrently_and_fused():
+    search_client = RecordingSearchClient(DOCUMENTS, latency=0.2)
+    embeddings = FakeEmbeddings(dimensions=8)
+    retriever = Retriever(search_client, "embedding", "sourcepage", "content", embeddings=embeddings)
+    t = time.perf_counter()
+    retrieval = retriever.retrieve(["Zahnersatz Kosten", "Stornokosten Reiseversicherung", "Brillen Kosten"], {"retrieval_mode": "text", "top": 3})
+    assert time.perf_counter() - t < 0.5
+    assert search_client.max_active == 3
+    ids = [d["id"] for d in retrieval]
+    assert len(ids) == 3 and len(set(ids)) == 3
+    assert embeddings.calls == 0
+
+    retriever.retrieve(["Zahnersatz", "Reise"], {"retrieval_mode": "hybrid"})
+    assert embeddings.calls == 1
+
+
+def test_cache():
+    search_client = RecordingSearchClient(DOCUMENTS)
+    embeddings = FakeEmbeddings(dimensions=8)
+    retriever = Retriever(search_client, "embedding", "sourcepage", "content", embeddings=embeddings, cache=DictCache())
+    first = retriever.retrieve(["Kosten", "Reise"], {})
+    second = retriever.retrieve(["Kosten", "Reise", "Tarif"], {})
+    assert second.stats.cache_hits == 2 and second.stats.searches == 1
+    assert len(search_client.calls) == 3 and embeddings.calls == 2
+    assert [d["id"] for d in retriever.retrieve(["Kosten", "Reise"], {}).documents] == [d["id"] for d in first.documents]
+    # Other overrides are other cache entries
+    retriever.retrieve("Kosten", {"exclude_category": "reise"})
+    assert len(search_client.calls) == 4
+
+
+def test_retrieve_each_keeps_the_results_of_every_query():
+    search_client = RecordingSearchClient(DOCUMENTS, latency=0.2)
+    embeddings = FakeEmbeddings(dimensions=8)
+    retriever = Retriever(search_client, "embedding", "sourcepage", "content", embeddings=embeddings)
+    t = time.perf_counter()
+    retrievals = retriever.retrieve_each(["Zahnersatz", "Stornokosten", "Brillen"], {"top": 1})
+    assert time.perf_counter() - t < 0.5
+    assert [[d["id"] for d in r] for r in retrievals] == [["0"], ["2"], ["3"]]
+    assert embeddings.calls == 1 and retrievals[0].stats.searches == 3
+    assert retriever.retrieve_each([], {}) == []
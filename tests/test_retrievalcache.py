@@ -0,0 +1,74 @@
+import threading
+
+from app.backend.core.retrievalcache import RetrievalCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire():
+    clock = Clock()
+    cache = RetrievalCache(ttl=10, clock=clock)
+    cache.set("q", [{"id": "1"}])
+    clock.now = 9
+    assert cache.get("q") == [{"id": "1"}]
+    clock.now = 10
+    assert cache.get("q") is None
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 0)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = RetrievalCache(max_entries=2)
+    cache.set("a", [])
+    cache.set("b", [])
+    cache.get("a")
+    cache.set("c", [])
+    assert cache.get("b") is None and cache.get("a") == [] and cache.get("c") == []
+    assert cache.evictions == 1
+
+
+def test_only_fields_and_annotations_are_kept():
+    cache = RetrievalCache(fields=["id", "content"])
+    cache.set("q", [{"id": "1", "content": "text", "embedding": [0.1], "@search.score": 1.5}])
+    assert cache.get("q") == [{"id": "1", "content": "text", "@search.score": 1.5}]
+
+
+def test_cache_is_cleared_when_the_polled_index_version_changes():
+    versions = ["v1"]
+
+    def version():
+        if isinstance(versions[0], Exception):
+            raise versions[0]
+        return versions[0]
+
+    cache = RetrievalCache(version=version)
+    cache.poll()
+    cache.set("q", [{"id": "1"}])
+    versions[0] = "v2"
+    # Requests only see the polled version
+    assert cache.get("q") == [{"id": "1"}]
+    cache.poll()
+    assert cache.get("q") is None
+    cache.set("q", [{"id": "2"}])
+    versions[0] = ConnectionError("unavailable")
+    cache.poll()
+    assert cache.get("q") == [{"id": "2"}]
+
+
+def test_index_version_is_polled_in_the_background():
+    polled = threading.Event()
+
+    def version():
+        polled.set()
+        return "v1"
+
+    cache = RetrievalCache(version=version, version_interval=60).start()
+    try:
+        assert polled.wait(5)
+    finally:
+        cache.stop()
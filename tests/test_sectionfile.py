@@ -0,0 +1,32 @@
+import pytest
+
+from prepdocslib.sectionfile import SectionWriter, decode_embedding, encode_embedding, read_sections
+
+
+def test_embedding_roundtrip():
+    embedding = [0.5, -0.25, 1e-3, 3.0]
+    decoded = decode_embedding(encode_embedding(embedding))
+    assert decoded == pytest.approx(embedding)
+    assert len(encode_embedding([0.1] * 1536)) == 8192
+
+
+@pytest.mark.parametrize("name", ["sections.jsonl", "sections.jsonl.gz"])
+def test_sections_roundtrip(tmp_path, name):
+    path = str(tmp_path / name)
+    sections = [
+        {"id": "file-a-page-0", "content": "Grüße", "category": None, "sourcepage": "a-0.pdf", "sourcefile": "a.pdf", "embedding": [0.5, 0.25]},
+        {"id": "file-a-page-1", "content": "Text", "category": "x", "sourcepage": "a-1.pdf", "sourcefile": "a.pdf"},
+    ]
+    with SectionWriter(path) as writer:
+        for section in sections:
+            writer.write(section)
+    assert writer.count == 2
+    assert list(read_sections(path)) == sections
+    assert [s.get("embedding") for s in read_sections(path, include_embeddings=False)] == [None, None]
+
+
+def test_read_sections_rejects_other_files(tmp_path):
+    path = tmp_path / "other.jsonl"
+    path.write_text('{"id": "1"}\n')
+    with pytest.raises(ValueError):
+        list(read_sections(str(path)))
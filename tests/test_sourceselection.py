@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from app.backend.core.sourceselection import SourceSelector, lexical_similarity, relevance, select_sources
+
+SOURCES = [
+    "a.pdf: Zahnersatz wird zu 90 Prozent erstattet, auch Implantate und Kronen.",
+    "b.pdf: Zahnersatz wird zu 90 Prozent erstattet, auch Implantate und Kronen.",
+    "a.pdf: Zahnersatz wird zu 90 Prozent erstattet, auch Implantate.",
+    "c.pdf: Die Wartezeit beträgt acht Monate ab Vertragsbeginn.",
+    "d.pdf: Brillen sind nicht versichert.",
+]
+
+
+def test_relevance():
+    assert relevance([{"@search.score": 2.0}, {"@search.score": 1.0}, {"@search.score": -1.0}]).tolist() == [1.0, 0.5, 0.0]
+    assert relevance([{"@search.score": 0.1, "@search.reranker_score": 3.0}, {"@search.score": 0.2, "@search.reranker_score": 1.5}]).tolist() == [1.0, 0.5]
+    assert relevance([{}, {}]).tolist() == [1.0, 0.5]
+
+
+def test_lexical_similarity():
+    similarity = lexical_similarity(SOURCES)
+    assert np.allclose(np.diag(similarity), 1)
+    assert similarity[0, 1] > 0.9 and similarity[0, 3] < 0.2
+
+
+def test_mmr_skips_redundant_sources():
+    scores = np.array([1.0, 0.95, 0.9, 0.5, 0.4])
+    assert select_sources(SOURCES, scores, 3, mmr_lambda=1.0) == [0, 1, 2]
+    assert select_sources(SOURCES, scores, 3, mmr_lambda=0.5) == [0, 3, 4]
+
+
+def test_token_budget():
+    scores = np.array([1.0, 0.95, 0.9, 0.5, 0.4])
+    count_tokens = len
+    assert select_sources(SOURCES, scores, 3, token_budget=len(SOURCES[0]) + len(SOURCES[4]), count_tokens=count_tokens) == [0, 4]
+    with pytest.raises(ValueError):
+        select_sources(SOURCES, scores, 3, token_budget=10)
+
+
+def test_selector_follows_overrides():
+    selector = SourceSelector(len)
+    documents = [{"@search.score": s} for s in [1.0, 0.95, 0.9, 0.5, 0.4]]
+    assert selector.retrieval_overrides({"top": 3}) == {"top": 3}
+    assert selector.select(documents, SOURCES, {"top": 3}) == SOURCES
+    assert selector.retrieval_overrides({"top": 3, "mmr": True, "mmr_candidates": 20})["top"] == 20
+    assert selector.select(documents, SOURCES, {"top": 2, "mmr": True}) == [SOURCES[0], SOURCES[3]]
@@ -0,0 +1,132 @@
+import itertools
+import random
+import re
+
+import pytest
+
+from legacytextsplitter import legacy_split_text
+from prepdocslib.textsplitter import Page, TextSplitter
+
+
+class WordEncoding:
+    """Stand-in for a tiktoken encoding where every word with its trailing whitespace is one token."""
+
+    def encode_ordinary(self, text):
+        return re.findall(r"\S+\s*|\s+", text)
+
+    def decode_tokens_bytes(self, tokens):
+        return [t.encode("utf-8") for t in tokens]
+
+
+def make_page_map(pages):
+    page_map = []
+    offset = 0
+    for page_num, text in enumerate(pages):
+        page_map.append((page_num, offset, text))
+        offset += len(text)
+    return page_map
+
+
+def random_pages(seed):
+    rnd = random.Random(seed)
+    words = ["Versicherung", "Schäden", "Zahnersatz", "bis", "zu", "90%", "(inkl.", "Inlays)", "Leistung:", "Tarif", "DS75", "weltweit;", "e-Bike", "{x}", "[1]"]
+    pages = []
+    for _ in range(rnd.randint(1, 8)):
+        parts = []
+        for _ in range(rnd.randint(0, 400)):
+            r = rnd.random()
+            if r < 0.08:
+                parts.append(rnd.choice([".", "!", "?"]))
+            elif r < 0.1:
+                parts.append("<table><tr><td>" + " ".join(rnd.choices(words, k=rnd.randint(5, 120))) + "</td></tr>" + ("</table>" if rnd.random() < 0.5 else ""))
+            elif r < 0.12:
+                parts.append("x" * rnd.randint(50, 300))
+            else:
+                parts.append(rnd.choice(words) + rnd.choice([" ", " ", "\n", ""]))
+        pages.append("".join(parts))
+    return pages
+
+
+@pytest.mark.parametrize("seed", range(39))
+def test_split_pages_matches_legacy_splitter(seed):
+    page_map = make_page_map(random_pages(seed))
+    assert list(TextSplitter().split_pages(page_map)) == list(legacy_split_text(page_map))
+
+
+def test_split_pages_does_not_repeat_sections_after_unclosed_table():
+    # The legacy splitter yields the same section forever for this document
+    page_map = make_page_map(random_pages(39))
+    sections = list(TextSplitter().split_pages(page_map))
+    legacy = list(itertools.islice(legacy_split_text(page_map), len(sections)))
+    assert sections[:10] == legacy[:10]
+    assert legacy[10] == legacy[9]
+    assert sections[10] != sections[9]
+    assert sections[10].content.startswith("<table")
+
+
+@pytest.mark.parametrize("limits", [(200, 20, 30), (50, 10, 5), (1000, 100, 100)])
+def test_split_pages_matches_legacy_splitter_with_other_limits(limits):
+    for seed in range(10):
+        page_map = make_page_map(random_pages(100 + seed))
+        assert list(TextSplitter(*limits).split_pages(page_map)) == list(legacy_split_text(page_map, *limits))
+
+
+def test_split_pages_short_and_empty_documents():
+    assert list(TextSplitter().split_pages([])) == []
+    assert list(TextSplitter().split_pages([Page(0, 0, "Kurz.")])) == list(legacy_split_text([(0, 0, "Kurz.")]))
+
+
+def test_split_pages_finds_pages_with_empty_pages():
+    page_map = make_page_map(["a" * 500 + ". ", "", "", "b" * 1500 + ". ", "c" * 800])
+    sections = list(TextSplitter().split_pages(page_map))
+    assert sections == list(legacy_split_text(page_map))
+    assert [s.page_num for s in sections] == [0, 3, 3]
+
+
+def test_split_pages_by_tokens():
+    text = " ".join(f"Wort{i}" + ("." if i % 17 == 16 else "") for i in range(2000))
+    sections = list(TextSplitter(100, 10, 15, token_encoding=WordEncoding()).split_pages([Page(0, 0, text)]))
+    assert len(sections) > 1
+    for section in sections:
+        # Sections may be extended to the end of a sentence within the search limit
+        assert len(section.content.split()) <= 100 + 10 + 1
+    for previous, section in zip(sections, sections[1:]):
+        # Neighbouring sections overlap by up to the overlap, rounded to whole sentences or words
+        overlap = set(previous.content.split()) & set(section.content.split())
+        assert 0 < len(overlap) <= 15 + 2 * 10
+    assert sections[0].content.startswith("Wort0 ")
+    assert sections[-1].content.rstrip().endswith("Wort1999")
+
+
+def test_split_pages_by_tokens_with_multibyte_characters():
+    text = "Größenänderung über Gebühr. " * 300
+    sections = list(TextSplitter(50, 5, 5, token_encoding=WordEncoding()).split_pages([Page(0, 0, text)]))
+    assert all(section.content.lstrip().startswith("Größenänderung") for section in sections)
+    assert all(len(section.content.split()) <= 50 + 5 + 1 for section in sections)
+
+
+def test_split_pages_streams_pages():
+    read = []
+
+    def pages():
+        for page_num in range(1000):
+            read.append(page_num)
+            yield Page(page_num, 0, f"Seite {page_num} beschreibt die Leistungen des Tarifs. " * 20)
+
+    sections = TextSplitter().split_pages(pages())
+    first = next(sections)
+    assert first.page_num == 0
+    # Only the pages needed to complete the first section have been read
+    assert len(read) <= 2
+    rest = list(sections)
+    assert len(read) == 1000
+    assert rest[-1].page_num == 999
+    expected = list(TextSplitter().split_pages(make_page_map([f"Seite {i} beschreibt die Leistungen des Tarifs. " * 20 for i in range(1000)])))
+    assert [first] + rest == expected
+
+
+def test_split_pages_by_tokens_across_pages():
+    pages = [" ".join(f"Wort{i}-{j}" + ("." if j % 13 == 12 else "") for j in range(rnd)) + " " for i, rnd in enumerate([0, 40, 7, 300, 1, 90] * 5)]
+    splitter = TextSplitter(50, 5, 5, token_encoding=WordEncoding())
+    # Tokenizing page by page gives the same tokens as tokenizing the whole text at once
+    assert [s.content for s in splitter.split_pages(make_page_map(pages))] == [s.content for s in splitter.split_pages([Page(0, 0, "".join(pages))])]
@@ -0,0 +1,69 @@
+import pytest
+from azure.core.credentials import AccessToken
+
+from app.backend.core.tokenmanager import TokenManager
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCredential:
+    """Issues tokens valid for an hour, or fails while failing is set."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.issued = 0
+        self.failing = False
+
+    def get_token(self, scope):
+        if self.failing:
+            raise RuntimeError("Azure AD unavailable")
+        self.issued += 1
+        return AccessToken(f"token-{self.issued}", int(self.clock()) + 3600)
+
+
+def test_refreshes_before_expiry():
+    clock = Clock()
+    published = []
+    manager = TokenManager(FakeCredential(clock), "scope", publish=published.append, clock=clock)
+    manager.refresh()
+    # Nothing to do until the token is due
+    assert manager.step() == 3600 - 300
+    assert manager.token == "token-1" and published == ["token-1"]
+    # Refreshed while the current token has another refresh_margin seconds left
+    clock.now += 3600 - 300
+    manager.step()
+    assert manager.token == "token-2" and manager.expires_on == 1000 + 2 * 3600 - 300
+    assert published[-1] == "token-2"
+
+
+def test_keeps_the_current_token_while_refresh_fails():
+    clock = Clock()
+    credential = FakeCredential(clock)
+    manager = TokenManager(credential, "scope", clock=clock)
+    manager.refresh()
+    clock.now += 3500
+    credential.failing = True
+    assert manager.step() == manager.retry_interval
+    assert manager.token == "token-1" and manager.failures == 1
+    credential.failing = False
+    manager.step()
+    assert manager.token == "token-2"
+
+
+def test_start_and_stop():
+    clock = Clock()
+    manager = TokenManager(FakeCredential(clock), "scope", clock=clock).start()
+    try:
+        assert manager.token == "token-1"
+    finally:
+        manager.stop()
+    credential = FakeCredential(clock)
+    credential.failing = True
+    with pytest.raises(RuntimeError):
+        TokenManager(credential, "scope", clock=clock).start()
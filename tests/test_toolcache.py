@@ -0,0 +1,50 @@
+from app.backend.core.toolcache import MISSING, ToolMemo, ToolResultCache, normalize_query
+from app.backend.core.trace import Trace
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_query():
+    assert normalize_query("  Reise   Storno Kosten? ") == "reise storno kosten"
+    assert normalize_query('"Named after".') == "named after"
+
+
+def test_memo_reuses_results_within_a_run():
+    calls = []
+    trace = Trace()
+    memo = ToolMemo(trace=trace)
+    lookup = lambda: calls.append(1) or None  # noqa: E731
+    assert memo.call("Lookup", "Erstattung", lookup) is None
+    # None is a result too, and the same query written differently is not looked up again
+    assert memo.call("Lookup", "erstattung.", lookup) is None
+    assert memo.call("Search", "Erstattung", lambda: ["p-1.pdf: Ja"], ("text",)) == ["p-1.pdf: Ja"]
+    assert memo.call("Search", "Erstattung", lambda: ["p-2.pdf: Nein"], ("vectors",)) == ["p-2.pdf: Nein"]
+    assert len(calls) == 1 and (memo.calls, memo.run_hits, memo.shared_hits) == (3, 1, 0)
+    memo.summarize()
+    html = trace.to_html()
+    assert "Lookup[erstattung.] answered from an earlier action of this run" in html
+    assert "1 of 4 searches and lookups answered without a remote call" in html
+
+
+def test_memo_shares_results_until_they_expire():
+    clock = Clock()
+    cache = ToolResultCache(ttl=60, clock=clock)
+    ToolMemo(cache).call("Search", "Storno", lambda: ["p-1.pdf: Ja"])
+    memo = ToolMemo(cache, Trace())
+    assert memo.call("Search", "storno", lambda: ["p-2.pdf: Nein"]) == ["p-1.pdf: Ja"]
+    assert memo.shared_hits == 1 and "answered from the tool cache" in memo.trace.to_html()
+    clock.now = 60
+    assert ToolMemo(cache).call("Search", "Storno", lambda: ["p-2.pdf: Nein"]) == ["p-2.pdf: Nein"]
+
+
+def test_result_cache_is_bounded():
+    cache = ToolResultCache(max_entries=2)
+    for i in range(3):
+        cache.set(i, str(i))
+    assert len(cache) == 2 and cache.get(0) is MISSING and cache.get(2) == "2"
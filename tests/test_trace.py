@@ -0,0 +1,28 @@
+from app.backend.core.trace import Trace
+
+
+def test_trace_renders_on_demand():
+    messages = [{"role": "system", "content": "Sources:\n<a.pdf>"}]
+    trace = Trace()
+    trace.section("Searched for", "Storno")
+    trace.messages("Conversations", messages)
+    # Events keep a reference to the messages, nothing is rendered until asked for
+    messages.append({"role": "user", "content": "Sind Stornokosten versichert?"})
+    html = trace.to_html()
+    assert html.startswith("Searched for:<br>Storno<br><br>Conversations:<br>")
+    assert "&lt;a.pdf&gt;" in html and "Stornokosten" in html
+
+
+def test_trace_extend_and_agent_events():
+    trace = Trace()
+    trace.note("The actions depend on each other, running the ReAct agent")
+    other = Trace()
+    other.add("tool_end", "p-1.pdf: Ja", "blue", "Observation: ", "Thought:")
+    other.add("error", "Tool", ValueError("timeout"))
+    trace.extend(other)
+    assert len(trace) == 3
+    html = trace.to_html()
+    assert "running the ReAct agent<br><br>" in html
+    assert "<span style='color:blue'>p-1.pdf: Ja</span>" in html
+    assert "Tool error: timeout" in html
+